@@ -0,0 +1,323 @@
+""" End-to-end throughput benchmark for the posting agents, run against the local stand-in.
+
+Each agent's real async_main() (or main(), with --mode sync) runs --iterations times in its own
+process, with WordPress, OpenAI and NewsAPI all pointed at benchmarks/wp_stub_server.py. The report
+has posts/min, p50/p95/p99 latency per stage and the requests each agent made, and is written as
+JSON (default: benchmarks/results/agents-<timestamp>.json) so runs can be compared over time.
+
+    python benchmarks/bench_agents.py --iterations 20 --llm-latency 0.8 --error-rate 0.02
+
+--posts-per-run K has every run write K posts concurrently; with --llm-rpm/--llm-tpm the stand-in
+answers 429 above those limits, as the OpenAI API does, to exercise the agents' rate limiter.
+
+The agents need their usual dependencies installed (openai, httpx, diffusers, ...); images (diffusion
+for the agents, re-hosted article images for the news agent) stay off unless --with-images is given,
+since image generation dominates everything else.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import functools
+import importlib
+import subprocess
+from collections import defaultdict
+
+import requests
+from wp_stub_server import WP_PREFIX, add_config_arguments, config_from_args, start_stub_server
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+# agent name -> (directory, module, {stage: function in the agent module})
+AGENTS = {
+    "venezart_agent": ("venezart/agent", "agent_venezart_wp", {
+        "generate_text": "gpt_generate_v_post",
+        "image": "render_image",
+        "upload_image": "upload_image",
+    }),
+    "venezart_news": ("venezart/wp_news", "agent_news_wp_venezart", {
+        "fetch_news": "fetch_latest_news",
+        "generate_text": "gpt_generate_post",
+        "image": "upload_article_image_async",
+    }),
+    "coromoto": ("coromoto", "v_wp_agent", {
+        "generate_text": "gpt_generate_v_post",
+    }),
+}
+
+# Stages timed on the WordPress clients, shared by every agent
+CLIENT_STAGES = {
+    "taxonomy": "resolve_terms",
+    "create_post": "create_post",
+    "upload_media": "upload_media_bytes",
+}
+
+
+def percentile(sorted_values, pct):
+    """ Nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(durations):
+    values = sorted(durations)
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else None,
+    }
+
+
+def timed(owner, name, stage, timings):
+    """ Replace owner.name with a wrapper that records each call's duration under stage.
+
+    Raises AttributeError when owner has no such attribute, so a renamed function cannot silently
+    drop its stage from the report.
+    """
+    func = getattr(owner, name)
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                timings[stage].append(time.perf_counter() - start)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings[stage].append(time.perf_counter() - start)
+
+    setattr(owner, name, wrapper)
+
+
+def run_child(agent, mode, iterations, output_path):
+    """ Runs inside the agent's process: import it, instrument it, drive its main path """
+    directory, module_name, stages = AGENTS[agent]
+    agent_dir = os.path.join(REPO_ROOT, directory)
+    sys.path.insert(0, agent_dir)
+    os.chdir(agent_dir)
+
+    timings = defaultdict(list)
+    module = importlib.import_module(module_name)
+    for stage, function in stages.items():
+        timed(module, function, stage, timings)
+
+    import wp_client
+    import async_wp_client
+    import resilience
+    import llm_stream
+    import llm_limiter
+    for stage, method in CLIENT_STAGES.items():
+        timed(wp_client.WordPressClient, method, stage, timings)
+        timed(async_wp_client.AsyncWordPressClient, method, stage, timings)
+
+    announce = llm_stream.TitleStream.announce
+
+    def timed_announce(title_stream, title):
+        # Time from the start of generation until the title has streamed in
+        if title_stream.title is None and title:
+            timings["time_to_title"].append(time.perf_counter() - title_stream.started)
+        announce(title_stream, title)
+
+    llm_stream.TitleStream.announce = timed_announce
+
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        run_start = time.perf_counter()
+        try:
+            if mode == "async":
+                asyncio.run(module.async_main())
+            else:
+                module.main()
+        except Exception as e:
+            errors += 1
+            logger.exception(f"{agent} run failed: {e}")
+        timings["run"].append(time.perf_counter() - run_start)
+    wall = time.perf_counter() - start
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "wall_seconds": wall,
+            "errors": errors,
+            "timings": timings,
+            "http": resilience.metrics.snapshot(),
+            "rate_limiter": llm_limiter.get_rate_limiter().stats(),
+            "llm_routing": module.llm.stats() if hasattr(module.llm, "stats") else None,
+            "post_index": module.post_index.stats() if getattr(module, "post_index", None) else None,
+            # Only imported when an image was rendered
+            "diffusion": sys.modules["pipeline_cache"].get_pipeline_registry().stats()
+            if "pipeline_cache" in sys.modules else None,
+        }, f)
+
+
+def child_environment(base_url, scratch, args):
+    env = dict(os.environ)
+    env.update({
+        "WORDPRESS_URL": f"{base_url}{WP_PREFIX}",
+        "WORDPRESS_USERNAME": "bench",
+        "WORDPRESS_PASSWORD": "bench",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "OLLAMA_HOST": base_url,
+        "LLM_BACKEND": args.llm_backend,
+        "NEWS_API_KEY": "bench",
+        "NEWS_API_URL": f"{base_url}/v2/everything",
+        "WP_TAXONOMY_CACHE": os.path.join(scratch, "wp_taxonomy.json"),
+        "WP_MEDIA_INDEX": os.path.join(scratch, "media_index.json"),
+        # The stand-in starts with few categories; creating the missing ones there is harmless
+        "WP_TERM_CREATE_POLICY": "categories",
+        "LLM_CACHE_PATH": os.path.join(scratch, "llm_cache.json"),
+        "ENABLE_IMAGE_GENERATION": "true" if args.with_images else "false",
+        "REHOST_ARTICLE_IMAGES": "true" if args.with_images else "false",
+        "POSTS_PER_RUN": str(args.posts_per_run),
+        "POST_DEDUP": "true" if args.dedup else "false",
+        "POST_INDEX_DIR": os.path.join(scratch, "post_index"),
+        "PYTHONPATH": os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                    env.get("PYTHONPATH")])),
+    })
+    return env
+
+
+def bench_agent(agent, server, args):
+    """ Run one agent in a fresh process against the stand-in and return its report """
+    requests.post(f"{server.base_url}/__reset")
+    with tempfile.TemporaryDirectory() as scratch:
+        output_path = os.path.join(scratch, "result.json")
+        env = child_environment(server.base_url, scratch, args)
+        # The news agent's image stage is the article image, not diffusion, so it always runs
+        if agent == "venezart_news":
+            env["ENABLE_IMAGE_GENERATION"] = "true"
+
+        command = [sys.executable, os.path.abspath(__file__), "--child", agent, "--mode", args.mode,
+                   "--iterations", str(args.iterations), "--child-output", output_path]
+        completed = subprocess.run(command, env=env, capture_output=not args.verbose, text=True)
+        if completed.returncode != 0 or not os.path.exists(output_path):
+            logger.error(f"{agent} benchmark process failed (exit {completed.returncode})")
+            if completed.stderr:
+                logger.error(completed.stderr[-4000:])
+            return {"failed": True, "exit_code": completed.returncode}
+
+        with open(output_path, encoding="utf-8") as f:
+            child = json.load(f)
+
+    stats = requests.get(f"{server.base_url}/__stats").json()
+    posts = stats["posts_created"]
+    return {
+        "mode": args.mode,
+        "iterations": args.iterations,
+        "errors": child["errors"],
+        "posts": posts,
+        "wall_seconds": child["wall_seconds"],
+        "posts_per_min": posts / child["wall_seconds"] * 60 if child["wall_seconds"] else None,
+        "stages": {stage: summarize(durations) for stage, durations in sorted(child["timings"].items())},
+        "requests": stats["requests"],
+        "requests_per_post": stats["total_requests"] / posts if posts else None,
+        "bytes_in": stats["bytes_in"],
+        "bytes_out": stats["bytes_out"],
+        "injected_errors": stats["injected_errors"],
+        "rate_limited": stats["rate_limited"],
+        "prompt_tokens": stats["prompt_tokens"],
+        "prompt_tokens_per_post": stats["prompt_tokens"] / posts if posts else None,
+        "cached_tokens": stats["cached_tokens"],
+        "prompt_cache_hit_rate": stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else None,
+        "http": child["http"],
+        "rate_limiter": child["rate_limiter"],
+        "llm_routing": child["llm_routing"],
+        "post_index": child["post_index"],
+        "diffusion": child["diffusion"],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_report(report):
+    for agent, result in report["agents"].items():
+        if result.get("failed"):
+            print(f"{agent}: FAILED")
+            continue
+        print(f"{agent} ({result['mode']}): {result['posts']} posts in {result['wall_seconds']:.1f}s "
+              f"= {result['posts_per_min']:.1f} posts/min, {result['requests_per_post'] or 0:.1f} requests/post, "
+              f"{result['prompt_tokens_per_post'] or 0:.0f} input tokens/post "
+              f"({result['prompt_cache_hit_rate'] or 0:.0%} cached)")
+        for stage, summary in result["stages"].items():
+            print(f"  {stage:<14} n={summary['count']:<4} p50={summary['p50'] * 1000:8.1f}ms "
+                  f"p95={summary['p95'] * 1000:8.1f}ms p99={summary['p99'] * 1000:8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--agents", default=",".join(AGENTS), help="Comma-separated agents to run")
+    parser.add_argument("--mode", choices=["async", "sync"], default="async")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--posts-per-run", type=int, default=1, help="Posts each agent run writes concurrently")
+    parser.add_argument("--llm-backend", choices=["openai", "ollama", "auto"], default="openai",
+                        help="Completion backend the agents use (auto routes between the two)")
+    parser.add_argument("--with-images", action="store_true", help="Also render images and re-host article images")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Skip near-duplicate topics and posts (the stand-in writes the same post every time)")
+    parser.add_argument("--output", default=None, help="Results file (default: benchmarks/results/agents-<timestamp>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Show the agents' own log output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.mode, args.iterations, args.child_output)
+        return
+
+    config = config_from_args(args)
+    server = start_stub_server(config=config)
+    report = {
+        "benchmark": "agents",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "python": sys.version.split()[0],
+        "stub": config.as_dict(),
+        "agents": {},
+    }
+    try:
+        for agent in args.agents.split(","):
+            logger.info(f"Benchmarking {agent} ({args.mode}, {args.iterations} iterations)...")
+            report["agents"][agent] = bench_agent(agent, server, args)
+    finally:
+        server.shutdown()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"agents-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    logger.info(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+""" CPU image generation benchmark: seconds per image and peak memory for each dtype, thread count and batch size.
+
+Every configuration runs in a fresh process started in the agent's directory, with the diffusion
+pipeline forced onto the CPU (DIFFUSION_DEVICE=cpu): the model is loaded once, then --images images
+are rendered through the agent's own render_prompt, one call per image, or with a batch size above
+1 through render_prompts, that many images per pipeline call. The report has the load time, the
+median seconds per image, the images per hour that makes, and the peak resident memory of the
+process, and is written as JSON (default: benchmarks/results/image-cpu-<timestamp>.json), to size
+CPU boxes to a posting rate.
+
+    python benchmarks/bench_image_cpu.py --dtypes float32,bfloat16 --threads 4,8 --steps 20 --images 3
+    python benchmarks/bench_image_cpu.py --dtypes float32 --batch-sizes 1,4 --images 8
+
+The agent's model is downloaded on first use unless --model names one already in the Hugging Face
+cache; torch and diffusers must be installed.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import statistics
+import subprocess
+
+from bench_agents import AGENTS, REPO_ROOT, RESULTS_DIR, git_revision
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PROMPT = "A bright watercolor of a city skyline at dawn, soft light, detailed, wide shot"
+
+
+def peak_rss_mb():
+    """ Peak resident memory of this process (ru_maxrss is KiB on Linux, bytes on macOS) """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_child(args):
+    """ Render in this process and print the measurements as JSON on the last line of stdout """
+    sys.path.insert(0, os.getcwd())
+    import torch
+    from generate_image import MODEL_ID, render_prompt, render_prompts
+    from pipeline_cache import get_pipeline, inference_device
+
+    model_id = args.model or MODEL_ID
+    device, dtype = inference_device()
+    started = time.perf_counter()
+    get_pipeline(model_id, device, dtype)
+    load_seconds = time.perf_counter() - started
+    rss_after_load = peak_rss_mb()
+
+    if args.batch_size > 1:
+        # One render_prompts call; every image is charged its share of the whole run
+        started = time.perf_counter()
+        results = render_prompts([(PROMPT, index) for index in range(args.images)], steps=args.steps, width=args.size,
+                                 height=args.size, model_id=model_id, batch_size=args.batch_size)
+        if not all(results):
+            raise SystemExit("Rendering failed")
+        seconds = [(time.perf_counter() - started) / args.images] * args.images
+    else:
+        seconds = []
+        for index in range(args.images):
+            started = time.perf_counter()
+            image = render_prompt(PROMPT, seed=index, steps=args.steps, width=args.size, height=args.size,
+                                  model_id=model_id)
+            if image is None:
+                raise SystemExit("Rendering failed")
+            seconds.append(time.perf_counter() - started)
+
+    print(json.dumps({
+        "model": model_id, "device": device, "dtype": dtype, "threads": torch.get_num_threads(),
+        "load_seconds": load_seconds, "image_seconds": seconds,
+        "peak_rss_after_load_mb": rss_after_load, "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def bench_configuration(args, dtype, threads, batch_size):
+    directory = AGENTS[args.agent][0]
+    env = dict(os.environ, DIFFUSION_DEVICE="cpu", DIFFUSION_CPU_DTYPE=dtype, DIFFUSION_THREADS=str(threads),
+               DIFFUSION_CPU_STEPS=str(args.steps), PYTHONDONTWRITEBYTECODE="1")
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--steps", str(args.steps),
+               "--images", str(args.images), "--size", str(args.size), "--batch-size", str(batch_size)]
+    if args.model:
+        command += ["--model", args.model]
+    completed = subprocess.run(command, cwd=os.path.join(REPO_ROOT, directory), env=env,
+                               capture_output=not args.verbose, text=True)
+    lines = (completed.stdout or "").strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        logger.error(f"{dtype} with {threads} threads, batches of {batch_size}, failed (exit {completed.returncode})")
+        if completed.stderr:
+            logger.error(completed.stderr[-4000:])
+        return {"failed": True, "exit_code": completed.returncode}
+
+    child = json.loads(lines[-1])
+    per_image = statistics.median(child["image_seconds"])
+    return dict(child, seconds_per_image=per_image, images_per_hour=3600 / per_image if per_image else None)
+
+
+def print_report(report):
+    for result in report["configurations"]:
+        if result.get("failed"):
+            print(f"{result['dtype']} x{result['threads']} batch {result['batch_size']}: FAILED")
+            continue
+        print(f"{result['dtype']:<9} {result['threads']:>3} threads, batch {result['batch_size']:>2}: "
+              f"{result['seconds_per_image']:7.1f}s/image "
+              f"({result['images_per_hour']:.0f}/hour), load {result['load_seconds']:.1f}s, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--agent", default="venezart_agent", choices=sorted(AGENTS),
+                        help="Agent whose generate_image (model and settings) is used")
+    parser.add_argument("--model", default=None, help="Diffusion model to load instead of the agent's")
+    parser.add_argument("--dtypes", default="float32,bfloat16", help="Comma-separated CPU dtypes")
+    parser.add_argument("--threads", default=str(os.cpu_count() or 1), help="Comma-separated torch thread counts")
+    parser.add_argument("--steps", type=int, default=20, help="Inference steps per image")
+    parser.add_argument("--images", type=int, default=3, help="Images rendered per configuration")
+    parser.add_argument("--batch-sizes", default="1",
+                        help="Comma-separated images per pipeline call; 1 renders them one call at a time")
+    parser.add_argument("--size", type=int, default=512, help="Image width and height in pixels")
+    parser.add_argument("--output", default=None,
+                        help="Results file (default: benchmarks/results/image-cpu-<timestamp>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Show the rendering processes' own output")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--batch-size", type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    report = {
+        "benchmark": "image-cpu",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "agent": args.agent,
+        "steps": args.steps,
+        "size": args.size,
+        "configurations": [],
+    }
+    for dtype in args.dtypes.split(","):
+        for threads in (int(value) for value in args.threads.split(",")):
+            for batch_size in (int(value) for value in args.batch_sizes.split(",")):
+                logger.info(f"Rendering {args.images} images in {dtype} with {threads} threads, "
+                            f"{batch_size} per pipeline call...")
+                result = bench_configuration(args, dtype, threads, batch_size)
+                report["configurations"].append(dict(result, dtype=dtype, threads=threads, batch_size=batch_size))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"image-cpu-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    logger.info(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+""" Image generation profile benchmark: wall time per image for each generation profile, with the images to compare.
+
+The agent's generate_image is loaded in a fresh process started in its directory; the diffusion
+model is loaded once, then each profile (draft, standard, quality, or --profiles) renders the
+agent's prompt for --topic with seeds 0 .. --images - 1, after one warm-up image. Profiles keep
+their own step counts on the CPU too (the DIFFUSION_CPU_STEPS cap is lifted).
+
+The report has each profile's scheduler, steps and size, the median seconds per image, the speed-up
+over the quality profile and the PSNR of each image against the quality image of the same seed (a
+rough check; the images themselves are what to look at). It is written as JSON (default:
+benchmarks/results/image-profiles-<timestamp>.json) with the images saved next to it, so cutting
+steps with a faster scheduler can be judged side by side:
+
+    python benchmarks/bench_image_profiles.py --agent venezart_agent --images 3
+    python benchmarks/bench_image_profiles.py --profiles standard,quality --topic tech
+
+torch and diffusers must be installed; the agent's model is downloaded on first use.
+"""
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import statistics
+import subprocess
+
+from bench_agents import AGENTS, REPO_ROOT, RESULTS_DIR, git_revision
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def psnr(image, reference):
+    """ Peak signal-to-noise ratio in dB of image against reference, resized to match; None when they are identical """
+    import numpy as np
+
+    pixels = np.asarray(image.convert("RGB"), dtype=np.float64)
+    reference = np.asarray(reference.convert("RGB").resize(image.size), dtype=np.float64)
+    error = np.mean((pixels - reference) ** 2)
+    return 10 * math.log10(255 ** 2 / error) if error else None
+
+
+def run_child(args):
+    """ Render in this process, save the images to --image-dir and print the measurements as JSON on the last line """
+    sys.path.insert(0, os.getcwd())
+    from generate_image import MODEL_ID, image_profile, image_prompt, render_prompt
+    from pipeline_cache import get_pipeline, inference_device
+
+    device, dtype = inference_device()
+    started = time.perf_counter()
+    get_pipeline(MODEL_ID, device, dtype)
+    load_seconds = time.perf_counter() - started
+    prompt = image_prompt(args.topic)
+    os.makedirs(args.image_dir, exist_ok=True)
+
+    profiles, images = {}, {}
+    for name in args.profiles.split(","):
+        settings = image_profile(name)
+        render_prompt(prompt, seed=args.images, **settings)  # Warm-up: first use of the scheduler and size
+
+        seconds, images[name] = [], []
+        for seed in range(args.images):
+            started = time.perf_counter()
+            image = render_prompt(prompt, seed=seed, **settings)
+            if image is None:
+                raise SystemExit(f"Rendering the {name} profile failed")
+            seconds.append(time.perf_counter() - started)
+            image.save(os.path.join(args.image_dir, f"{name}-{seed}.png"))
+            images[name].append(image)
+        profiles[name] = dict(settings, size=list(images[name][0].size), image_seconds=seconds)
+
+    if "quality" in images:
+        for name, rendered in images.items():
+            profiles[name]["psnr_vs_quality"] = [psnr(image, reference)
+                                                 for image, reference in zip(rendered, images["quality"])]
+
+    print(json.dumps({"model": MODEL_ID, "device": device, "dtype": dtype, "prompt": prompt,
+                      "load_seconds": load_seconds, "profiles": profiles}))
+
+
+def print_report(report):
+    reference = report["profiles"].get("quality")
+    for name, result in report["profiles"].items():
+        speedup = f", {result['speedup_vs_quality']:.1f}x quality's speed" if name != "quality" and reference else ""
+        quality = [value for value in result.get("psnr_vs_quality", []) if value is not None]
+        similarity = f", PSNR {statistics.median(quality):.1f} dB vs quality" if quality else ""
+        width, height = result["size"]
+        print(f"{name:<9} {result['scheduler']:<12} {result['steps']:>3} steps {width}x{height}: "
+              f"{result['seconds_per_image']:7.2f}s/image{speedup}{similarity}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--agent", default="venezart_agent", choices=sorted(AGENTS),
+                        help="Agent whose generate_image (model, prompts and profiles) is used")
+    parser.add_argument("--profiles", default="draft,standard,quality", help="Comma-separated generation profiles")
+    parser.add_argument("--topic", default="tech", help="Topic whose image prompt is rendered")
+    parser.add_argument("--images", type=int, default=3, help="Images rendered per profile, one per seed")
+    parser.add_argument("--output", default=None,
+                        help="Results file (default: benchmarks/results/image-profiles-<timestamp>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Show the rendering process's own output")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--image-dir", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    output = args.output or os.path.join(RESULTS_DIR, f"image-profiles-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    image_dir = os.path.splitext(os.path.abspath(output))[0]
+    env = dict(os.environ, DIFFUSION_CPU_STEPS="1000", PYTHONDONTWRITEBYTECODE="1")
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--profiles", args.profiles,
+               "--topic", args.topic, "--images", str(args.images), "--image-dir", image_dir]
+    logger.info(f"Rendering {args.images} images per profile ({args.profiles}) with {args.agent}...")
+    completed = subprocess.run(command, cwd=os.path.join(REPO_ROOT, AGENTS[args.agent][0]), env=env,
+                               capture_output=not args.verbose, text=True)
+    lines = (completed.stdout or "").strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        logger.error(f"Rendering failed (exit {completed.returncode})")
+        if completed.stderr:
+            logger.error(completed.stderr[-4000:])
+        sys.exit(1)
+
+    child = json.loads(lines[-1])
+    for result in child["profiles"].values():
+        result["seconds_per_image"] = statistics.median(result["image_seconds"])
+    reference = child["profiles"].get("quality")
+    if reference:
+        for result in child["profiles"].values():
+            result["speedup_vs_quality"] = reference["seconds_per_image"] / result["seconds_per_image"]
+
+    report = dict(child, benchmark="image-profiles", timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                  git_revision=git_revision(), python=sys.version.split()[0], agent=args.agent,
+                  topic=args.topic, image_dir=image_dir)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    logger.info(f"Results written to {output}, images to {image_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+""" Cold-start benchmark: how long importing each agent module takes, measured with python -X importtime.
+
+Every agent module is imported --repeat times, each in a fresh interpreter started in the agent's
+directory, with no OpenAI key set (importing must not need one). The report has the median import
+time of the agent module, the median wall time of the whole interpreter run, and the direct imports
+of the agent that cost the most, and is written as JSON (default:
+benchmarks/results/imports-<timestamp>.json) so cold starts can be compared over time.
+
+    python benchmarks/bench_import.py --repeat 5
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+from bench_agents import AGENTS, REPO_ROOT, RESULTS_DIR, git_revision
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# import time: self [us] | cumulative | imported package
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)\s*$")
+
+
+def parse_importtime(stderr):
+    """ (module, depth, cumulative seconds) for every line -X importtime wrote, in the order it wrote them """
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append((match.group(4), (len(match.group(3)) - 1) // 2, int(match.group(2)) / 1e6))
+    return entries
+
+
+def direct_imports(entries, module):
+    """ Cumulative time of each module imported directly by module (children are listed before their parent) """
+    children = {}
+    for index, (name, depth, _) in enumerate(entries):
+        if name == module and depth == 0:
+            for child, child_depth, cumulative in reversed(entries[:index]):
+                if child_depth == 0:
+                    break
+                if child_depth == 1:
+                    children[child] = cumulative
+            break
+    return children
+
+
+def child_environment():
+    env = dict(os.environ)
+    env.pop("OPENAI_API_KEY", None)
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def bench_imports(agent, repeat):
+    directory, module_name, _ = AGENTS[agent]
+    agent_dir = os.path.join(REPO_ROOT, directory)
+    import_times, wall_times = [], []
+    children = defaultdict(list)
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+                                   cwd=agent_dir, env=child_environment(), capture_output=True, text=True)
+        wall_times.append(time.perf_counter() - start)
+        if completed.returncode != 0:
+            logger.error(f"Importing {module_name} failed (exit {completed.returncode})")
+            logger.error(completed.stderr[-4000:])
+            return {"failed": True, "exit_code": completed.returncode}
+
+        entries = parse_importtime(completed.stderr)
+        import_times.append(next(cumulative for name, depth, cumulative in entries
+                                 if name == module_name and depth == 0))
+        for child, cumulative in direct_imports(entries, module_name).items():
+            children[child].append(cumulative)
+
+    slowest = sorted(((statistics.median(times), child) for child, times in children.items()), reverse=True)
+    return {
+        "module": module_name,
+        "repeat": repeat,
+        "import_seconds": statistics.median(import_times),
+        "wall_seconds": statistics.median(wall_times),
+        "slowest_imports": {child: seconds for seconds, child in slowest[:10]},
+    }
+
+
+def print_report(report):
+    for agent, result in report["agents"].items():
+        if result.get("failed"):
+            print(f"{agent}: FAILED")
+            continue
+        print(f"{agent}: import {result['module']} {result['import_seconds'] * 1000:.1f}ms, "
+              f"interpreter run {result['wall_seconds'] * 1000:.1f}ms (median of {result['repeat']})")
+        for child, seconds in result["slowest_imports"].items():
+            print(f"  {child:<28} {seconds * 1000:8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--agents", default=",".join(AGENTS), help="Comma-separated agents to import")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per agent")
+    parser.add_argument("--output", default=None, help="Results file (default: benchmarks/results/imports-<timestamp>.json)")
+    args = parser.parse_args()
+
+    report = {
+        "benchmark": "imports",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "python": sys.version.split()[0],
+        "agents": {},
+    }
+    for agent in args.agents.split(","):
+        logger.info(f"Timing the import of {agent} ({args.repeat} runs)...")
+        report["agents"][agent] = bench_imports(agent, args.repeat)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"imports-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report)
+    logger.info(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
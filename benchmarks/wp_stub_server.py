@@ -0,0 +1,789 @@
+""" Local stand-in for the services the agents talk to, for load tests and benchmarks.
+
+Serves, on one port:
+  /wp-json/wp/v2/categories, /tags   GET (slug, slug[], per_page, _fields) and POST (create)
+  /wp-json/wp/v2/posts               POST
+  /wp-json/wp/v2/media               POST (raw body, Content-Length or chunked)
+  /wp-json/batch/v1                  POST (up to 25 requests, 207 Multi-Status)
+  /v1/chat/completions               OpenAI-compatible chat completions (plain or streamed as SSE)
+  /v1/embeddings                     OpenAI-compatible embeddings (hashed words, so equal texts match)
+  /v1/files, /v1/batches             OpenAI Batch API: upload JSONL, create and poll batches, download results
+  /api/chat                          Ollama-compatible local chat (plain or streamed as NDJSON)
+  /v2/everything                     NewsAPI-compatible article search
+  /images/<name>                     image files for the NewsAPI articles
+  /__stats, /__reset                 request counters (GET) and counter reset (POST)
+
+Every route can be slowed down and made to fail at a given rate, so the agents' retry and
+concurrency paths can be exercised without touching the production site. Chat completions report
+cached prompt tokens the way OpenAI's prompt cache does, so prompt layouts can be compared.
+
+Run it on its own with:
+    python benchmarks/wp_stub_server.py --port 8089 --latency 0.05 --error-rate 0.02
+"""
+import re
+import gzip
+import hashlib
+import email.parser
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WP_PREFIX = "/wp-json/wp/v2"
+BATCH_PATH = "/wp-json/batch/v1"
+MAX_BATCH_SIZE = 25
+
+SEED_TERMS = {
+    "categories": ["Blog", "just-release"],
+    "tags": ["art", "blog", "creativity", "3D", "AiArt", "Artists", "ArtLovers", "Artwork", "DigitalArt",
+             "Innovation", "Tech"],
+}
+
+# Padding that makes full (unprojected) objects about as heavy as real WordPress responses
+RENDERED_FILLER = "<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40 + "</p>"
+
+GENERATED_POST = (
+    "Bold Colors and Quiet Lines: How Artists Are Rethinking Digital Canvases\n\n"
+    + "Digital tools keep changing how art gets made and shared. " * 30
+    + "\n\n#art #digitalart #creativity"
+)
+
+# The same post as a structured (JSON schema) reply
+GENERATED_POST_JSON = json.dumps({
+    "title": "Bold Colors and Quiet Lines: How Artists Are Rethinking Digital Canvases",
+    "body_html": "<p>" + "Digital tools keep changing how art gets made and shared. " * 30 + "</p>",
+    "excerpt": "Digital tools keep changing how art gets made and shared.",
+    "tags": ["art", "digital art", "creativity"],
+})
+
+
+class StubConfig:
+    """ Latency (seconds) and error injection for the stand-in """
+
+    def __init__(self, latency=0.0, jitter=0.0, media_latency=None, llm_latency=0.0, llm_first_token=None,
+                 ollama_latency=0.0, news_latency=0.0, batch_latency=2.0, llm_rpm=None, llm_tpm=None, error_rate=0.0,
+                 error_status=503, retry_after=None, error_routes=None, image_size=200 * 1024,
+                 prompt_cache_min_tokens=1024, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.media_latency = latency if media_latency is None else media_latency
+        self.llm_latency = llm_latency
+        # A streamed completion starts after llm_first_token and spends the rest of llm_latency streaming
+        self.llm_first_token = min(llm_latency, 0.1 * llm_latency if llm_first_token is None else llm_first_token)
+        self.ollama_latency = ollama_latency
+        self.news_latency = news_latency
+        # Seconds a Batch API batch stays in progress before its results are ready
+        self.batch_latency = batch_latency
+        # Requests and tokens per minute above which chat completions get 429s, like an OpenAI account
+        self.llm_rpm = llm_rpm
+        self.llm_tpm = llm_tpm
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        # Route prefixes ("posts", "media", "llm", ...) that errors are injected into; None means all
+        self.error_routes = error_routes
+        self.image_size = image_size
+        # Prompts shorter than this are never served from the prompt cache (OpenAI's minimum is 1024 tokens)
+        self.prompt_cache_min_tokens = prompt_cache_min_tokens
+        self.random = random.Random(seed)
+
+    def latency_for(self, route):
+        if route.startswith("llm"):
+            base = self.llm_first_token if route.endswith("stream") else self.llm_latency
+        elif route.startswith("ollama"):
+            base = 0.1 * self.ollama_latency if route.endswith("stream") else self.ollama_latency
+        elif route.startswith("news") or route.startswith("image"):
+            base = self.news_latency
+        elif route.startswith("media"):
+            base = self.media_latency
+        else:
+            base = self.latency
+        return max(0.0, base + self.random.uniform(-self.jitter, self.jitter)) if base else 0.0
+
+    def injects_errors(self, route):
+        if not self.error_rate or route.startswith("stats"):
+            return False
+        return self.error_routes is None or any(route.startswith(prefix) for prefix in self.error_routes)
+
+    def as_dict(self):
+        return {key: value for key, value in vars(self).items() if key != "random"}
+
+
+def project(obj, fields):
+    """ Apply a WordPress _fields projection (top-level keys only) """
+    if not fields:
+        return obj
+    wanted = [field.strip() for field in fields.split(",") if field.strip()]
+    return {key: obj[key] for key in wanted if key in obj}
+
+
+class StubState:
+    """ In-memory site content and request counters, shared by all handler threads """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_id = 1000
+        self.terms = {"categories": {}, "tags": {}}
+        self.posts = {}
+        self.media = {}
+        self.files = {}
+        self.batches = {}
+        self.requests = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.injected_errors = 0
+        self.rate_limited = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        # Hashes of the prompt prefixes seen so far, for the stand-in prompt cache
+        self.prompt_prefixes = set()
+        # (time, tokens) of the chat completions served in the last minute
+        self.llm_window = deque()
+        for taxonomy, names in SEED_TERMS.items():
+            for name in names:
+                self.create_term(taxonomy, name)
+
+    def new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def create_term(self, taxonomy, name, slug=None):
+        slug = slug or re.sub(r"[^a-z0-9_-]+", "-", name.lower()).strip("-")
+        term = {
+            "id": self.new_id(), "count": 0, "description": "", "link": f"http://stub/{taxonomy}/{slug}/",
+            "name": name, "slug": slug, "taxonomy": "category" if taxonomy == "categories" else "post_tag",
+            "parent": 0, "meta": [], "_links": {"self": [{"href": f"http://stub{WP_PREFIX}/{taxonomy}/{slug}"}]},
+        }
+        self.terms[taxonomy][slug] = term
+        return term
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "total_requests": sum(self.requests.values()),
+                "posts_created": len(self.posts),
+                "media_uploaded": len(self.media),
+                "terms_created": sum(len(terms) for terms in self.terms.values())
+                - sum(len(names) for names in SEED_TERMS.values()),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "injected_errors": self.injected_errors,
+                "rate_limited": self.rate_limited,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests.clear()
+            self.posts.clear()
+            self.media.clear()
+            self.bytes_in = self.bytes_out = self.injected_errors = self.rate_limited = self.prompt_tokens = 0
+            self.cached_tokens = 0
+            self.prompt_prefixes.clear()
+            self.llm_window.clear()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "WordPressStub/1.0"
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    # --- plumbing -------------------------------------------------------------------------
+
+    @property
+    def state(self):
+        return self.server.state
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b"".join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with self.state.lock:
+            self.state.bytes_in += len(body)
+        return body
+
+    def send_json(self, status, obj, headers=None):
+        body = json.dumps(obj).encode()
+        self.send_bytes(status, body, "application/json; charset=UTF-8", headers)
+
+    def send_bytes(self, status, body, content_type, headers=None):
+        compressible = content_type.startswith("application/json")
+        if compressible and len(body) > 1024 and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=5)
+            headers = dict(headers or {}, **{"Content-Encoding": "gzip"})
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+        with self.state.lock:
+            self.state.bytes_out += len(body)
+
+    def begin(self, route):
+        """ Count the request, apply latency and maybe inject an error; True if the handler should go on """
+        with self.state.lock:
+            self.state.requests[route] += 1
+        delay = self.config.latency_for(route)
+        if delay:
+            time.sleep(delay)
+        if self.config.injects_errors(route) and self.config.random.random() < self.config.error_rate:
+            with self.state.lock:
+                self.state.injected_errors += 1
+            headers = {"Retry-After": str(self.config.retry_after)} if self.config.retry_after is not None else None
+            self.send_json(self.config.error_status, {"code": "stub_injected_error", "message": "Injected error",
+                                                      "data": {"status": self.config.error_status}}, headers)
+            return False
+        return True
+
+    # --- dispatch -------------------------------------------------------------------------
+
+    def do_HEAD(self):
+        self.route("HEAD")
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def route(self, method):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip("/")
+        body = self.read_body() if method == "POST" else b""
+
+        if path == "/__stats":
+            return self.send_json(200, self.state.stats())
+        if path == "/__reset":
+            self.state.reset_counters()
+            return self.send_json(200, {"reset": True})
+
+        if path in ("/wp-json", WP_PREFIX) or path == "":
+            if self.begin("wp_index " + method):
+                self.send_json(200, {"namespace": "wp/v2", "routes": {}})
+            return
+
+        match = re.match(rf"^{WP_PREFIX}/(categories|tags)$", path)
+        if match:
+            taxonomy = match.group(1)
+            route = f"{taxonomy} {method}"
+            if self.begin(route):
+                status, obj = (self.list_terms(taxonomy, query) if method == "GET"
+                               else self.create_term(taxonomy, json.loads(body or b"{}"), query))
+                self.send_json(status, obj)
+            return
+
+        if path == f"{WP_PREFIX}/posts" and method == "POST":
+            if self.begin("posts POST"):
+                self.send_json(*self.create_post(json.loads(body or b"{}"), query))
+            return
+
+        if path == f"{WP_PREFIX}/media" and method == "POST":
+            if self.begin("media POST"):
+                self.send_json(*self.create_media(body, query))
+            return
+
+        if path == BATCH_PATH and method == "POST":
+            if self.begin("batch POST"):
+                self.send_json(*self.batch(json.loads(body or b"{}")))
+            return
+
+        if path == "/v1/chat/completions" and method == "POST":
+            request = json.loads(body or b"{}")
+            if not request.get("stream"):
+                if self.begin("llm chat.completions") and self.within_rate_limits(request):
+                    self.send_json(200, self.chat_completion(request, self.count_prompt(request)))
+            elif self.begin("llm chat.completions stream") and self.within_rate_limits(request):
+                self.stream_chat_completion(request, self.count_prompt(request))
+            return
+
+        if path == "/v1/embeddings" and method == "POST":
+            if self.begin("llm embeddings"):
+                self.send_json(200, self.embeddings(json.loads(body or b"{}")))
+            return
+
+        if path == "/v1/files" and method == "POST":
+            if self.begin("llm files POST"):
+                self.send_json(*self.upload_file(body))
+            return
+
+        match = re.match(r"^/v1/files/([\w-]+)/content$", path)
+        if match:
+            if self.begin("llm files content"):
+                content = self.state.files.get(match.group(1), {}).get("content")
+                if content is None:
+                    self.send_json(404, {"error": {"message": "No such file", "type": "invalid_request_error"}})
+                else:
+                    self.send_bytes(200, content, "application/octet-stream")
+            return
+
+        if path == "/v1/batches" and method == "POST":
+            if self.begin("llm batches POST"):
+                self.send_json(*self.create_batch(json.loads(body or b"{}")))
+            return
+
+        match = re.match(r"^/v1/batches/([\w-]+)$", path)
+        if match:
+            if self.begin("llm batches GET"):
+                self.send_json(*self.retrieve_batch(match.group(1)))
+            return
+
+        if path == "/api/chat" and method == "POST":
+            request = json.loads(body or b"{}")
+            if not request.get("stream", True):
+                if self.begin("ollama chat"):
+                    self.count_prompt(request)
+                    self.send_json(200, self.ollama_message(request, self.generated_reply(request), done=True))
+            elif self.begin("ollama chat stream"):
+                self.count_prompt(request)
+                self.stream_ollama_chat(request)
+            return
+
+        if path == "/v2/everything":
+            if self.begin("news everything"):
+                self.send_json(200, self.news(query))
+            return
+
+        if path.startswith("/images/"):
+            if self.begin("image GET"):
+                self.send_bytes(200, self.image_bytes(path), "image/jpeg")
+            return
+
+        self.send_json(404, {"code": "rest_no_route", "message": "No route was found matching the URL and request method.",
+                             "data": {"status": 404}})
+
+    # --- WordPress ------------------------------------------------------------------------
+
+    def list_terms(self, taxonomy, query):
+        slugs = query.get("slug[]", []) + [slug for value in query.get("slug", []) for slug in value.split(",")]
+        per_page = int(query.get("per_page", ["10"])[0])
+        if per_page > 100:
+            return 400, {"code": "rest_invalid_param", "message": "Invalid parameter(s): per_page", "data": {"status": 400}}
+        fields = query.get("_fields", [None])[0]
+        with self.state.lock:
+            terms = self.state.terms[taxonomy]
+            found = [terms[slug] for slug in slugs if slug in terms] if slugs else list(terms.values())
+        return 200, [project(term, fields) for term in found[:per_page]]
+
+    def create_term(self, taxonomy, body, query):
+        name = body.get("name")
+        if not name:
+            return 400, {"code": "rest_missing_callback_param", "message": "Missing parameter(s): name",
+                         "data": {"status": 400, "params": ["name"]}}
+        with self.state.lock:
+            existing = next((t for t in self.state.terms[taxonomy].values() if t["name"] == name), None)
+            if existing:
+                return 400, {"code": "term_exists", "message": "A term with the name provided already exists.",
+                             "data": {"status": 400, "term_id": existing["id"]}}
+            term = self.state.create_term(taxonomy, name, body.get("slug"))
+        return 201, project(term, query.get("_fields", [None])[0])
+
+    def create_post(self, body, query):
+        with self.state.lock:
+            for taxonomy in ("categories", "tags"):
+                known = {term["id"] for term in self.state.terms[taxonomy].values()}
+                unknown = [term_id for term_id in body.get(taxonomy, []) if term_id not in known]
+                if unknown:
+                    return 400, {"code": "rest_invalid_param", "message": f"Invalid parameter(s): {taxonomy}",
+                                 "data": {"status": 400, "params": {taxonomy: "Invalid term ID."}}}
+            featured = body.get("featured_media")
+            if featured and featured not in self.state.media:
+                return 400, {"code": "rest_invalid_featured_media", "message": "Invalid featured media ID.",
+                             "data": {"status": 400, "params": {"featured_media": "Invalid featured media ID."}}}
+            post_id = self.state.new_id()
+            post = {
+                "id": post_id, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "slug": f"post-{post_id}",
+                "status": body.get("status", "draft"), "type": "post", "link": f"http://stub/?p={post_id}",
+                "title": {"raw": body.get("title", ""), "rendered": body.get("title", "")},
+                "content": {"raw": body.get("content", ""), "rendered": f"<p>{body.get('content', '')}</p>" + RENDERED_FILLER},
+                "excerpt": {"rendered": RENDERED_FILLER}, "featured_media": featured or 0,
+                "categories": body.get("categories", []), "tags": body.get("tags", []),
+                "_links": {"self": [{"href": f"http://stub{WP_PREFIX}/posts/{post_id}"}]},
+            }
+            self.state.posts[post_id] = post
+        return 201, project(post, query.get("_fields", [None])[0])
+
+    def create_media(self, body, query):
+        disposition = self.headers.get("Content-Disposition", "")
+        match = re.search(r'filename="?([^";]+)"?', disposition)
+        if not match or not body:
+            return 400, {"code": "rest_upload_no_data", "message": "No data supplied.", "data": {"status": 400}}
+        with self.state.lock:
+            media_id = self.state.new_id()
+            media = {
+                "id": media_id, "source_url": f"http://stub/wp-content/uploads/{media_id}-{match.group(1)}",
+                "mime_type": self.headers.get("Content-Type"), "media_details": {"filesize": len(body), "sizes": {}},
+                "description": {"rendered": RENDERED_FILLER},
+                "_links": {"self": [{"href": f"http://stub{WP_PREFIX}/media/{media_id}"}]},
+            }
+            self.state.media[media_id] = media
+        return 201, project(media, query.get("_fields", [None])[0])
+
+    def batch(self, body):
+        requests = body.get("requests", [])
+        if len(requests) > MAX_BATCH_SIZE:
+            return 400, {"code": "rest_batch_max_requests", "data": {"status": 400}}
+
+        responses = []
+        for request in requests:
+            url = urlparse(request.get("path", ""))
+            query = parse_qs(url.query)
+            path = url.path.rstrip("/")
+            match = re.match(r"^/wp/v2/(categories|tags|posts)$", path)
+            with self.state.lock:
+                self.state.requests[f"batch:{match.group(1) if match else 'unknown'} {request.get('method')}"] += 1
+            if not match:
+                status, obj = 404, {"code": "rest_no_route", "data": {"status": 404}}
+            elif match.group(1) == "posts":
+                status, obj = self.create_post(request.get("body") or {}, query)
+            else:
+                status, obj = self.create_term(match.group(1), request.get("body") or {}, query)
+            responses.append({"status": status, "headers": {}, "body": obj})
+        return 207, {"responses": responses}
+
+    # --- OpenAI and NewsAPI ---------------------------------------------------------------
+
+    def generated_reply(self, body):
+        """ The post in the format the request asks for: JSON for a json_schema response_format (or Ollama format) """
+        structured = (body.get("response_format") or {}).get("type") == "json_schema" or isinstance(body.get("format"), dict)
+        return GENERATED_POST_JSON if structured else GENERATED_POST
+
+    def completion_usage(self, body, cached_tokens=0):
+        prompt = " ".join(str(message.get("content", "")) for message in body.get("messages", []))
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = max(1, len(self.generated_reply(body)) // 4)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)}}
+
+    def cache_prompt(self, body, step=128):
+        """ Tokens of the prompt served from the prompt cache, which then holds this prompt too.
+
+        As with OpenAI, a hit is the longest prefix, in steps of step tokens from
+        prompt_cache_min_tokens on, that an earlier request to the same model started with.
+        """
+        prompt = "".join(f"{message.get('role')}: {message.get('content', '')}\n" for message in body.get("messages", []))
+        first = max(step, self.config.prompt_cache_min_tokens)
+        boundaries = range(first * 4, len(prompt) + 1, step * 4)
+        keys = [hashlib.sha1(f"{body.get('model')}\0{prompt[:end]}".encode()).hexdigest() for end in boundaries]
+        with self.state.lock:
+            cached = max((end // 4 for end, key in zip(boundaries, keys) if key in self.state.prompt_prefixes), default=0)
+            self.state.prompt_prefixes.update(keys)
+        return cached
+
+    def count_prompt(self, body):
+        """ Add the prompt of a completion that is being served to the input token totals; returns its cached tokens """
+        cached = self.cache_prompt(body)
+        usage = self.completion_usage(body, cached)
+        with self.state.lock:
+            self.state.prompt_tokens += usage["prompt_tokens"]
+            self.state.cached_tokens += usage["prompt_tokens_details"]["cached_tokens"]
+        return cached
+
+    def within_rate_limits(self, body):
+        """ Count the completion against --llm-rpm/--llm-tpm, or answer 429 and return False if it does not fit """
+        if not self.config.llm_rpm and not self.config.llm_tpm:
+            return True
+        tokens = self.completion_usage(body)["total_tokens"]
+        with self.state.lock:
+            now = time.monotonic()
+            window = self.state.llm_window
+            while window and now - window[0][0] >= 60:
+                window.popleft()
+            over_requests = self.config.llm_rpm and len(window) + 1 > self.config.llm_rpm
+            over_tokens = self.config.llm_tpm and sum(used for _, used in window) + tokens > self.config.llm_tpm
+            if not (over_requests or over_tokens):
+                window.append((now, tokens))
+                return True
+            self.state.rate_limited += 1
+            retry_after = max(1, int(60 - (now - window[0][0])) + 1) if window else 1
+        limit = "requests" if over_requests else "tokens"
+        self.send_json(429, {"error": {"message": f"Rate limit reached for {limit} per min", "type": limit,
+                                       "code": "rate_limit_exceeded"}}, {"retry-after": str(retry_after)})
+        return False
+
+    def chat_completion(self, body, cached_tokens=0):
+        return {
+            "id": f"chatcmpl-stub-{time.monotonic_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self.generated_reply(body)},
+                         "finish_reason": "stop", "logprobs": None}],
+            "usage": self.completion_usage(body, cached_tokens),
+        }
+
+    def embeddings(self, body, dim=256):
+        """ Deterministic stand-in embeddings: each word adds to a bucket picked by its hash """
+        texts = body.get("input") or []
+        texts = [texts] if isinstance(texts, str) else texts
+        data = []
+        for index, text in enumerate(texts):
+            vector = [0.0] * dim
+            for word in re.findall(r"\w+", text.lower()):
+                vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dim] += 1.0
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(len(text) // 4 for text in texts)
+        return {"object": "list", "data": data, "model": body.get("model", "stub"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    def stream_chat_completion(self, body, cached_tokens=0):
+        """ Send the completion as server-sent events, a few words per chunk, over the rest of llm_latency """
+        words = re.findall(r"\S+\s*|\s+", self.generated_reply(body))
+        pieces = ["".join(words[index:index + 4]) for index in range(0, len(words), 4)]
+        delay = max(0.0, self.config.llm_latency - self.config.llm_first_token) / len(pieces)
+        completion_id = f"chatcmpl-stub-{time.monotonic_ns()}"
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+        def event(delta, finish_reason=None, usage=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": body.get("model", "stub"),
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}]}
+            if usage is not None:
+                chunk["choices"] = []
+            if include_usage:
+                chunk["usage"] = usage
+            return f"data: {json.dumps(chunk)}\n\n".encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = [event({"role": "assistant", "content": ""})]
+        events += [event({"content": piece}) for piece in pieces]
+        events += [event({}, "stop")]
+        if include_usage:
+            events.append(event({}, usage=self.completion_usage(body, cached_tokens)))
+        events.append(b"data: [DONE]\n\n")
+        for index, data in enumerate(events):
+            if delay and 1 < index <= len(pieces):
+                time.sleep(delay)
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            with self.state.lock:
+                self.state.bytes_out += len(data)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def ollama_message(self, body, content, done):
+        message = {"model": body.get("model", "stub"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                   "message": {"role": "assistant", "content": content}, "done": done}
+        if done:
+            usage = self.completion_usage(body)
+            message.update(done_reason="stop", prompt_eval_count=usage["prompt_tokens"],
+                           eval_count=usage["completion_tokens"])
+        return message
+
+    def stream_ollama_chat(self, body):
+        """ Send the reply as Ollama does: one JSON object per line, the last one with done set """
+        words = re.findall(r"\S+\s*|\s+", self.generated_reply(body))
+        pieces = ["".join(words[index:index + 4]) for index in range(0, len(words), 4)]
+        delay = 0.9 * self.config.ollama_latency / len(pieces)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        lines = [self.ollama_message(body, piece, done=False) for piece in pieces]
+        lines.append(self.ollama_message(body, "", done=True))
+        for index, line in enumerate(lines):
+            if delay and 0 < index < len(pieces):
+                time.sleep(delay)
+            data = json.dumps(line).encode() + b"\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            with self.state.lock:
+                self.state.bytes_out += len(data)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def upload_file(self, body):
+        """ Store the file part of a multipart/form-data upload """
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode() + body
+        )
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.get_payload()}
+        part = fields.get("file")
+        if part is None:
+            return 400, {"error": {"message": "Missing file", "type": "invalid_request_error"}}
+        content = part.get_payload(decode=True)
+        purpose = fields["purpose"].get_payload(decode=True).decode() if "purpose" in fields else "batch"
+        return 200, self.store_file(content, part.get_filename() or "upload.jsonl", purpose)
+
+    def store_file(self, content, filename, purpose):
+        with self.state.lock:
+            file_id = f"file-stub{self.state.new_id()}"
+            record = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                      "filename": filename, "purpose": purpose, "status": "processed"}
+            self.state.files[file_id] = dict(record, content=content)
+        return record
+
+    def create_batch(self, body):
+        input_file = self.state.files.get(body.get("input_file_id"))
+        if input_file is None:
+            return 400, {"error": {"message": "Invalid input_file_id", "type": "invalid_request_error"}}
+        now = int(time.time())
+        with self.state.lock:
+            batch = {
+                "id": f"batch_stub{self.state.new_id()}", "object": "batch", "endpoint": body.get("endpoint"),
+                "errors": None, "input_file_id": input_file["id"], "completion_window": body.get("completion_window"),
+                "status": "in_progress", "output_file_id": None, "error_file_id": None, "created_at": now,
+                "in_progress_at": now, "expires_at": now + 24 * 3600, "completed_at": None,
+                "request_counts": {"total": len(input_file["content"].splitlines()), "completed": 0, "failed": 0},
+                "metadata": body.get("metadata"),
+            }
+            self.state.batches[batch["id"]] = batch
+        return 200, batch
+
+    def retrieve_batch(self, batch_id):
+        batch = self.state.batches.get(batch_id)
+        if batch is None:
+            return 404, {"error": {"message": "No such batch", "type": "invalid_request_error"}}
+        with self.state.lock:
+            ready = batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.config.batch_latency
+            if ready:
+                batch["status"] = "finalizing"
+        if ready:
+            self.complete_batch(batch)
+        return 200, batch
+
+    def complete_batch(self, batch):
+        """ Answer every request in the batch's input file and attach the results as its output file """
+        lines = []
+        for line in self.state.files[batch["input_file_id"]]["content"].decode().splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            body = request.get("body") or {}
+            lines.append(json.dumps({
+                "id": f"batch_req_{self.state.new_id()}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": f"req_{self.state.new_id()}",
+                             "body": self.chat_completion(body, self.cache_prompt(body))},
+                "error": None,
+            }))
+        output = self.store_file("\n".join(lines).encode() + b"\n", f"{batch['id']}_output.jsonl", "batch_output")
+        batch.update(status="completed", output_file_id=output["id"], completed_at=int(time.time()),
+                     request_counts={"total": len(lines), "completed": len(lines), "failed": 0})
+        with self.state.lock:
+            self.state.requests["llm batch requests"] += len(lines)
+
+    def news(self, query):
+        host = self.headers.get("Host", "127.0.0.1")
+        topic = query.get("q", ["news"])[0]
+        articles = []
+        for index in range(20):
+            articles.append({
+                "source": {"id": None, "name": "Stub News"},
+                "author": "Stub Author",
+                "title": f"{topic.title()} story number {index}",
+                "description": f"What happened in {topic} today, part {index}.",
+                "url": f"http://{host}/articles/{index}",
+                "urlToImage": f"http://{host}/images/{topic.replace(' ', '-')}-{index}.jpg",
+                "publishedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                # NewsAPI cuts the content off at 200 characters and says how much is left
+                "content": (f"<p>Full text about {topic}.</p> " * 10)[:200] + " [+2817 chars]",
+            })
+        return {"status": "ok", "totalResults": len(articles), "articles": articles}
+
+    def image_bytes(self, path):
+        # Deterministic per path, so the same article image always has the same bytes
+        rng = random.Random(path)
+        return b"\xff\xd8\xff\xe0" + bytes(rng.getrandbits(8) for _ in range(self.config.image_size))
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config=None):
+        super().__init__(address, StubHandler)
+        self.config = config or StubConfig()
+        self.state = StubState()
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+def start_stub_server(host="127.0.0.1", port=0, config=None):
+    """ Start the stand-in on a background thread and return the server (see StubServer.base_url) """
+    server = StubServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"WordPress stand-in listening on {server.base_url}")
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.02, help="WordPress response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter added to every latency")
+    parser.add_argument("--media-latency", type=float, default=None, help="Latency of media uploads (default: --latency)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Latency of chat completions")
+    parser.add_argument("--llm-first-token", type=float, default=None,
+                        help="Time to the first streamed token (default: a tenth of --llm-latency)")
+    parser.add_argument("--ollama-latency", type=float, default=2.0, help="Latency of local (Ollama) chat completions")
+    parser.add_argument("--news-latency", type=float, default=0.1, help="Latency of NewsAPI and image downloads")
+    parser.add_argument("--batch-latency", type=float, default=2.0, help="Time until a Batch API batch completes")
+    parser.add_argument("--llm-rpm", type=float, default=None, help="Chat completions per minute before 429s")
+    parser.add_argument("--llm-tpm", type=float, default=None, help="Chat completion tokens per minute before 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After sent with injected errors")
+    parser.add_argument("--error-routes", default=None,
+                        help="Comma-separated routes to inject errors into, e.g. posts,media,batch (default: all)")
+    parser.add_argument("--image-size", type=int, default=200 * 1024, help="Size of served article images in bytes")
+    parser.add_argument("--prompt-cache-min-tokens", type=int, default=1024,
+                        help="Shortest prompt served from the prompt cache (OpenAI: 1024 tokens)")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args):
+    return StubConfig(
+        latency=args.latency, jitter=args.jitter, media_latency=args.media_latency, llm_latency=args.llm_latency,
+        llm_first_token=args.llm_first_token, ollama_latency=args.ollama_latency, news_latency=args.news_latency,
+        batch_latency=args.batch_latency, llm_rpm=args.llm_rpm, llm_tpm=args.llm_tpm, error_rate=args.error_rate,
+        error_status=args.error_status, retry_after=args.retry_after,
+        error_routes=args.error_routes.split(",") if args.error_routes else None, image_size=args.image_size,
+        prompt_cache_min_tokens=args.prompt_cache_min_tokens, seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), config_from_args(args))
+    logger.info(f"WordPress stand-in listening on {server.base_url} (WORDPRESS_URL={server.base_url}{WP_PREFIX})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
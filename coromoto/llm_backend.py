@@ -0,0 +1,179 @@
+import os
+import time
+import logging
+import threading
+
+from authenticate import get_openai_client
+from llm_stream import TitleStream, complete_text, streaming_enabled
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class OpenAIBackend:
+    """ Chat completions from the OpenAI API, paced by the process-wide rate limiter.
+
+    Without a client, the process-wide one is created on the first completion.
+    """
+
+    def __init__(self, model, client=None):
+        self._client = client
+        self.model = model
+        self.model_id = model
+
+    @property
+    def client(self):
+        return self._client or get_openai_client()
+
+    def complete(self, messages, title_stream=None, response_format=None):
+        return complete_text(self.client, self.model, messages, title_stream, response_format)
+
+    def answered_by(self):
+        """ The model_id of the backend that wrote the last completion on this thread """
+        return self.model_id
+
+
+class OllamaBackend:
+    """ Chat completions from a local Ollama server (host defaults to OLLAMA_HOST or localhost:11434) """
+
+    def __init__(self, model, host=None):
+        self.host = host
+        self.model = model
+        self.model_id = f"ollama:{model}"
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import ollama  # Only needed once a local completion is requested
+
+            self._client = ollama.Client(host=self.host)
+        return self._client
+
+    def complete(self, messages, title_stream=None, response_format=None):
+        # Ollama takes the JSON schema itself as format
+        options = {"format": response_format["json_schema"]["schema"]} if response_format else {}
+        if not streaming_enabled():
+            text = self.client.chat(model=self.model, messages=messages, **options)["message"]["content"]
+            if title_stream and text:
+                title_stream.feed(text)
+            return text
+
+        title_stream = title_stream or TitleStream(lambda lines: None)
+        for chunk in self.client.chat(model=self.model, messages=messages, stream=True, **options):
+            if chunk["message"]["content"]:
+                title_stream.feed(chunk["message"]["content"])
+        return title_stream.text()
+
+    def answered_by(self):
+        """ The model_id of the backend that wrote the last completion on this thread """
+        return self.model_id
+
+
+class LatencyRouter:
+    """ Sends completions to primary, and to fallback while primary is slow, saturated or failing.
+
+    primary counts as slow when the moving average of its completion times is above max_latency
+    seconds, and as saturated when max_in_flight of its requests are already running or waiting
+    for the rate limiter. After routing away for being slow or failing, primary is tried again once
+    cooldown seconds have passed, so a recovered remote API takes the work back.
+
+    model_id is primary's; answered_by() tells which of the two wrote a completion, so the LLM
+    cache can keep fallback answers apart from primary ones.
+    """
+
+    def __init__(self, primary, fallback, max_latency=20.0, max_in_flight=8, cooldown=60.0, smoothing=0.3):
+        self.primary = primary
+        self.fallback = fallback
+        self.model_id = primary.model_id
+        self.max_latency = max_latency
+        self.max_in_flight = max_in_flight
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.latency = None
+        self.in_flight = 0
+        self.avoid_until = 0.0
+        self.routed = {"primary": 0, "fallback": 0}
+        self._lock = threading.Lock()
+        self._answered = threading.local()
+
+    def _use_primary(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.in_flight >= self.max_in_flight or now < self.avoid_until:
+                self.routed["fallback"] += 1
+                return False
+            if self.latency is not None and self.latency > self.max_latency:
+                # Cooldown over: give primary one request to show it has recovered
+                self.latency = None
+            self.in_flight += 1
+            self.routed["primary"] += 1
+            return True
+
+    def _finished(self, elapsed=None):
+        with self._lock:
+            self.in_flight -= 1
+            if elapsed is None:
+                self.avoid_until = time.monotonic() + self.cooldown
+                return
+            self.latency = elapsed if self.latency is None else (
+                self.smoothing * elapsed + (1 - self.smoothing) * self.latency
+            )
+            if self.latency > self.max_latency:
+                logger.warning(f"{self.primary.model_id} is averaging {self.latency:.1f}s per completion; "
+                               f"using {self.fallback.model_id} for the next {self.cooldown:.0f}s")
+                self.avoid_until = time.monotonic() + self.cooldown
+
+    def complete(self, messages, title_stream=None, response_format=None):
+        if not self._use_primary():
+            return self._complete_fallback(messages, title_stream, response_format)
+
+        start = time.monotonic()
+        try:
+            text = self.primary.complete(messages, title_stream, response_format)
+        except Exception as e:
+            self._finished()
+            if title_stream is not None and title_stream.text():
+                raise  # Part of the post has already been streamed to listeners
+            logger.warning(f"{self.primary.model_id} failed ({e}); falling back to {self.fallback.model_id}")
+            return self._complete_fallback(messages, title_stream, response_format)
+        self._finished(time.monotonic() - start)
+        self._answered.model_id = self.primary.model_id
+        return text
+
+    def _complete_fallback(self, messages, title_stream, response_format):
+        self._answered.model_id = self.fallback.model_id
+        return self.fallback.complete(messages, title_stream, response_format)
+
+    def answered_by(self):
+        """ The model_id of the backend that wrote the last completion on this thread """
+        return getattr(self._answered, "model_id", self.model_id)
+
+    def stats(self):
+        return dict(self.routed, latency=self.latency, in_flight=self.in_flight)
+
+
+def get_backend(agent_name, model, openai_client=None):
+    """ The completion backend for an agent: LLM_BACKEND_<AGENT_NAME>, else LLM_BACKEND (openai, ollama or auto).
+
+    auto routes between OpenAI and the local Ollama model (OLLAMA_MODEL) with a LatencyRouter,
+    tuned by LLM_ROUTER_MAX_LATENCY, LLM_ROUTER_MAX_IN_FLIGHT and LLM_ROUTER_COOLDOWN. No client
+    is created until the first completion, so building the backend at import time is cheap.
+    """
+    choice = os.getenv(f"LLM_BACKEND_{agent_name.upper()}", os.getenv("LLM_BACKEND", "openai")).lower()
+    if choice == "openai":
+        return OpenAIBackend(model, openai_client)
+
+    local = OllamaBackend(os.getenv("OLLAMA_MODEL", "llama3.1"), os.getenv("OLLAMA_HOST"))
+    if choice == "ollama":
+        return local
+    if choice == "auto":
+        return LatencyRouter(
+            OpenAIBackend(model, openai_client),
+            local,
+            max_latency=float(os.getenv("LLM_ROUTER_MAX_LATENCY", "20")),
+            max_in_flight=int(os.getenv("LLM_ROUTER_MAX_IN_FLIGHT", "8")),
+            cooldown=float(os.getenv("LLM_ROUTER_COOLDOWN", "60")),
+        )
+    raise ValueError(f"Unknown LLM backend {choice!r}; expected openai, ollama or auto")
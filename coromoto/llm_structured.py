@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import logging
+
+from llm_stream import TitleStream
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Fields of a generated post; the schema is sent with each request, so the reply always parses as JSON
+POST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "body_html": {"type": "string"},
+        "excerpt": {"type": "string"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["title", "body_html", "excerpt", "tags"],
+    "additionalProperties": False,
+}
+
+# Appended to the post prompt in structured mode; part of the LLM cache key like the prompt itself
+STRUCTURED_INSTRUCTIONS = (
+    "Reply with a JSON object only: title (plain text, no quotes or markdown), body_html (the post content "
+    "as HTML, without the title), excerpt (one or two plain sentences) and tags (3 to 8 short tags)."
+)
+
+# The title string of a JSON post, complete once its closing quote has arrived
+JSON_TITLE = re.compile(r'"title"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+class PostFormatError(ValueError):
+    """ A completion is not a valid structured post """
+
+
+def structured_output_enabled():
+    """ Posts are requested as JSON unless LLM_STRUCTURED_OUTPUT is set to false """
+    return os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() == "true"
+
+
+def post_response_format():
+    """ response_format for a chat completion that must match POST_SCHEMA """
+    return {"type": "json_schema", "json_schema": {"name": "blog_post", "strict": True, "schema": POST_SCHEMA}}
+
+
+def clean_title(title):
+    """ The title without markdown emphasis, surrounding quotes or a "Title:" prefix """
+    title = title.strip().strip("*#").strip()
+    if len(title) > 1 and title[0] == title[-1] == '"':
+        title = title[1:-1].strip()
+    if title.lower().startswith("title:"):
+        title = title[len("title:"):].strip()
+    return title
+
+
+def parse_structured_post(text):
+    """ The post in a JSON completion, with every field checked; raises PostFormatError naming the first problem """
+    try:
+        post = json.loads(text)
+    except (TypeError, ValueError) as e:
+        raise PostFormatError(f"the reply is not valid JSON ({e})")
+    if not isinstance(post, dict):
+        raise PostFormatError("the reply is not a JSON object")
+
+    missing = [field for field in POST_SCHEMA["required"] if field not in post]
+    if missing:
+        raise PostFormatError(f"missing fields: {', '.join(missing)}")
+    for field in ("title", "body_html", "excerpt"):
+        if not isinstance(post[field], str):
+            raise PostFormatError(f"{field} must be a string")
+    if not isinstance(post["tags"], list) or not all(isinstance(tag, str) for tag in post["tags"]):
+        raise PostFormatError("tags must be a list of strings")
+
+    post["title"] = clean_title(post["title"])
+    if not post["title"]:
+        raise PostFormatError("title is empty")
+    if not post["body_html"].strip():
+        raise PostFormatError("body_html is empty")
+    post["excerpt"] = post["excerpt"].strip()
+    post["tags"] = [tag.strip().lstrip("#") for tag in post["tags"] if tag.strip().lstrip("#")]
+    return post
+
+
+def try_parse_structured_post(text):
+    """ The structured post in text, or None when text is not one (a line-format completion, say) """
+    try:
+        return parse_structured_post(text)
+    except PostFormatError:
+        return None
+
+
+class JsonTitleStream(TitleStream):
+    """ TitleStream for JSON completions: the title is recorded as soon as its string value has closed """
+
+    def __init__(self):
+        super().__init__(lambda lines: None)
+
+    def feed(self, text):
+        self._parts.append(text)
+        if self.title is None:
+            match = JSON_TITLE.search(self.text())
+            if match:
+                self.announce(clean_title(json.loads(f'"{match.group(1)}"')))
+
+
+def complete_structured_post(llm, messages, title_stream=None):
+    """ JSON completion text for messages that passes parse_structured_post.
+
+    An invalid reply is sent back once with the validation error; if the second reply is invalid
+    too, PostFormatError is raised so the caller can fall back to the line format.
+    """
+    response_format = post_response_format()
+    text = llm.complete(messages, title_stream, response_format=response_format)
+    try:
+        parse_structured_post(text)
+        return text
+    except PostFormatError as e:
+        logger.warning(f"Structured post was invalid ({e}); asking again")
+        retry_messages = messages + [
+            {"role": "assistant", "content": text},
+            {"role": "user", "content": f"That reply is invalid: {e}. Reply again with only the corrected JSON object."},
+        ]
+
+    if title_stream is not None:
+        title_stream.restart()
+    text = llm.complete(retry_messages, title_stream, response_format=response_format)
+    parse_structured_post(text)
+    return text
+
+
+def complete_post(llm, messages, fallback_messages, title_stream=None):
+    """ Structured post text for messages or, when the model fails to produce a valid one twice, a line-format completion of fallback_messages """
+    try:
+        return complete_structured_post(llm, messages, title_stream)
+    except PostFormatError as e:
+        logger.warning(f"No valid structured post ({e}); falling back to the line format")
+    if title_stream is not None:
+        title_stream.restart()
+    return llm.complete(fallback_messages, title_stream)
@@ -0,0 +1,261 @@
+import os
+import gc
+import time
+import logging
+import weakref
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Inference steps cap on CPU, where every step costs seconds
+CPU_INFERENCE_STEPS = int(os.getenv("DIFFUSION_CPU_STEPS", "20"))
+
+# Working memory one 512x512 image takes during inference, beyond the weights, by dtype; rough upper bounds
+IMAGE_MEMORY_BYTES = {"float16": 1.0 * 1024 ** 3, "bfloat16": 1.0 * 1024 ** 3, "float32": 2.0 * 1024 ** 3}
+# Images in one pipeline call, however much memory is free; larger batches stop paying off
+MAX_BATCH_SIZE = 8
+
+# Schedulers images can be sampled with: diffusers class and options; "default" is the one the model ships with
+SCHEDULERS = {
+    "default": None,
+    "dpm++": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++"}),
+    "dpm++-karras": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++", "use_karras_sigmas": True}),
+    "euler": ("EulerDiscreteScheduler", {}),
+    "euler-a": ("EulerAncestralDiscreteScheduler", {}),
+    "unipc": ("UniPCMultistepScheduler", {}),
+    "ddim": ("DDIMScheduler", {}),
+}
+
+# Schedulers built for each loaded pipeline, by name; dropped with the pipeline
+_schedulers = weakref.WeakKeyDictionary()
+
+_threads_configured = False
+
+
+def inference_device():
+    """ (device, dtype) images are rendered with.
+
+    DIFFUSION_DEVICE is auto (the default: CUDA when available, else the CPU), cuda or cpu. CUDA
+    renders in float16; the CPU in DIFFUSION_CPU_DTYPE, float32 by default or bfloat16, which is
+    about twice as fast on CPUs with native bfloat16 (AVX512-BF16, AMX) and much slower elsewhere.
+    """
+    device = os.getenv("DIFFUSION_DEVICE", "auto").lower()
+    if device == "auto":
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cpu":
+        return device, os.getenv("DIFFUSION_CPU_DTYPE", "float32").lower()
+    return device, "float16"
+
+
+def configure_cpu_threads():
+    """ Apply DIFFUSION_THREADS (default: torch's choice, one per physical core) once per process """
+    global _threads_configured
+    threads = os.getenv("DIFFUSION_THREADS")
+    if threads and not _threads_configured:
+        import torch
+        torch.set_num_threads(int(threads))
+        _threads_configured = True
+
+
+def load_pipeline(model_id, device="cuda", dtype="float16"):
+    """ Load a Stable Diffusion pipeline from the Hugging Face cache (or hub) and move it to device.
+
+    On the CPU, attention is computed in slices (lower peak memory) and the UNet and VAE use the
+    channels_last memory format, which the CPU convolution kernels run faster on.
+    """
+    # torch and diffusers take seconds to import; only runs that render an image pay for it
+    import torch
+    from diffusers import StableDiffusionPipeline
+
+    pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=getattr(torch, dtype))
+    pipe = pipe.to(device)
+    if device == "cpu":
+        configure_cpu_threads()
+        pipe.enable_attention_slicing()
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+    return pipe
+
+
+def free_memory_bytes(device):
+    """ Memory free on device: the GPU's for cuda, available system memory for the CPU; None when unknown """
+    try:
+        if device == "cuda":
+            import torch
+            return torch.cuda.mem_get_info()[0]
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError, RuntimeError):
+        return None
+
+
+def check_scheduler(name):
+    """ Raise ValueError unless name is one of SCHEDULERS """
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler {name!r}; expected one of {', '.join(SCHEDULERS)}")
+
+
+def set_scheduler(pipe, name="default"):
+    """ Switch pipe to the named scheduler, built from the model's own scheduler config once per pipeline.
+
+    The scheduler is part of the pipeline every caller shares: switch it while holding the pipeline
+    (use_pipeline) and before every call, since the previous holder may have left another one.
+    """
+    check_scheduler(name)
+    built = _schedulers.setdefault(pipe, {"default": pipe.scheduler})
+    if name not in built:
+        import diffusers
+        class_name, options = SCHEDULERS[name]
+        built[name] = getattr(diffusers, class_name).from_config(built["default"].config, **options)
+    pipe.scheduler = built[name]
+
+
+def batch_size_for(device, dtype, width=None, height=None):
+    """ Images to render in one pipeline call: DIFFUSION_BATCH_SIZE when set, else as many as fit in free memory.
+
+    The estimate keeps a fifth of the free memory in reserve and is capped at MAX_BATCH_SIZE; when
+    the free memory is unknown, images are rendered one at a time.
+    """
+    configured = os.getenv("DIFFUSION_BATCH_SIZE")
+    if configured:
+        return max(1, int(configured))
+    free = free_memory_bytes(device)
+    if not free:
+        return 1
+    pixels = (width or 512) * (height or 512) / (512 * 512)
+    per_image = IMAGE_MEMORY_BYTES.get(dtype, IMAGE_MEMORY_BYTES["float32"]) * pixels
+    return max(1, min(MAX_BATCH_SIZE, int(free * 0.8 // per_image)))
+
+
+def is_out_of_memory(error):
+    """ Whether error is torch running out of device or host memory """
+    return (isinstance(error, MemoryError) or type(error).__name__ == "OutOfMemoryError"
+            or "out of memory" in str(error).lower())
+
+
+def free_device_memory():
+    """ Hand memory of dropped pipelines back, so the next model has room to load """
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+class PipelineRegistry:
+    """ Diffusion pipelines kept loaded between images, so each model is read from disk once per process.
+
+    Pipelines are keyed by (model, device, dtype) and kept in least-recently-used order; loading one
+    more than max_models evicts the least recently used first. A model is loaded by one thread
+    while others asking for it wait, and use() holds a per-model lock around inference, since a
+    pipeline must not run two images at once. loader(model_id, device, dtype) returns a pipeline.
+    """
+
+    def __init__(self, max_models=1, loader=load_pipeline):
+        self.max_models = max(1, max_models)
+        self.loader = loader
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+        self._pipelines = OrderedDict()
+        self._model_locks = {}
+        self._lock = threading.Lock()
+
+    def _model_lock(self, key):
+        with self._lock:
+            return self._model_locks.setdefault(key, threading.RLock())
+
+    def _evict(self, keep):
+        """ Drop least recently used pipelines until at most keep are loaded.
+
+        A pipeline is only dropped under its model's lock, so an image still rendering on it
+        finishes before its memory is handed back.
+        """
+        evicted = []
+        while True:
+            with self._lock:
+                if len(self._pipelines) <= keep:
+                    break
+                key = next(iter(self._pipelines))
+            with self._model_lock(key):
+                with self._lock:
+                    # Another thread may have used or dropped it while this one waited
+                    if self._pipelines and next(iter(self._pipelines)) == key and len(self._pipelines) > keep:
+                        del self._pipelines[key]
+                        evicted.append(key)
+                        self.evictions += 1
+        for model_id, device, dtype in evicted:
+            logger.info(f"Evicted diffusion model {model_id} ({device}, {dtype})")
+        if evicted:
+            free_device_memory()
+
+    def get(self, model_id, device="cuda", dtype="float16"):
+        """ The loaded pipeline for model_id, loading it (and evicting others) if it is not resident """
+        key = (model_id, device, dtype)
+        with self._lock:
+            if key in self._pipelines:
+                self._pipelines.move_to_end(key)
+                self.hits += 1
+                return self._pipelines[key]
+
+        with self._model_lock(key):
+            with self._lock:
+                if key in self._pipelines:  # Loaded by another thread while this one waited
+                    self._pipelines.move_to_end(key)
+                    self.hits += 1
+                    return self._pipelines[key]
+            # Make room before loading, not after: two models may not fit side by side
+            self._evict(self.max_models - 1)
+            logger.info(f"Loading diffusion model {model_id} ({device}, {dtype})...")
+            started = time.perf_counter()
+            pipe = self.loader(model_id, device, dtype)
+            elapsed = time.perf_counter() - started
+            logger.info(f"Loaded diffusion model {model_id} in {elapsed:.1f}s")
+            with self._lock:
+                self._pipelines[key] = pipe
+                self.loads += 1
+                self.load_seconds += elapsed
+            return pipe
+
+    @contextmanager
+    def use(self, model_id, device="cuda", dtype="float16"):
+        """ The pipeline for model_id, held exclusively by the caller until the block ends """
+        with self._model_lock((model_id, device, dtype)):
+            yield self.get(model_id, device, dtype)
+
+    def clear(self):
+        self._evict(0)
+
+    def stats(self):
+        with self._lock:
+            return {"resident": [model_id for model_id, _, _ in self._pipelines], "loads": self.loads,
+                    "hits": self.hits, "evictions": self.evictions, "load_seconds": round(self.load_seconds, 3)}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_pipeline_registry():
+    """ The process-wide registry; DIFFUSION_MAX_MODELS (default 1) pipelines stay loaded at a time """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PipelineRegistry(max_models=int(os.getenv("DIFFUSION_MAX_MODELS", "1")))
+    return _registry
+
+
+def get_pipeline(model_id, device="cuda", dtype="float16"):
+    return get_pipeline_registry().get(model_id, device, dtype)
+
+
+def use_pipeline(model_id, device="cuda", dtype="float16"):
+    return get_pipeline_registry().use(model_id, device, dtype)
@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import httpx
+import requests
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (connect, read) timeouts in seconds for each kind of outbound call.
+# Override one with HTTP_TIMEOUT_<ENDPOINT>="connect,read", e.g. HTTP_TIMEOUT_NEWSAPI="5,10".
+DEFAULT_TIMEOUTS = {
+    "default": (5.0, 60.0),
+    "wordpress": (5.0, 60.0),
+    "wordpress_media": (5.0, 120.0),
+    "wordpress_batch": (5.0, 120.0),
+    "newsapi": (5.0, 15.0),
+    "image_download": (5.0, 30.0),
+}
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# The server turned these away without acting on them, so any method may be sent again
+RETRY_ANY_METHOD_STATUSES = {429, 503}
+
+# These can come back after the request was (partly) applied; only idempotent methods are retried
+RETRY_IDEMPOTENT_STATUSES = {500, 502, 504}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """ Raised instead of sending a request while the host's circuit is open """
+
+
+class AsyncCircuitOpenError(httpx.TransportError):
+    """ httpx flavour of CircuitOpenError, so callers catching httpx.HTTPError handle it too """
+
+
+def timeout_for(endpoint):
+    """ (connect, read) timeout for an endpoint name """
+    value = os.getenv(f"HTTP_TIMEOUT_{endpoint.upper()}")
+    if value:
+        try:
+            connect, read = (float(part) for part in value.split(","))
+            return connect, read
+        except ValueError:
+            logger.warning(f"Ignoring malformed HTTP_TIMEOUT_{endpoint.upper()}={value!r}; expected 'connect,read'")
+    return DEFAULT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUTS["default"])
+
+
+def parse_retry_after(value):
+    """ Seconds to wait according to a Retry-After header (delta-seconds or HTTP date), or None """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def is_replayable(body):
+    """ True when a request body can be sent again (not a stream or file that was already consumed) """
+    return body is None or isinstance(body, (bytes, bytearray, str, dict, list, tuple))
+
+
+class RetryPolicy:
+    """ How often and how long to wait before sending a failed request again """
+
+    def __init__(self, max_attempts=3, backoff_base=0.5, backoff_max=30.0):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def delay(self, attempt, retry_after=None):
+        """ Seconds to wait after failed attempt number attempt (1-based).
+
+        Exponential backoff with full jitter, so clients that failed together do not retry together;
+        a Retry-After from the server takes precedence.
+        """
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def should_retry_status(self, method, status_code, retry_after=None):
+        # A server asking us to wait longer than backoff_max is better reported than waited on
+        if retry_after is not None and retry_after > self.backoff_max:
+            return False
+        return status_code in RETRY_ANY_METHOD_STATUSES or (
+            method in IDEMPOTENT_METHODS and status_code in RETRY_IDEMPOTENT_STATUSES
+        )
+
+
+class CircuitBreaker:
+    """ Per-host circuit breaker.
+
+    After failure_threshold consecutive failures (connection errors, timeouts, 5xx) the circuit
+    opens and requests to the host fail immediately. Once reset_timeout seconds have passed it
+    goes half-open: requests are let through again, and the next outcome closes or re-opens it.
+    """
+
+    def __init__(self, host, failure_threshold=5, reset_timeout=60.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            return self.state != "open"
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"Circuit for {self.host} closed again")
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        """ Count a failure; returns True when this failure opened the circuit """
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                logger.error(f"Circuit for {self.host} opened after {self.failures} failures; "
+                             f"failing fast for {self.reset_timeout:g}s")
+                return True
+            return False
+
+
+class ResilienceMetrics:
+    """ Thread-safe per-host counters: requests, retries, failures, circuit_opened, short_circuited """
+
+    COUNTERS = ("requests", "retries", "failures", "circuit_opened", "short_circuited")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def incr(self, host, name):
+        with self._lock:
+            counters = self._hosts.setdefault(host, dict.fromkeys(self.COUNTERS, 0))
+            counters[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            by_host = {host: dict(counters) for host, counters in self._hosts.items()}
+        totals = {name: sum(counters[name] for counters in by_host.values()) for name in self.COUNTERS}
+        with _breakers_lock:
+            open_circuits = sorted(host for host, breaker in _breakers.items() if breaker.state != "closed")
+        return {"totals": totals, "by_host": by_host, "open_circuits": open_circuits}
+
+
+metrics = ResilienceMetrics()
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_policy = None
+_session = None
+_session_lock = threading.Lock()
+
+
+def breaker_for(url):
+    """ The circuit breaker shared by every request to url's host """
+    host = urlparse(url).netloc
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(
+                host,
+                failure_threshold=int(os.getenv("HTTP_CIRCUIT_FAILURES", "5")),
+                reset_timeout=float(os.getenv("HTTP_CIRCUIT_RESET", "60")),
+            )
+        return breaker
+
+
+def default_policy():
+    """ Retry policy configured from the environment """
+    global _policy
+    if _policy is None:
+        _policy = RetryPolicy(
+            max_attempts=int(os.getenv("HTTP_MAX_ATTEMPTS", "3")),
+            backoff_base=float(os.getenv("HTTP_BACKOFF_BASE", "0.5")),
+            backoff_max=float(os.getenv("HTTP_BACKOFF_MAX", "30")),
+        )
+    return _policy
+
+
+def shared_session():
+    """ Keep-alive session for outbound calls that have no client of their own (NewsAPI, image downloads) """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = requests.Session()
+    return _session
+
+
+def _record_status(breaker, status_code):
+    if status_code >= 500:
+        if breaker.record_failure():
+            metrics.incr(breaker.host, "circuit_opened")
+        metrics.incr(breaker.host, "failures")
+    elif status_code != 429:
+        # The host answered; a 4xx is the caller's problem, not a sign the host is down
+        breaker.record_success()
+
+
+def _record_error(breaker):
+    if breaker.record_failure():
+        metrics.incr(breaker.host, "circuit_opened")
+    metrics.incr(breaker.host, "failures")
+
+
+def _can_retry_requests_error(method, error):
+    # Nothing was sent if the connection never opened, so even a POST can go again
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    return method in IDEMPOTENT_METHODS
+
+
+def resilient_request(method, url, endpoint="default", session=None, policy=None, **kwargs):
+    """ requests-based HTTP call with the endpoint's timeout, retries and the host's circuit breaker.
+
+    Retries with jittered exponential backoff (or the server's Retry-After) on connection errors,
+    timeouts, 429 and 5xx responses, as far as that is safe for the method. Streamed request bodies
+    are never retried. Raises CircuitOpenError without sending anything while the host is down.
+    """
+    session = session or shared_session()
+    policy = policy or default_policy()
+    method = method.upper()
+    kwargs.setdefault("timeout", timeout_for(endpoint))
+    breaker = breaker_for(url)
+    attempts = policy.max_attempts if is_replayable(kwargs.get("data")) else 1
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if not breaker.allow():
+            metrics.incr(breaker.host, "short_circuited")
+            raise CircuitOpenError(f"Circuit for {breaker.host} is open; not sending {method} {url}")
+
+        metrics.incr(breaker.host, "requests")
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            _record_error(breaker)
+            if attempt >= attempts or breaker.state == "open" or not _can_retry_requests_error(method, e):
+                raise
+            reason, delay = type(e).__name__, policy.delay(attempt)
+        else:
+            _record_status(breaker, response.status_code)
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if (attempt >= attempts or breaker.state == "open"
+                    or not policy.should_retry_status(method, response.status_code, retry_after)):
+                return response
+            reason, delay = f"HTTP {response.status_code}", policy.delay(attempt, retry_after)
+            response.close()
+
+        metrics.incr(breaker.host, "retries")
+        logger.warning(f"{method} {url} failed ({reason}); retry {attempt}/{attempts - 1} in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def _can_retry_httpx_error(method, error):
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    return method in IDEMPOTENT_METHODS
+
+
+async def async_resilient_request(client, method, url, endpoint="default", policy=None, stream=False, **kwargs):
+    """ httpx.AsyncClient counterpart of resilient_request.
+
+    With stream=True the response body is left unread, and the caller must close the response.
+    """
+    policy = policy or default_policy()
+    method = method.upper()
+    if "timeout" not in kwargs:
+        connect, read = timeout_for(endpoint)
+        kwargs["timeout"] = httpx.Timeout(read, connect=connect)
+    breaker = breaker_for(url)
+    attempts = policy.max_attempts if is_replayable(kwargs.get("content")) else 1
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if not breaker.allow():
+            metrics.incr(breaker.host, "short_circuited")
+            raise AsyncCircuitOpenError(f"Circuit for {breaker.host} is open; not sending {method} {url}")
+
+        metrics.incr(breaker.host, "requests")
+        try:
+            response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+        except httpx.TransportError as e:
+            _record_error(breaker)
+            if attempt >= attempts or breaker.state == "open" or not _can_retry_httpx_error(method, e):
+                raise
+            reason, delay = type(e).__name__, policy.delay(attempt)
+        else:
+            _record_status(breaker, response.status_code)
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if (attempt >= attempts or breaker.state == "open"
+                    or not policy.should_retry_status(method, response.status_code, retry_after)):
+                return response
+            reason, delay = f"HTTP {response.status_code}", policy.delay(attempt, retry_after)
+            await response.aclose()
+
+        metrics.incr(breaker.host, "retries")
+        logger.warning(f"{method} {url} failed ({reason}); retry {attempt}/{attempts - 1} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+def report_metrics():
+    """ Log the retry and circuit-breaker counters, and write them to HTTP_METRICS_PATH when that is set """
+    snapshot = metrics.snapshot()
+    totals = snapshot["totals"]
+    logger.info(
+        f"HTTP: {totals['requests']} requests, {totals['retries']} retries, {totals['failures']} failures, "
+        f"{totals['circuit_opened']} circuits opened, {totals['short_circuited']} short-circuited; "
+        f"open circuits: {', '.join(snapshot['open_circuits']) or 'none'}"
+    )
+
+    path = os.getenv("HTTP_METRICS_PATH")
+    if path:
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(dict(snapshot, timestamp=time.time()), f, indent=2)
+        except OSError as e:
+            logger.warning(f"Could not write HTTP metrics to {path}: {e}")
+    return snapshot
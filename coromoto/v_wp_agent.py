@@ -2,12 +2,24 @@ import time
 
 # Import the necessary modules (the rest of your script remains unchanged)
 import os
+import asyncio
 import logging
 import random
-import base64
-import requests
-from dotenv import load_dotenv
-from authenticate import open_ai_auth
+from config import load_env
+from authenticate import get_openai_client
+from wp_client import get_wp_client
+from async_wp_client import get_async_wp_client
+from resilience import report_metrics
+from llm_cache import cached_completion
+from llm_stream import TitleStream
+from llm_limiter import completion_pool, report_rate_limits
+from llm_backend import get_backend
+from llm_batch import batch_request, collect_batch, pending_jobs, submit_batch
+from llm_structured import (
+    STRUCTURED_INSTRUCTIONS, JsonTitleStream, complete_post, post_response_format, structured_output_enabled,
+    try_parse_structured_post,
+)
+from post_index import get_post_index
 # from generate_image import generate_image, upload_image_to_wordpress  # Import the image generation function
 
 # Configure logger
@@ -15,24 +27,43 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Load environment variables from a .env file
-load_dotenv()
+load_env()
 
-# Environment variables
-wordpress_url = os.getenv("WORDPRESS_URL")
-username = os.getenv("WORDPRESS_USERNAME")
-password = os.getenv("WORDPRESS_PASSWORD")
+# Tags attached to every post
+POST_TAGS = ["art", "blog", "just-release", "post", "creativity", "engagement"]
 
-ai_client = open_ai_auth()
+# Completion model and prompts; they are part of the LLM cache key, so editing them starts a fresh cache.
+# The system and instruction text is a fixed prefix sent before the topic, so the provider's prompt
+# cache can reuse it from one call to the next; bump PROMPT_VERSION whenever the prefix changes
+POST_MODEL = "gpt-4o-mini"
+PROMPT_VERSION = "2"
+SYSTEM_PROMPT = "You are a helpful writing assistant."
+POST_INSTRUCTIONS = (
+    "Create an engaging post on the topic the user gives, with a title and content. "
+    "The title should be catchy, between 8-12 words, and suitable for a blog post. "
+    "The content should have a professional yet conversational tone to keep readers engaged. "
+    "The content should be structured, using subheadings, bullet points, and short paragraphs for readability. "
+    "The content should have citations links to credible sources when referencing data and news. "
+    "The content should be under 500 words and include relevant hashtags and SEO keywords."
+    "don't include the word Title in the title."
+)
+POST_PROMPT = "Topic: {topic}"
 
-# Prepare the credentials for Basic Auth
-auth_string = f"{username}:{password}"
-encoded_auth = base64.b64encode(auth_string.encode()).decode()
+# Topics repeat, and a cached post would repeat with them, so topic posts are only cached when
+# LLM_TOPIC_CACHE_TTL (seconds) is set
+TOPIC_CACHE_TTL = float(os.getenv("LLM_TOPIC_CACHE_TTL", "0"))
 
-# Headers with encoded authorization
-headers = {
-    "Authorization": f"Basic {encoded_auth}",
-    "Content-Type": "application/json"
-}
+# Name of this agent, for its jobs in the shared Batch API job directory and LLM_BACKEND_<AGENT_NAME>
+AGENT_NAME = "coromoto"
+
+# Completion backend (OpenAI, a local Ollama model, or a router between the two)
+llm = get_backend(AGENT_NAME, POST_MODEL)
+
+# Earlier posts, to skip posts that nearly repeat one and prefer unused topics (None when POST_DEDUP is false)
+post_index = get_post_index(AGENT_NAME)
+
+# Random topics drawn for each post wanted, so there are others to use when some were covered recently
+TOPIC_DRAWS = 5
 
 # Other functions...
 
@@ -42,62 +73,64 @@ def generate_post_topic():
     logger.info(f"Selected random topic: {topic}")
     return topic
 
+def pick_topics(count):
+    """ Up to count different random topics, preferring topics not used in the last POST_DEDUP_SUBJECT_WINDOW_HOURS.
+
+    Recently used topics fill the places fresh ones leave, so the topic check never stops the
+    agent from posting; a post that repeats an earlier one is caught afterwards by is_repeat.
+    """
+    candidates = list(dict.fromkeys(generate_post_topic() for _ in range(count * TOPIC_DRAWS)))
+    topics = post_index.fresh(candidates, count) if post_index is not None else candidates[:count]
+    if len(topics) < count:
+        logger.info(f"Only {len(topics)} of {count} topics were not used recently; reusing others")
+        topics += [topic for topic in candidates if topic not in topics][:count - len(topics)]
+    return topics
+
+
+def is_repeat(title, content):
+    """ True when a generated post nearly repeats an earlier one, so it is not worth a WordPress write """
+    return post_index is not None and post_index.find_duplicate(f"{title}\n{content}") is not None
+
+
+def remember_post(topic, title, content):
+    """ Add a published post to the post index """
+    if post_index is not None:
+        post_index.remember_post(topic, title, content)
+
+
 def get_category_id(slug):
     """ Get category ID by slug """
-    category_response = requests.get(f"{wordpress_url}/categories?slug={slug}", headers=headers)
-    if category_response.status_code == 200:
-        categories = category_response.json()
-        if categories:
-            category_id = categories[0]["id"]
-            logger.info(f"Category ID for '{slug}': {category_id}")
-            return category_id
-        else:
-            logger.error(f"Category with slug '{slug}' not found.")
-    else:
-        logger.error("Failed to retrieve categories:", category_response.status_code, category_response.text)
-    return None
+    return get_wp_client().get_category_id(slug)
+
+
+def get_category_ids(slugs):
+    """ Get category IDs by slugs in one lookup, in the same order as slugs """
+    return get_wp_client().get_category_ids(slugs)
 
 
 def get_tag_ids(slugs):
     """ Get tag IDs by slugs """
-    tag_ids = []
-    for slug in slugs:
-        tag_response = requests.get(f"{wordpress_url}/tags?slug={slug}", headers=headers)
-        if tag_response.status_code == 200:
-            tags = tag_response.json()
-            if tags:
-                tag_id = tags[0]["id"]
-                tag_ids.append(tag_id)
-                logger.info(f"Tag ID for '{slug}': {tag_id}")
-            else:
-                logger.error(f"Tag with slug '{slug}' not found.")
-        else:
-            logger.error(f"Failed to retrieve tag '{slug}': {tag_response.status_code}, {tag_response.text}")
-    return tag_ids
+    return get_wp_client().get_tag_ids(slugs)
 
 
+def parse_title(lines):
+    """ The title is the first non-empty line """
+    for line in lines:
+        if line.strip():
+            return line.strip().lstrip("*").strip()  # Remove any asterisks and leading/trailing spaces
+    return None
 
-def gpt_generate_v_post(post_topic):
-    logger.info(f"Generating a post based on the following topic using ChatGPT API: {post_topic}...")
-    response = ai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a helpful writing assistant."},
-            {
-                "role": "user",
-                "content": (
-                    f"Create an engaging post on {post_topic} with a title and content. "
-                    f"The title should be catchy, between 8-12 words, and suitable for a blog post. "
-                    f"The content should have a professional yet conversational tone to keep readers engaged. "
-                    f"The content should be structured, using subheadings, bullet points, and short paragraphs for readability. "
-                    f"The content should have citations links to credible sources when referencing data and news. "
-                    f"The content should be under 500 words and include relevant hashtags and SEO keywords."
-                    f"don't include the word Title in the title."
-                ),
-            },
-        ],
-    )
-    full_content = response.choices[0].message.content.strip()
+
+def parse_post(post_topic, full_content):
+    """ Split a completion into the post title, content and details: a structured (JSON) post, else the line format.
+
+    details holds the excerpt and tags of a structured post; a line-format post has none.
+    """
+    post = try_parse_structured_post(full_content)
+    if post:
+        return post["title"], post["body_html"], {"excerpt": post["excerpt"], "tags": post["tags"]}
+
+    full_content = full_content.strip()
     lines = full_content.splitlines()
     
     # Extract the title and ensure it does not contain "Title:" prefix
@@ -108,13 +141,50 @@ def gpt_generate_v_post(post_topic):
             
     # Extract content after the title
     content = "\n".join(lines[1:]) if len(lines) > 1 else full_content
+    return title, content, {}
+
+
+def prompt_prefix(structured):
+    """ The system message every post request starts with; it only changes with PROMPT_VERSION """
+    parts = [SYSTEM_PROMPT, POST_INSTRUCTIONS] + ([STRUCTURED_INSTRUCTIONS] if structured else [])
+    return "\n\n".join(parts)
+
+
+def post_prompts(structured):
+    """ The fixed prompt text, as part of the LLM cache key """
+    return [PROMPT_VERSION, prompt_prefix(structured), POST_PROMPT]
+
+
+def post_messages(post_topic, structured=False):
+    return [
+        {"role": "system", "content": prompt_prefix(structured)},
+        {"role": "user", "content": POST_PROMPT.format(topic=post_topic)},
+    ]
+
+
+def gpt_generate_v_post(post_topic):
+    """ Write a post on the topic: (title, content, details) as parse_post returns them """
+    logger.info(f"Generating a post based on the following topic using ChatGPT API: {post_topic}...")
+    structured = structured_output_enabled()
+    title_stream = JsonTitleStream() if structured else TitleStream(parse_title)
+
+    def generate():
+        if structured:
+            return complete_post(llm, post_messages(post_topic, structured=True), post_messages(post_topic), title_stream)
+        return llm.complete(post_messages(post_topic), title_stream)
+
+    full_content = cached_completion(
+        llm.model_id, post_prompts(structured), post_topic, generate, ttl=TOPIC_CACHE_TTL,
+        answered_by=llm.answered_by,
+    )
+    title, content, details = parse_post(post_topic, full_content)
 
     logger.info(f"Generated Post - Title: {title}")
     logger.info(f"Content: {content}")
-    return title, content
+    return title, content, details
 
-def create_wordpress_post(title, content, category_ids, tag_ids):
-    """ Create a WordPress post with tags, categories, and optionally an image """
+def build_post_data(title, content, category_ids, tag_ids, excerpt=None):
+    """ Request body for a new WordPress post """
     post_data = {
         "title": title,
         "content": content,
@@ -123,31 +193,49 @@ def create_wordpress_post(title, content, category_ids, tag_ids):
         "tags": tag_ids
     }
 
+    # Use the generated excerpt instead of WordPress's cut of the content
+    if excerpt:
+        post_data["excerpt"] = excerpt
+
     # Add featured image if available
 
-    try:
-        response = requests.post(f"{wordpress_url}/posts", json=post_data, headers=headers)
-        if response.status_code == 201:
-            logger.info("Post created successfully: " + response.json().get("link"))
-        else:
-            logger.error(f"Failed to create post: {response.status_code}, {response.text}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"An error occurred while creating the post: {e}")
+    return post_data
+
+
+def merge_tag_ids(tag_ids, ids_by_tag):
+    """ tag_ids followed by the IDs found for a post's generated tags, without repeats """
+    return list(dict.fromkeys(list(tag_ids) + [tag_id for tag_id in ids_by_tag.values() if tag_id]))
+
+
+def post_tag_ids(tag_ids, details):
+    """ tag_ids plus the IDs of the post's generated tags (created only as WP_TERM_CREATE_POLICY allows) """
+    tags = details.get("tags")
+    return merge_tag_ids(tag_ids, get_wp_client().resolve_terms("tags", tags)) if tags else list(tag_ids)
+
+
+def create_wordpress_post(title, content, category_ids, tag_ids, excerpt=None):
+    """ Create a WordPress post with tags, categories, and optionally an image """
+    get_wp_client().create_post(build_post_data(title, content, category_ids, tag_ids, excerpt))
 
 # Main function to generate and create a WordPress post
 def main():
     # Toggle for enabling or disabling image generation and upload
     enable_image_generation = os.getenv("ENABLE_IMAGE_GENERATION", "true").lower() == "true"
 
-    topic = generate_post_topic()
-    topic_category_id = get_category_id(topic)
-    just_release_category_id = get_category_id("just-release")
+    # Create the shared WordPress client early so its connection warms up in the background
+    get_wp_client()
 
-    # Adding tags to match the previous post
-    tag_ids = get_tag_ids(["art", "blog", "just-release", "post", "creativity", "engagement"])
+    topics = pick_topics(1)
+    if not topics:
+        return
+    topic = topics[0]
+    topic_category_id, just_release_category_id = get_category_ids([topic, "just-release"])
 
     if topic_category_id and just_release_category_id:
-        post_title, post_content = gpt_generate_v_post(topic)
+        # Adding tags to match the previous post
+        tag_ids = get_tag_ids(POST_TAGS)
+
+        post_title, post_content, details = gpt_generate_v_post(topic)
 
         # Try to get an existing image
         existing_image_url = None
@@ -162,14 +250,132 @@ def main():
 
             # if image_url:
             #     post_content = f"<img src='{image_url}' alt='{topic}' />\n\n" + post_content
+            pass
 
-            create_wordpress_post(post_title, post_content, [topic_category_id, just_release_category_id], tag_ids)
+        if is_repeat(post_title, post_content):
+            return
+        create_wordpress_post(post_title, post_content, [topic_category_id, just_release_category_id],
+                              post_tag_ids(tag_ids, details), details.get("excerpt"))
+        remember_post(topic, post_title, post_content)
+
+
+async def publish_post(wp, topic, category_ids, tag_ids):
+    """ Write one post on the topic and create it; tag_ids is an awaitable shared by every post of the run """
+    loop = asyncio.get_running_loop()
+    tag_ids, (post_title, post_content, details) = await asyncio.gather(
+        tag_ids,
+        loop.run_in_executor(completion_pool(), gpt_generate_v_post, topic),
+    )
+    if await loop.run_in_executor(None, is_repeat, post_title, post_content):
+        return
+    if details.get("tags"):
+        tag_ids = merge_tag_ids(tag_ids, await wp.resolve_terms("tags", details["tags"]))
+    post_data = build_post_data(post_title, post_content, category_ids, tag_ids, details.get("excerpt"))
+    await wp.create_post(post_data)
+    await loop.run_in_executor(None, remember_post, topic, post_title, post_content)
+
+
+async def async_main(count=None):
+    """ Same flow as main(), but the tag lookup and text generation run concurrently.
+
+    The categories are resolved first (normally straight from the taxonomy cache), so a topic
+    without a category does not pay for a completion that could never be posted. count posts
+    (default: POSTS_PER_RUN, 1) are written at once; their completions share the LLM_WORKERS
+    thread pool and the process-wide rate limiter.
+    """
+    count = int(os.getenv("POSTS_PER_RUN", "1")) if count is None else count
+    wp = get_async_wp_client()
+
+    try:
+        topics = await asyncio.get_running_loop().run_in_executor(None, pick_topics, count)
+        *topic_category_ids, just_release_category_id = await wp.get_category_ids(topics + ["just-release"])
+        posts = [(topic, [topic_category_id, just_release_category_id])
+                 for topic, topic_category_id in zip(topics, topic_category_ids)
+                 if topic_category_id and just_release_category_id]
+        if posts:
+            tag_ids = asyncio.ensure_future(wp.get_tag_ids(POST_TAGS))
+            results = await asyncio.gather(
+                *(publish_post(wp, topic, category_ids, tag_ids) for topic, category_ids in posts),
+                return_exceptions=True,
+            )
+            failures = [result for result in results if isinstance(result, Exception)]
+            for failure in failures:
+                logger.error(f"Failed to publish a post: {failure!r}")
+            if len(failures) == len(posts):
+                raise failures[0]
+    finally:
+        await wp.aclose()
+        report_metrics()
+        report_rate_limits()
+
+def post_batch_results(job, outputs):
+    """ Create a draft for every completion in a finished batch, in as few WordPress requests as possible """
+    if outputs is None:
+        return  # Still running; the next bulk run picks it up
+
+    slugs = list(dict.fromkeys(job.subjects[custom_id] for custom_id in outputs)) + ["just-release"]
+    category_ids = get_category_ids(slugs)
+    if not all(category_ids):
+        missing = [slug for slug, category_id in zip(slugs, category_ids) if not category_id]
+        logger.error(f"Categories {missing} not found; keeping batch {job.batch_id} for the next run")
+        return
+    category_ids = dict(zip(slugs, category_ids))
+    tag_ids = get_tag_ids(POST_TAGS)
+
+    posts, posts_data = [], []
+    for custom_id, full_content in outputs.items():
+        post_topic = job.subjects[custom_id]
+        title, content, details = parse_post(post_topic, full_content)
+        if is_repeat(title, content):
+            continue
+        posts.append((post_topic, title, content))
+        posts_data.append(build_post_data(title, content, [category_ids[post_topic], category_ids["just-release"]],
+                                          post_tag_ids(tag_ids, details), details.get("excerpt")))
+    created = get_wp_client().create_posts(posts_data) if posts_data else []
+    for post, created_post in zip(posts, created):
+        if created_post:
+            remember_post(*post)
+    logger.info(f"Created {sum(1 for post in created if post)} of {len(job.subjects)} drafts from batch {job.batch_id}")
+    job.finish()
+
+
+def bulk_main(count):
+    """ Write count drafts on random topics through the OpenAI Batch API, at half the per-token price.
+
+    Topics without a category are dropped before submitting, as in main(). Finished batches from
+    earlier runs are posted first; the new batch is waited on for up to LLM_BATCH_WAIT seconds and,
+    if it is still running by then, posted by the next bulk run.
+    """
+    for job in pending_jobs(AGENT_NAME):
+        post_batch_results(job, collect_batch(get_openai_client(), job, timeout=0))
+
+    if count:
+        topics = pick_topics(count)
+        if not topics:
+            return
+        category_ids = get_category_ids(topics + ["just-release"])
+        if not category_ids[-1]:
+            logger.error("Category 'just-release' not found. Stopping the app.")
+            return
+
+        topics = {f"post-{index}": topic for index, (topic, category_id) in enumerate(zip(topics, category_ids)) if category_id}
+        structured = structured_output_enabled()
+        response_format = post_response_format() if structured else None
+        batch_requests = [batch_request(custom_id, POST_MODEL, post_messages(topic, structured), response_format)
+                          for custom_id, topic in topics.items()]
+        job = submit_batch(get_openai_client(), AGENT_NAME, batch_requests, topics)
+        post_batch_results(job, collect_batch(get_openai_client(), job))
 
 # Adding a loop to run continuously
 if __name__ == "__main__":
-    while True:
-        main()  # Run the main function to generate and post content
-        # Generate a random sleep time between 12 and 24 hours
-        sleep_time = random.uniform(1 * 3600, 2 * 3600)  # Convert hours to seconds
-        logger.info(f"Sleeping for {sleep_time / 3600:.2f} hours until the next post...")
-        time.sleep(sleep_time)
+    # BULK_POSTS=N writes N drafts in one Batch API job instead of posting on a timer
+    bulk_posts = int(os.getenv("BULK_POSTS", "0"))
+    if bulk_posts or os.getenv("BULK_COLLECT", "false").lower() == "true":
+        bulk_main(bulk_posts)
+    else:
+        while True:
+            asyncio.run(async_main())  # Run the main function to generate and post content
+            # Generate a random sleep time between 12 and 24 hours
+            sleep_time = random.uniform(1 * 3600, 2 * 3600)  # Convert hours to seconds
+            logger.info(f"Sleeping for {sleep_time / 3600:.2f} hours until the next post...")
+            time.sleep(sleep_time)
@@ -37,15 +37,15 @@ while true; do
                 echo "Running $script..."
                 python3 "$script" &> "$LOG_DIR/$(basename $script).log"
                 if [ $? -ne 0 ]; then
+                    # Keep the scheduler alive; the next cycle gets a fresh run
                     echo "Error: Script $script failed. Check log at $LOG_DIR/$(basename $script).log"
-                    exit 1
                 fi
             else
                 echo "Warning: Script $script not found. Skipping."
             fi
         done
 
-        echo "All scripts completed successfully."
+        echo "All scripts finished."
     else
         echo "Current time is not within the allowed range. Waiting..."
     fi
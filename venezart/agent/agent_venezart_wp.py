@@ -2,38 +2,66 @@ import time
 
 # Import the necessary modules (the rest of your script remains unchanged)
 import os
+import asyncio
 import logging
 import random
-import ollama
-import base64
-import requests
-from dotenv import load_dotenv
-from authenticate import open_ai_auth
-from generate_image import generate_image, upload_image_to_wordpress  # Import the image generation function
+from config import load_env
+from authenticate import get_openai_client
+from generate_image import render_image_bytes, upload_generated_image  # Import the image generation functions
+from wp_client import get_wp_client, slugify
+from async_wp_client import get_async_wp_client
+from resilience import report_metrics
+from llm_cache import cached_completion
+from llm_stream import TitleStream
+from llm_limiter import completion_pool, report_rate_limits
+from llm_backend import get_backend
+from llm_batch import batch_request, collect_batch, pending_jobs, submit_batch
+from llm_structured import (
+    STRUCTURED_INSTRUCTIONS, JsonTitleStream, complete_post, post_response_format, structured_output_enabled,
+    try_parse_structured_post,
+)
+from post_index import get_post_index
 
 # Configure logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Load environment variables from a .env file
-load_dotenv()
+load_env()
 
-# Environment variables
-wordpress_url = os.getenv("WORDPRESS_URL")
-username = os.getenv("WORDPRESS_USERNAME")
-password = os.getenv("WORDPRESS_PASSWORD")
+# Categories and tags attached to every post
+POST_CATEGORIES = ["Blog", "just-release"]
+POST_TAGS = ["art", "blog", "creativity", "3D", "AiArt", "Artists", "ArtLovers", "Artwork", "DigitalArt", "Innovation", "Tech"]
 
-ai_client = open_ai_auth()
+# Completion model and prompts; they are part of the LLM cache key, so editing them starts a fresh cache.
+# The system and instruction text is a fixed prefix sent before the topic, so the provider's prompt
+# cache can reuse it from one call to the next; bump PROMPT_VERSION whenever the prefix changes
+POST_MODEL = "gpt-4o-mini"
+PROMPT_VERSION = "2"
+SYSTEM_PROMPT = "You are a helpful writing assistant."
+POST_INSTRUCTIONS = (
+    "Create a unique and engaging post on the topic the user gives, with a title and content. "
+    "The title should be catchy, between 8-12 words, and suitable for a blog post. "
+    "The content should be under 500 words and include relevant hashtags, SEO keywords, and emojis. "
+    "Do not include the word 'Title' in the title."
+)
+POST_PROMPT = "Topic: {topic}"
 
-# Prepare the credentials for Basic Auth
-auth_string = f"{username}:{password}"
-encoded_auth = base64.b64encode(auth_string.encode()).decode()
+# Topics repeat, and a cached post would repeat with them, so topic posts are only cached when
+# LLM_TOPIC_CACHE_TTL (seconds) is set
+TOPIC_CACHE_TTL = float(os.getenv("LLM_TOPIC_CACHE_TTL", "0"))
 
-# Headers with encoded authorization
-headers = {
-    "Authorization": f"Basic {encoded_auth}",
-    "Content-Type": "application/json"
-}
+# Name of this agent, for its jobs in the shared Batch API job directory and LLM_BACKEND_<AGENT_NAME>
+AGENT_NAME = "venezart_agent"
+
+# Completion backend (OpenAI, a local Ollama model, or a router between the two)
+llm = get_backend(AGENT_NAME, POST_MODEL)
+
+# Earlier posts, to skip posts that nearly repeat one and prefer unused topics (None when POST_DEDUP is false)
+post_index = get_post_index(AGENT_NAME)
+
+# Random topics drawn for each post wanted, so there are others to use when some were covered recently
+TOPIC_DRAWS = 5
 
 # Other functions...
 
@@ -56,90 +84,122 @@ def generate_post_topic():
     logger.info(f"Selected random topic: {topic}")
     return topic
 
+def pick_topics(count):
+    """ Up to count different random topics, preferring topics not used in the last POST_DEDUP_SUBJECT_WINDOW_HOURS.
+
+    Recently used topics fill the places fresh ones leave, so the topic check never stops the
+    agent from posting; a post that repeats an earlier one is caught afterwards by is_repeat.
+    """
+    candidates = list(dict.fromkeys(generate_post_topic() for _ in range(count * TOPIC_DRAWS)))
+    topics = post_index.fresh(candidates, count) if post_index is not None else candidates[:count]
+    if len(topics) < count:
+        logger.info(f"Only {len(topics)} of {count} topics were not used recently; reusing others")
+        topics += [topic for topic in candidates if topic not in topics][:count - len(topics)]
+    return topics
+
+
+def is_repeat(title, content):
+    """ True when a generated post nearly repeats an earlier one, so it is not worth an image or a WordPress write """
+    return post_index is not None and post_index.find_duplicate(f"{title}\n{content}") is not None
+
+
+def remember_post(topic, title, content):
+    """ Add a published post to the post index """
+    if post_index is not None:
+        post_index.remember_post(topic, title, content)
+
+
 def get_category_id(slug):
     """ Get category ID by slug """
-    category_response = requests.get(f"{wordpress_url}/categories?slug={slug}", headers=headers)
-    if category_response.status_code == 200:
-        categories = category_response.json()
-        if categories:
-            category_id = categories[0]["id"]
-            logger.info(f"Category ID for '{slug}': {category_id}")
-            return category_id
-        else:
-            logger.error(f"Category with slug '{slug}' not found.")
-    else:
-        logger.error("Failed to retrieve categories:", category_response.status_code, category_response.text)
-    return None
+    return get_wp_client().get_category_id(slug)
+
+
+def get_category_ids(slugs):
+    """ Get category IDs by slugs in one lookup, in the same order as slugs """
+    return get_wp_client().get_category_ids(slugs)
 
 
 def get_tag_ids(slugs):
     """ Get tag IDs by slugs """
-    tag_ids = []
-    for slug in slugs:
-        tag_response = requests.get(f"{wordpress_url}/tags?slug={slug}", headers=headers)
-        if tag_response.status_code == 200:
-            tags = tag_response.json()
-            if tags:
-                tag_id = tags[0]["id"]
-                tag_ids.append(tag_id)
-                logger.info(f"Tag ID for '{slug}': {tag_id}")
-            else:
-                logger.error(f"Tag with slug '{slug}' not found.")
-        else:
-            logger.error(f"Failed to retrieve tag '{slug}': {tag_response.status_code}, {tag_response.text}")
-    return tag_ids
+    return get_wp_client().get_tag_ids(slugs)
+
+
+def parse_title(lines):
+    """ The title is the first non-empty line, without a "Title:" prefix """
+    for line in lines:
+        line = line.strip()
+        if line and not line.lower().startswith("title:"):
+            return line.lstrip("*").strip()  # Remove any asterisks or leading/trailing spaces
+    return None
+
+
+def parse_post(post_topic, full_content):
+    """ Split a completion into the post title, content and details: a structured (JSON) post, else the line format.
+
+    details holds the excerpt and tags of a structured post; a line-format post has none.
+    """
+    post = try_parse_structured_post(full_content)
+    if post:
+        return post["title"], post["body_html"], {"excerpt": post["excerpt"], "tags": post["tags"]}
+
+    lines = full_content.strip().splitlines()
+
+    # Extract the title from the first non-empty line, without a "Title:" prefix; the content follows it
+    for index, line in enumerate(lines):
+        title = parse_title([line])
+        if title:
+            return title, "\n".join(lines[index + 1:]).strip(), {}
+    return f"{post_topic.capitalize()} Insights", "\n".join(lines[1:]).strip(), {}  # Fallback title if none detected
+
+
+def prompt_prefix(structured):
+    """ The system message every post request starts with; it only changes with PROMPT_VERSION """
+    parts = [SYSTEM_PROMPT, POST_INSTRUCTIONS] + ([STRUCTURED_INSTRUCTIONS] if structured else [])
+    return "\n\n".join(parts)
+
+
+def post_prompts(structured):
+    """ The fixed prompt text, as part of the LLM cache key """
+    return [PROMPT_VERSION, prompt_prefix(structured), POST_PROMPT]
+
+
+def post_messages(post_topic, structured=False):
+    return [
+        {"role": "system", "content": prompt_prefix(structured)},
+        {"role": "user", "content": POST_PROMPT.format(topic=post_topic)},
+    ]
 
 
 def gpt_generate_v_post(post_topic):
+    """ Write a post on the topic: (title, content, details) as parse_post returns them """
     logger.info(f"Generating a post based on the following topic using ChatGPT API: {post_topic}...")
+    structured = structured_output_enabled()
+    title_stream = JsonTitleStream() if structured else TitleStream(parse_title)
     
+    def generate():
+        if structured:
+            return complete_post(llm, post_messages(post_topic, structured=True), post_messages(post_topic), title_stream)
+        return llm.complete(post_messages(post_topic), title_stream)
+
     try:
-        response = ai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful writing assistant."},
-                {
-                    "role": "user",
-                    "content": (
-                        f"Create a unique and engaging post on {post_topic} with a title and content. "
-                        f"The title should be catchy, between 8-12 words, and suitable for a blog post. "
-                        f"The content should be under 500 words and include relevant hashtags, SEO keywords, and emojis. "
-                        f"Do not include the word 'Title' in the title."
-                    ),
-                },
-            ],
+        full_content = cached_completion(
+            llm.model_id, post_prompts(structured), post_topic, generate, ttl=TOPIC_CACHE_TTL,
+            answered_by=llm.answered_by,
         )
-        
-        full_content = response.choices[0].message.content.strip()
-        lines = full_content.splitlines()
-        
-        # Extract the title from the first non-empty line, without a "Title:" prefix.
-        title = None
-        for line in lines:
-            line = line.strip()
-            if line and not line.lower().startswith("title:"):
-                title = line.lstrip("*").strip()  # Remove any asterisks or leading/trailing spaces
-                break
-        
-        if not title:
-            title = f"{post_topic.capitalize()} Insights"  # Fallback title if none detected
-
-        # Extract the content after the title
-        content_start_index = lines.index(title) + 1 if title in lines else 1
-        content = "\n".join(lines[content_start_index:]).strip()
+        title, content, details = parse_post(post_topic, full_content)
 
         logger.info(f"Generated Post - Title: {title}")
         logger.info(f"Content: {content}")
         
-        return title, content
+        return title, content, details
 
     except Exception as e:
         logger.error(f"Failed to generate post: {str(e)}")
-        return None, None
+        return None, None, {}
     
 
-def create_wordpress_post(title, content, category_ids, tag_ids, featured_image_id=None):
-    """ Create a WordPress post with tags, categories, and optionally an image """
+def build_post_data(title, content, category_ids, tag_ids, featured_image_id=None, excerpt=None):
+    """ Request body for a new WordPress post """
     post_data = {
         "title": title,
         "content": content,
@@ -148,52 +208,218 @@ def create_wordpress_post(title, content, category_ids, tag_ids, featured_image_
         "tags": tag_ids
     }
 
+    # Use the generated excerpt instead of WordPress's cut of the content
+    if excerpt:
+        post_data["excerpt"] = excerpt
+
     # Add featured image if available
     if featured_image_id:
         post_data["featured_media"] = featured_image_id
 
-    try:
-        response = requests.post(f"{wordpress_url}/posts", json=post_data, headers=headers)
-        if response.status_code == 201:
-            logger.info("Post created successfully: " + response.json().get("link"))
-        else:
-            logger.error(f"Failed to create post: {response.status_code}, {response.text}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"An error occurred while creating the post: {e}")
+    return post_data
+
+
+def merge_tag_ids(tag_ids, ids_by_tag):
+    """ tag_ids followed by the IDs found for a post's generated tags, without repeats """
+    return list(dict.fromkeys(list(tag_ids) + [tag_id for tag_id in ids_by_tag.values() if tag_id]))
+
+
+def post_tag_ids(tag_ids, details):
+    """ tag_ids plus the IDs of the post's generated tags (created only as WP_TERM_CREATE_POLICY allows) """
+    tags = details.get("tags")
+    return merge_tag_ids(tag_ids, get_wp_client().resolve_terms("tags", tags)) if tags else list(tag_ids)
+
+
+def create_wordpress_post(title, content, category_ids, tag_ids, featured_image_id=None, excerpt=None):
+    """ Create a WordPress post with tags, categories, and optionally an image """
+    get_wp_client().create_post(build_post_data(title, content, category_ids, tag_ids, featured_image_id, excerpt))
 
 # Main function to generate and create a WordPress post
 def main():
     # Toggle for enabling or disabling image generation and upload
     enable_image_generation = os.getenv("ENABLE_IMAGE_GENERATION", "true").lower() == "true"
 
-    topic = generate_post_topic()
-    topic_category_id = get_category_id("Blog")
-    just_release_category_id = get_category_id("just-release")
+    # Create the shared WordPress client early so its connection warms up in the background
+    get_wp_client()
+
+    topics = pick_topics(1)
+    if not topics:
+        return
+    topic = topics[0]
+    topic_category_id, just_release_category_id = get_category_ids(POST_CATEGORIES)
 
     # Adding tags
-    tag_ids = get_tag_ids(["art", "blog", "creativity", "3D", "AiArt", "Artists", "ArtLovers", "Artwork", "DigitalArt", "Innovation", "Tech"])
+    tag_ids = get_tag_ids(POST_TAGS)
 
     if topic_category_id and just_release_category_id:
-        post_title, post_content = gpt_generate_v_post(topic)
+        post_title, post_content, details = gpt_generate_v_post(topic)
+        if not post_title or is_repeat(post_title, post_content):
+            return
+        tag_ids = post_tag_ids(tag_ids, details)
 
         # Try to get an existing image
         existing_image_url = None
+        image_id = None
 
         if existing_image_url:
             # If the image is found, use it
             post_content = f"<img src='{existing_image_url}' alt='{topic}' />\n\n" + post_content
         elif enable_image_generation:
-            # If no existing image is found, generate a new one
-            image_path = generate_image(topic)  # Generate image based on the topic
-            image_url, image_id = upload_image_to_wordpress(image_path)
+            # If no existing image is found, generate a new one and upload it from memory
+            image_url, image_id = upload_generated_image(topic)
 
             # if image_url:
             #     post_content = f"<img src='{image_url}' alt='{topic}' />\n\n" + post_content
 
-        create_wordpress_post(post_title, post_content, [topic_category_id, just_release_category_id], tag_ids, image_id)
+        create_wordpress_post(post_title, post_content, [topic_category_id, just_release_category_id], tag_ids,
+                              image_id, details.get("excerpt"))
+        remember_post(topic, post_title, post_content)
+
+
+async def render_image(topic, render_lock=None):
+    """ Render the featured image off the event loop and return its encoded bytes, or None.
+
+    The image comes from the image worker when IMAGE_WORKER_ADDRESS is set, else from this process.
+    Posts written together share render_lock, so only one image is rendered at a time. A render that
+    is already under way cannot be stopped; when the task is cancelled it keeps the lock until it ends.
+    """
+    loop = asyncio.get_running_loop()
+    async with render_lock or asyncio.Lock():
+        rendering = loop.run_in_executor(None, render_image_bytes, topic)
+        try:
+            return await asyncio.shield(rendering)
+        except asyncio.CancelledError:
+            await asyncio.wait([rendering])
+            raise
+
+
+async def upload_image(wp, data, title):
+    """ Upload a rendered image from memory, named after the post, and return its media ID """
+    media = await wp.upload_media_bytes(data, f"ai_gen_image_{slugify(title)}.jpg")
+    return media.get("id") if media else None
+
+
+async def publish_post(wp, topic, category_ids, tag_ids, enable_image_generation=True, render_lock=None):
+    """ Write one post on the topic and create it; the text and image are made while the taxonomy resolves.
+
+    category_ids and tag_ids are awaitables shared by every post of the run. The image is only
+    uploaded once the post has passed its checks; the render is cancelled when the post is dropped.
+    """
+    loop = asyncio.get_running_loop()
+    render = asyncio.ensure_future(render_image(topic, render_lock)) if enable_image_generation else None
+
+    try:
+        (topic_category_id, just_release_category_id), tag_ids, generated = await asyncio.gather(
+            category_ids,
+            tag_ids,
+            loop.run_in_executor(completion_pool(), gpt_generate_v_post, topic),
+        )
+        post_title, post_content, details = generated
+        if not (topic_category_id and just_release_category_id and post_title):
+            return
+        if await loop.run_in_executor(None, is_repeat, post_title, post_content):
+            return
+        if details.get("tags"):
+            tag_ids = merge_tag_ids(tag_ids, await wp.resolve_terms("tags", details["tags"]))
+
+        data = await render if render else None
+        image_id = await upload_image(wp, data, post_title) if data else None
+        post_data = build_post_data(post_title, post_content, [topic_category_id, just_release_category_id], tag_ids,
+                                    image_id, details.get("excerpt"))
+        await wp.create_post(post_data)
+        await loop.run_in_executor(None, remember_post, topic, post_title, post_content)
+    finally:
+        if render:
+            render.cancel()  # Nothing to do once the image is in; otherwise the post was dropped
+
+
+async def async_main(count=None):
+    """ Same flow as main(), but the taxonomy lookups, text generation and image run concurrently.
+
+    count posts (default: POSTS_PER_RUN, 1) are written at once; their completions share the
+    LLM_WORKERS thread pool and the process-wide rate limiter.
+    """
+    enable_image_generation = os.getenv("ENABLE_IMAGE_GENERATION", "true").lower() == "true"
+    count = int(os.getenv("POSTS_PER_RUN", "1")) if count is None else count
+    loop = asyncio.get_running_loop()
+    wp = get_async_wp_client()
+
+    try:
+        category_ids = asyncio.ensure_future(wp.get_category_ids(POST_CATEGORIES))
+        tag_ids = asyncio.ensure_future(wp.get_tag_ids(POST_TAGS))
+        render_lock = asyncio.Lock()
+        topics = await loop.run_in_executor(None, pick_topics, count)
+        results = await asyncio.gather(
+            *(publish_post(wp, topic, category_ids, tag_ids, enable_image_generation, render_lock)
+              for topic in topics),
+            return_exceptions=True,
+        )
+        failures = [result for result in results if isinstance(result, Exception)]
+        for failure in failures:
+            logger.error(f"Failed to publish a post: {failure!r}")
+        if failures and len(failures) == len(topics):
+            raise failures[0]
+    finally:
+        await wp.aclose()
+        report_metrics()
+        report_rate_limits()
+
+
+def post_batch_results(job, outputs):
+    """ Create a draft for every completion in a finished batch, in as few WordPress requests as possible """
+    if outputs is None:
+        return  # Still running; the next bulk run picks it up
+
+    category_ids = get_category_ids(POST_CATEGORIES)
+    if not all(category_ids):
+        logger.error(f"Categories {POST_CATEGORIES} not found; keeping batch {job.batch_id} for the next run")
+        return
+    tag_ids = get_tag_ids(POST_TAGS)
+
+    posts, posts_data = [], []
+    for custom_id, full_content in outputs.items():
+        title, content, details = parse_post(job.subjects[custom_id], full_content)
+        if is_repeat(title, content):
+            continue
+        posts.append((job.subjects[custom_id], title, content))
+        posts_data.append(build_post_data(title, content, list(category_ids), post_tag_ids(tag_ids, details),
+                                          excerpt=details.get("excerpt")))
+    created = get_wp_client().create_posts(posts_data) if posts_data else []
+    for post, created_post in zip(posts, created):
+        if created_post:
+            remember_post(*post)
+    logger.info(f"Created {sum(1 for post in created if post)} of {len(job.subjects)} drafts from batch {job.batch_id}")
+    job.finish()
+
+
+def bulk_main(count):
+    """ Write count drafts on random topics through the OpenAI Batch API, at half the per-token price.
+
+    Finished batches from earlier runs are posted first. The new batch is waited on for up to
+    LLM_BATCH_WAIT seconds; if it is still running by then, the next bulk run posts it. Bulk
+    drafts have no featured image.
+    """
+    for job in pending_jobs(AGENT_NAME):
+        post_batch_results(job, collect_batch(get_openai_client(), job, timeout=0))
+
+    if count:
+        topics = {f"post-{index}": topic for index, topic in enumerate(pick_topics(count))}
+        if not topics:
+            return
+        structured = structured_output_enabled()
+        response_format = post_response_format() if structured else None
+        batch_requests = [batch_request(custom_id, POST_MODEL, post_messages(topic, structured), response_format)
+                          for custom_id, topic in topics.items()]
+        job = submit_batch(get_openai_client(), AGENT_NAME, batch_requests, topics)
+        post_batch_results(job, collect_batch(get_openai_client(), job))
 
 # Adding a loop to run continuously
 if __name__ == "__main__":
-    main()  # Run the main function to generate and post content
+    # BULK_POSTS=N writes N drafts in one Batch API job instead of one post right away
+    bulk_posts = int(os.getenv("BULK_POSTS", "0"))
+    if bulk_posts or os.getenv("BULK_COLLECT", "false").lower() == "true":
+        bulk_main(bulk_posts)
+    else:
+        asyncio.run(async_main())  # Run the main function to generate and post content
     
     
\ No newline at end of file
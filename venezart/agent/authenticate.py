@@ -1,34 +1,41 @@
-import tweepy
-import os
 import logging
-import openai
-from dotenv import load_dotenv
+import threading
+from config import get_config
 
 # Configure logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-
-# Load environment variables from the .env file
-logger.info("Loading environment variables from .env file...")
-load_dotenv()
-
-# Get Twitter API credentials from environment variables with error handling
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-
-if not OPENAI_API_KEY:
-    raise ValueError(
-        "OpenAI API key is missing. Please set the OPENAI_API_KEY environment variable."
-    )
+_client = None
+_client_lock = threading.Lock()
 
 
 def open_ai_auth():
     """
     Authenticate with OpenAI API using the provided API key.
+    Raises ValueError when OPENAI_API_KEY is not set.
     """
-    logger.info("Authenticating with OpenAI API...")
+    api_key = get_config().openai_api_key
+    if not api_key:
+        raise ValueError(
+            "OpenAI API key is missing. Please set the OPENAI_API_KEY environment variable."
+        )
+
+    import openai  # Imported here so runs that never call OpenAI do not pay for it
 
-    ai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    logger.info("Authenticating with OpenAI API...")
+    ai_client = openai.OpenAI(api_key=api_key)
     logger.info("Successfully authenticated with OpenAI API.")
     return ai_client
+
+
+def get_openai_client():
+    """
+    Return the process-wide OpenAI client, authenticating on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = open_ai_auth()
+    return _client
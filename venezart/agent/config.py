@@ -0,0 +1,49 @@
+import os
+import logging
+import threading
+from dotenv import load_dotenv
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_env_loaded = False
+_config = None
+_lock = threading.Lock()
+
+
+def load_env():
+    """ Load the .env file into the environment once per process; variables that are already set win """
+    global _env_loaded
+    if not _env_loaded:
+        with _lock:
+            if not _env_loaded:
+                load_dotenv()
+                _env_loaded = True
+
+
+class Config:
+    """ Credentials and connection settings shared by the agent's modules, read once from the environment """
+
+    def __init__(self, environ=None):
+        environ = os.environ if environ is None else environ
+        self.openai_api_key = environ.get("OPENAI_API_KEY")
+        self.wordpress_url = environ.get("WORDPRESS_URL")
+        self.wordpress_username = environ.get("WORDPRESS_USERNAME")
+        self.wordpress_password = environ.get("WORDPRESS_PASSWORD")
+        self.wp_pool_size = int(environ.get("WP_POOL_SIZE", "10"))
+        self.wp_connect_timeout = float(environ.get("WP_CONNECT_TIMEOUT", "5"))
+        self.wp_read_timeout = float(environ.get("WP_READ_TIMEOUT", "60"))
+        self.wp_max_concurrency = int(environ.get("WP_MAX_CONCURRENCY", "8"))
+        self.wp_prewarm = environ.get("WP_PREWARM", "true").lower() == "true"
+
+
+def get_config():
+    """ The process-wide Config, built (after loading .env) the first time something needs it """
+    global _config
+    if _config is None:
+        load_env()
+        with _lock:
+            if _config is None:
+                _config = Config()
+    return _config
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def normalize_subject(subject):
+    """ Canonical form of what a prompt is about (an article dict, a topic string, ...).
+
+    Key order, letter case and runs of whitespace do not change what the model is asked,
+    so they do not change the cache key either.
+    """
+    if isinstance(subject, dict):
+        return {str(key): normalize_subject(value) for key, value in sorted(subject.items()) if value is not None}
+    if isinstance(subject, (list, tuple)):
+        return [normalize_subject(value) for value in subject]
+    if isinstance(subject, str):
+        return " ".join(subject.split()).casefold()
+    return subject
+
+
+def completion_key(model, prompt, subject):
+    """ Content hash of everything that determines a completion: model, prompt template(s) and subject """
+    payload = json.dumps([model, prompt, normalize_subject(subject)], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """ Persistent LRU cache of completion texts, bounded by max_entries and expiring after ttl seconds """
+
+    def __init__(self, path, max_entries=500, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return OrderedDict()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable LLM cache {self.path}: {e}")
+            return OrderedDict()
+        # Least recently used first, as the eviction order expects
+        return OrderedDict(sorted(entries.items(), key=lambda item: item[1].get("used", item[1]["ts"])))
+
+    def save(self):
+        """ Write the cache to disk atomically """
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+
+    def get(self, key, ttl=None):
+        """ Cached text for key, or None when missing or older than ttl (default: the cache's ttl) """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry["ts"] < ttl:
+                self.hits += 1
+                entry["used"] = time.time()
+                self._entries.move_to_end(key)
+                return entry["text"]
+            self.misses += 1
+            return None
+
+    def set(self, key, text):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {"text": text, "ts": now, "used": now}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self.save()
+
+    def invalidate(self, key=None):
+        """ Drop one entry, or (with no key) everything """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        self.save()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """ The process-wide LLM cache configured from the environment, or None when LLM_CACHE is off """
+    global _cache
+    if os.getenv("LLM_CACHE", "true").lower() != "true":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache(
+                    os.getenv("LLM_CACHE_PATH", os.path.join("cache", "llm_cache.json")),
+                    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "500")),
+                    ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+                )
+    return _cache
+
+
+def cached_completion(model, prompt, subject, generate, ttl=None, answered_by=None):
+    """ Completion text for (model, prompt, subject), calling generate() only on a cache miss.
+
+    prompt is the unformatted template (or templates), so editing a prompt starts a fresh cache.
+    generate() must return the completion text; empty results and exceptions are not cached.
+    A ttl of 0 bypasses the cache for this call. answered_by() names the model that actually wrote
+    the text (a router may have fallen back to another one); the text is cached under that model,
+    so a lookup for model never returns another model's answer.
+    """
+    cache = get_llm_cache()
+    if cache is None or ttl == 0:
+        return generate()
+
+    key = completion_key(model, prompt, subject)
+    text = cache.get(key, ttl=ttl)
+    if text is not None:
+        stats = cache.stats()
+        logger.info(f"LLM cache hit ({stats['hits']} hits, {stats['misses']} misses); no completion requested")
+        return text
+
+    text = generate()
+    if text:
+        answered = answered_by() if answered_by else model
+        cache.set(key if answered == model else completion_key(answered, prompt, subject), text)
+    return text
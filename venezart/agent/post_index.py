@@ -0,0 +1,278 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+from authenticate import get_openai_client
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rows the matrix file starts with; it doubles whenever it is full
+INITIAL_CAPACITY = 256
+
+
+class HashingEmbedder:
+    """ Deterministic local embedding: word unigrams and bigrams hashed into dim buckets.
+
+    Needs no model and no network, so it suits tests and offline runs; it only sees shared wording,
+    where a model embedding also catches paraphrases.
+    """
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+        self.name = f"hashing{dim}"
+
+    def _bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = re.findall(r"\w+", text.casefold())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                column, sign = self._bucket(feature)
+                vectors[row, column] += sign
+        return vectors
+
+
+class OpenAIEmbedder:
+    """ Embeddings from the OpenAI API (text-embedding-3-small by default), all texts in one request """
+
+    def __init__(self, model="text-embedding-3-small", client=None):
+        self.model = model
+        self.name = f"openai-{model}"
+        self._client = client
+
+    def __call__(self, texts):
+        client = self._client or get_openai_client()
+        response = client.embeddings.create(model=self.model, input=list(texts))
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+
+def normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class PostIndex:
+    """ Embeddings of earlier posts, and of what they were about, for spotting near-duplicates before paying for a new one.
+
+    The unit-length vectors live in a memory-mapped float32 matrix (<path>.npy) that grows by
+    appending rows; labels, kinds and timestamps sit next to it in <path>.json. A row is a "post"
+    (title and content), searched for window seconds, or a "subject" (the topic or article a post
+    was written from), searched only for subject_window seconds: agents reuse a fixed set of
+    topics, and a topic must not be shut out for as long as the post written from it. A window of
+    None keeps rows searchable forever. A search is one matrix-vector product over the rows still
+    in their window. embedder(texts) returns one vector per text; any callable does.
+    """
+
+    def __init__(self, path, embedder, threshold=0.9, window=None, subject_window=None):
+        self.path = path
+        self.embedder = embedder
+        self.threshold = threshold
+        self.window = window
+        self.subject_window = subject_window
+        self.rejected = 0
+        self._matrix = None
+        self._labels = []
+        self._kinds = []
+        self._times = []
+        self._lock = threading.Lock()
+
+    @property
+    def matrix_path(self):
+        return f"{self.path}.npy"
+
+    @property
+    def meta_path(self):
+        return f"{self.path}.json"
+
+    def __len__(self):
+        with self._lock:
+            self._open()
+            return len(self._labels)
+
+    def _open(self):
+        """ Map the matrix file and read the labels on first use """
+        if self._matrix is not None:
+            return
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            matrix = np.load(self.matrix_path, mmap_mode="r+")
+            if len(meta["labels"]) > matrix.shape[0]:
+                raise ValueError("more labels than rows")
+            # Indexes written before kinds were stored hold (subject, post) pairs from remember_post
+            kinds = meta.get("kinds") or ["subject", "post"] * (len(meta["labels"]) // 2)
+            if len(kinds) != len(meta["labels"]):
+                kinds = ["post"] * len(meta["labels"])
+            self._matrix, self._labels, self._kinds, self._times = matrix, meta["labels"], kinds, meta["times"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Starting a new post index; {self.path} is unreadable: {e}")
+
+    def _reserve(self, rows, dim):
+        """ Make room for rows more vectors of size dim, doubling the matrix file as needed """
+        count = len(self._labels)
+        if self._matrix is not None and self._matrix.shape[1] != dim:
+            logger.warning(f"Embedding size changed ({self._matrix.shape[1]} -> {dim}); starting a new post index")
+            self._matrix, self._labels, self._kinds, self._times, count = None, [], [], [], 0
+        if self._matrix is not None and count + rows <= self._matrix.shape[0]:
+            return
+
+        capacity = max(INITIAL_CAPACITY, self._matrix.shape[0] if self._matrix is not None else 0)
+        while capacity < count + rows:
+            capacity *= 2
+        directory = os.path.dirname(self.matrix_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npy"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        if count:
+            grown[:count] = self._matrix[:count]
+        grown.flush()
+        del grown
+        self._matrix = None  # Unmap the old file before it is replaced
+        os.replace(tmp_path, self.matrix_path)
+        self._matrix = np.load(self.matrix_path, mmap_mode="r+")
+
+    def _save_meta(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"labels": self._labels, "kinds": self._kinds, "times": self._times}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def embed(self, texts):
+        return normalize_rows(np.asarray(self.embedder(list(texts)), dtype=np.float32))
+
+    def nearest(self, vectors):
+        """ (similarity, label) of the closest indexed entry for each vector; (0.0, None) when there is none """
+        with self._lock:
+            self._open()
+            count = len(self._labels)
+            if not count:
+                return [(0.0, None)] * len(vectors)
+            similarities = np.asarray(self._matrix[:count]) @ vectors.T
+            if self.window is not None or self.subject_window is not None:
+                similarities[~self._recent()] = -1.0
+            best = similarities.argmax(axis=0)
+            return [(float(similarities[row, column]), self._labels[row] if similarities[row, column] > -1.0 else None)
+                    for column, row in enumerate(best)]
+
+    def _recent(self):
+        """ Mask of the rows still inside the window of their kind """
+        now = time.time()
+        windows = {"post": self.window, "subject": self.subject_window}
+        cutoffs = [now - windows[kind] if windows[kind] is not None else float("-inf") for kind in self._kinds]
+        return np.asarray(self._times) >= np.asarray(cutoffs)
+
+    def add(self, texts, label, kind="post"):
+        """ Append the embeddings of texts, all under label, as rows of kind ("post" or "subject") """
+        vectors = self.embed(texts)
+        with self._lock:
+            self._open()
+            self._reserve(len(vectors), vectors.shape[1])
+            count = len(self._labels)
+            self._matrix[count:count + len(vectors)] = vectors
+            self._matrix.flush()
+            now = time.time()
+            self._labels.extend([label] * len(vectors))
+            self._kinds.extend([kind] * len(vectors))
+            self._times.extend([now] * len(vectors))
+            self._save_meta()
+
+    def fresh(self, candidates, count, text_of=str):
+        """ Up to count of candidates, in order, that are near-duplicates neither of an indexed post nor of each other.
+
+        All candidates are embedded in one embedder call. If that fails, the first count are returned
+        unchecked: skipping duplicates saves work, it must not stop the run.
+        """
+        if not candidates:
+            return []
+        try:
+            vectors = self.embed([text_of(candidate) for candidate in candidates])
+        except Exception as e:
+            logger.warning(f"Could not check for duplicate posts: {e}")
+            return list(candidates[:count])
+
+        chosen = []  # Positions in candidates
+        for position, (vector, (similarity, label)) in enumerate(zip(vectors, self.nearest(vectors))):
+            if len(chosen) == count:
+                break
+            if similarity >= self.threshold:
+                logger.info(f"Skipping {text_of(candidates[position])[:80]!r}: "
+                            f"{similarity:.2f} similar to the earlier post {label!r}")
+                self.rejected += 1
+            elif chosen and float((vectors[chosen] @ vector).max()) >= self.threshold:
+                self.rejected += 1  # Too close to another post of this run
+            else:
+                chosen.append(position)
+        return [candidates[position] for position in chosen]
+
+    def find_duplicate(self, text):
+        """ Label of an indexed post text is a near-duplicate of, or None (also when the check fails) """
+        try:
+            similarity, label = self.nearest(self.embed([text]))[0]
+        except Exception as e:
+            logger.warning(f"Could not check for duplicate posts: {e}")
+            return None
+        if similarity >= self.threshold:
+            logger.info(f"Generated post is {similarity:.2f} similar to the earlier post {label!r}")
+            self.rejected += 1
+            return label
+        return None
+
+    def remember_post(self, subject, title, content):
+        """ Index a published post: what it was about (a subject row) and what it says, both labelled with its title """
+        try:
+            self.add([subject], title, kind="subject")
+            self.add([f"{title}\n{content}"], title)
+        except Exception as e:
+            logger.warning(f"Could not add {title!r} to the post index: {e}")
+
+    def stats(self):
+        return {"size": len(self), "rejected": self.rejected}
+
+
+def get_embedder():
+    """ POST_DEDUP_EMBEDDER: openai (POST_DEDUP_EMBEDDING_MODEL, text-embedding-3-small) or hashing """
+    choice = os.getenv("POST_DEDUP_EMBEDDER", "openai").lower()
+    if choice == "openai":
+        return OpenAIEmbedder(os.getenv("POST_DEDUP_EMBEDDING_MODEL", "text-embedding-3-small"))
+    if choice == "hashing":
+        return HashingEmbedder()
+    raise ValueError(f"Unknown post embedder {choice!r}; expected openai or hashing")
+
+
+def get_post_index(name, embedder=None):
+    """ The post index of agent name, or None when POST_DEDUP is false.
+
+    Entries are kept per embedder under POST_INDEX_DIR (default cache/post_index); a candidate at
+    least POST_DEDUP_THRESHOLD (0.9) cosine-similar to a post from the last POST_DEDUP_WINDOW_DAYS
+    (30; 0 for no limit) counts as a duplicate. The topic or article of a post only blocks its
+    reuse for POST_DEDUP_SUBJECT_WINDOW_HOURS (24; 0 for no limit), so a fixed topic list can be
+    cycled through while posts that repeat an earlier one are still caught. Nothing is read until
+    the index is first used.
+    """
+    if os.getenv("POST_DEDUP", "true").lower() != "true":
+        return None
+    embedder = embedder or get_embedder()
+    window_days = float(os.getenv("POST_DEDUP_WINDOW_DAYS", "30"))
+    subject_hours = float(os.getenv("POST_DEDUP_SUBJECT_WINDOW_HOURS", "24"))
+    return PostIndex(
+        os.path.join(os.getenv("POST_INDEX_DIR", os.path.join("cache", "post_index")), f"{name}-{embedder.name}"),
+        embedder,
+        threshold=float(os.getenv("POST_DEDUP_THRESHOLD", "0.9")),
+        window=window_days * 24 * 3600 if window_days > 0 else None,
+        subject_window=subject_hours * 3600 if subject_hours > 0 else None,
+    )
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import logging
+import threading
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TaxonomyCache:
+    """ Persistent slug-to-ID cache for WordPress taxonomies (categories, tags).
+
+    Slugs that do not exist on the site are remembered too (negative entries, with their own
+    shorter TTL) so a missing term is not looked up again on every run. Term IDs only mean
+    something on the site they came from: the file records site, and a file written for another
+    site (or before sites were recorded) is ignored rather than read.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, negative_ttl=3600, site=None):
+        self.path = path
+        self.site = site
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable taxonomy cache {self.path}: {e}")
+            return {}
+        if not isinstance(data.get("terms"), dict) or data.get("site") != self.site:
+            logger.warning(f"Ignoring taxonomy cache {self.path}: it was not written for {self.site}")
+            return {}
+        return data["terms"]
+
+    def save(self):
+        """ Write the cache to disk atomically """
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"site": self.site, "terms": self._data}, f)
+            os.replace(tmp_path, self.path)
+
+    def lookup(self, taxonomy, slug):
+        """ Return (cached, term_id). cached is False for unknown or expired slugs;
+        (True, None) means the slug is known not to exist.
+        """
+        with self._lock:
+            entry = self._data.get(taxonomy, {}).get(slug)
+            if entry:
+                age = time.time() - entry["ts"]
+                if entry["id"] is not None and age < self.ttl:
+                    self.hits += 1
+                    return True, entry["id"]
+                if entry["id"] is None and age < self.negative_ttl:
+                    self.negative_hits += 1
+                    return True, None
+            self.misses += 1
+            return False, None
+
+    def get(self, taxonomy, slug):
+        """ Return the cached term ID for a slug, or None when it is unknown, missing or expired """
+        return self.lookup(taxonomy, slug)[1]
+
+    def set_many(self, taxonomy, ids_by_slug):
+        """ Store several slug -> ID pairs and persist them """
+        if not ids_by_slug:
+            return
+        now = time.time()
+        with self._lock:
+            terms = self._data.setdefault(taxonomy, {})
+            for slug, term_id in ids_by_slug.items():
+                terms[slug] = {"id": term_id, "ts": now}
+        self.save()
+
+    def set_missing(self, taxonomy, slugs):
+        """ Remember slugs that do not exist on the site """
+        if not slugs:
+            return
+        self.set_many(taxonomy, {slug: None for slug in slugs})
+
+    def invalidate(self, taxonomy=None, slug=None):
+        """ Drop one slug, one taxonomy, or (with no arguments) everything """
+        with self._lock:
+            if taxonomy is None:
+                self._data = {}
+            elif slug is None:
+                self._data.pop(taxonomy, None)
+            else:
+                self._data.get(taxonomy, {}).pop(slug, None)
+        self.save()
+        logger.info(f"Invalidated taxonomy cache (taxonomy={taxonomy}, slug={slug})")
+
+    def stats(self):
+        return {"hits": self.hits, "negative_hits": self.negative_hits, "misses": self.misses}
@@ -0,0 +1,158 @@
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# WordPress rejects batches larger than this unless the site raises rest_get_max_batch_size
+MAX_BATCH_SIZE = 25
+
+
+class BatchItem:
+    """ Outcome of one operation in a batch; filled in when the batch is submitted """
+
+    def __init__(self, method, path, body):
+        self.method = method
+        self.path = path
+        self.body = body
+        self.status = None
+        self._response = None
+        self._http_response = None
+
+    @property
+    def response(self):
+        """ Response body; for operations sent on their own it is only decoded on first access """
+        if self._http_response is not None:
+            http_response, self._http_response = self._http_response, None
+            try:
+                self._response = http_response.json()
+            except ValueError:
+                self._response = None
+        return self._response
+
+    @response.setter
+    def response(self, value):
+        self._response = value
+        self._http_response = None
+
+    def set_http_response(self, http_response):
+        self.status = http_response.status_code
+        self._http_response = http_response
+
+    @property
+    def ok(self):
+        return self.status is not None and 200 <= self.status < 300
+
+    def __repr__(self):
+        return f"BatchItem({self.method} {self.path}, status={self.status})"
+
+
+def with_fields(path, fields):
+    """ path with a _fields query, so WordPress only renders and returns those fields """
+    return f"{path}?_fields={fields}" if fields else path
+
+
+def batch_payload(namespace, items):
+    """ /batch/v1 request body for items; their paths are relative to namespace ("/wp/v2") """
+    return {
+        "validation": "normal",
+        "requests": [
+            {"method": item.method, "path": f"{namespace}{item.path}", "body": item.body}
+            for item in items
+        ],
+    }
+
+
+def apply_batch_responses(items, results):
+    """ Copy each per-request status and body from a /batch/v1 response onto its item """
+    for item, result in zip(items, results):
+        item.status = result.get("status")
+        item.response = result.get("body")
+        if not item.ok:
+            logger.error(f"Batched {item.method} {item.path} failed: {item.status}, {item.response}")
+
+
+class WordPressBatch:
+    """ Collects create/update operations (posts, terms) and sends them to /batch/v1, up to 25 per request.
+
+    Each call returns a BatchItem that holds that operation's status and response body once
+    submit() has run. Sites without the batch endpoint (WordPress < 5.6) get the same operations
+    as individual requests, pipelined over the client's connection pool.
+    """
+
+    def __init__(self, client, max_batch_size=MAX_BATCH_SIZE):
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.items = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.submit()
+
+    def add(self, method, path, body):
+        item = BatchItem(method, path, body)
+        self.items.append(item)
+        return item
+
+    def create_post(self, post_data, fields=None):
+        return self.add("POST", with_fields("/posts", fields), post_data)
+
+    def update_post(self, post_id, post_data, fields=None):
+        return self.add("POST", with_fields(f"/posts/{post_id}", fields), post_data)
+
+    def submit(self):
+        """ Send every queued operation and return the BatchItems in the order they were added """
+        items, self.items = self.items, []
+        pending = []
+        for start in range(0, len(items), self.max_batch_size):
+            chunk = items[start:start + self.max_batch_size]
+            # batch_supported flips to False on the first 404, so later chunks skip straight to the fallback
+            if not (self.client.batch_supported and self.client.namespace and self._send_batch(chunk)):
+                pending.extend(chunk)
+
+        if pending:
+            self._send_individually(pending)
+
+        succeeded = sum(1 for item in items if item.ok)
+        logger.info(f"Batch finished: {succeeded}/{len(items)} operations succeeded")
+        return items
+
+    def _send_batch(self, chunk):
+        """ Send one /batch/v1 request; returns False only when the site has no batch endpoint.
+
+        Other failures are not retried one by one: the batch may have been partly applied, and
+        resending it could create duplicate posts. Those items are left with status None.
+        """
+        payload = batch_payload(self.client.namespace, chunk)
+        try:
+            response = self.client.send("POST", self.client.batch_url, endpoint="wordpress_batch", json=payload)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"An error occurred while sending a batch of {len(chunk)} operations: {e}")
+            return True
+
+        if response.status_code == 404:
+            logger.warning("WordPress batch endpoint not available; falling back to individual requests.")
+            self.client.batch_supported = False
+            return False
+        if response.status_code != 207 and response.status_code != 200:
+            logger.error(f"Batch request failed: {response.status_code}, {response.text}")
+            return True
+
+        apply_batch_responses(chunk, response.json().get("responses", []))
+        return True
+
+    def _send_individually(self, items):
+        def send(item):
+            try:
+                item.set_http_response(self.client.request(item.method, item.path, json=item.body))
+            except requests.exceptions.RequestException as e:
+                logger.error(f"An error occurred during {item.method} {item.path}: {e}")
+
+        # Bounded by the connection pool so every worker reuses a kept-alive connection
+        with ThreadPoolExecutor(max_workers=self.client.pool_size) as executor:
+            list(executor.map(send, items))
@@ -1,149 +1,273 @@
-import time
-
 # Import the necessary modules (the rest of your script remains unchanged)
 import os
+import asyncio
 import logging
 import random
 # import ollama
-import base64
+import httpx
 import requests
-from dotenv import load_dotenv
-from authenticate import open_ai_auth
-from generate_image import generate_image, upload_image_to_wordpress  # Import the image generation function
-from get_news import fetch_latest_news, extract_image  # Import the function to fetch the latest news
-# Import functions from the other modules
-from upload_image_to_wordpress import upload_image_to_wordpress  # Import the function to upload image to WordPress
-from io import BytesIO
+from urllib.parse import urlparse
+from config import load_env
+from authenticate import get_openai_client
+from wp_client import get_wp_client
+from async_wp_client import get_async_wp_client
+from resilience import async_resilient_request, report_metrics, resilient_request
+from llm_cache import cached_completion
+from llm_stream import TitleStream
+from llm_limiter import completion_pool, report_rate_limits
+from llm_tokens import count_message_tokens
+from llm_backend import get_backend
+from llm_batch import batch_request, collect_batch, pending_jobs, submit_batch
+from llm_structured import (
+    STRUCTURED_INSTRUCTIONS, JsonTitleStream, complete_post, post_response_format, structured_output_enabled,
+    try_parse_structured_post,
+)
+from post_index import get_post_index
+from get_news import fetch_latest_news, extract_image, compact_article  # Import the function to fetch the latest news
 
 # Configure logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Load environment variables from a .env file
-load_dotenv()
+load_env()
+
+# Categories and tags attached to every post
+POST_CATEGORIES = ["Blog", "just-release"]
+# Size of the pieces an article image is streamed in
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
-# Environment variables
-wordpress_url = os.getenv("WORDPRESS_URL")
-username = os.getenv("WORDPRESS_USERNAME")
-password = os.getenv("WORDPRESS_PASSWORD")
+POST_TAGS = ["art", "blog", "creativity", "3D", "AiArt", "Artists", "ArtLovers", "Artwork", "DigitalArt", "Innovation", "Tech"]
 
-ai_client = open_ai_auth()
+# Completion model and prompts; they are part of the LLM cache key, so editing them starts a fresh cache.
+# The system and instruction text is a fixed prefix sent before the article, so the provider's prompt
+# cache can reuse it from one call to the next; bump PROMPT_VERSION whenever the prefix changes
+POST_MODEL = "gpt-4o-mini"
+PROMPT_VERSION = "2"
+SYSTEM_PROMPT = "You are a helpful writing assistant."
+POST_INSTRUCTIONS = (
+    "Create a unique and engaging post about the news article the user sends, with a title and content. "
+    "The title should be catchy, between 8-12 words, and suitable for a blog post. "
+    "The content should be under 500 words and include relevant hashtags, SEO keywords, and emojis. "
+    "Do not include the word 'Title' in the title."
+)
+POST_PROMPT = "{article}"
+# Tokens of article text (title, description and content) sent with each prompt
+ARTICLE_TOKEN_BUDGET = int(os.getenv("ARTICLE_TOKEN_BUDGET", "300"))
 
-# Prepare the credentials for Basic Auth
-auth_string = f"{username}:{password}"
-encoded_auth = base64.b64encode(auth_string.encode()).decode()
+# Name of this agent, for its jobs in the shared Batch API job directory and LLM_BACKEND_<AGENT_NAME>
+AGENT_NAME = "venezart_news"
 
-# Headers with encoded authorization
-headers = {
-    "Authorization": f"Basic {encoded_auth}",
-    "Content-Type": "application/json"
-}
+# Completion backend (OpenAI, a local Ollama model, or a router between the two)
+llm = get_backend(AGENT_NAME, POST_MODEL)
 
+# Earlier posts, to skip articles and posts that would nearly repeat one (None when POST_DEDUP is false)
+post_index = get_post_index(AGENT_NAME)
 
 
 def download_image(image_url):
-    """ Download an image from the given URL and save it locally """
+    """ Start a streaming download of the given image; the body is read later, while it is uploaded """
     try:
-        response = requests.get(image_url)
+        response = resilient_request("GET", image_url, endpoint="image_download", stream=True)
         if response.status_code == 200:
-            # Save image locally
-            image_path = "temp_image.jpg"
-            with open(image_path, "wb") as f:
-                f.write(response.content)
-            logger.info(f"Image downloaded successfully from {image_url}")
-            return image_path
+            logger.info(f"Image download started from {image_url}")
+            return response
         else:
             logger.error(f"Failed to download image: {response.status_code}, {response.text}")
+            response.close()
     except requests.exceptions.RequestException as e:
         logger.error(f"An error occurred while downloading the image: {e}")
 
     return None
 
 
+def download_length(headers):
+    """ Length of the bytes a download will yield, or None when unknown.
+
+    A compressed download is decoded on the fly, so its Content-Length does not match what is uploaded.
+    """
+    content_length = headers.get("Content-Length")
+    if not content_length or headers.get("Content-Encoding", "identity").lower() != "identity":
+        return None
+    return int(content_length)
+
+
+def article_images_enabled():
+    """ Copy an article's own image (urlToImage) into the media library as the featured image.
+
+    Off unless REHOST_ARTICLE_IMAGES is true: the images belong to their publishers.
+    """
+    return os.getenv("REHOST_ARTICLE_IMAGES", "false").lower() == "true"
+
+
+def article_image_filename(image_url):
+    return os.path.basename(urlparse(image_url).path) or "article_image.jpg"
+
+
+def upload_article_image(article):
+    """ Stream the article's image straight from its source into the media library and return the media ID """
+    image_url = extract_image(article)
+    if not image_url:
+        return None
+
+    # The same article image may already be in the media library from an earlier run
+    media = get_wp_client().find_media(image_url)
+    if media:
+        return media.get("id")
+
+    response = download_image(image_url)
+    if response is None:
+        return None
+
+    with response:
+        media = get_wp_client().upload_media_bytes(
+            response.iter_content(chunk_size=UPLOAD_CHUNK_SIZE),
+            article_image_filename(image_url),
+            response.headers.get("Content-Type", "image/jpeg"),
+            content_length=download_length(response.headers),
+            source_url=image_url,
+        )
+    return media.get("id") if media else None
+
+
+async def upload_article_image_async(article, ready=None):
+    """ Async version of upload_article_image; the download is piped into the upload chunk by chunk.
+
+    When ready (an awaitable) is given, the download is started right away but nothing is uploaded
+    until it resolves.
+    """
+    image_url = extract_image(article)
+    if not image_url:
+        return None
+
+    media = get_async_wp_client().find_media(image_url)
+    if media:
+        return media.get("id")
+
+    try:
+        async with httpx.AsyncClient(follow_redirects=True) as client:
+            response = await async_resilient_request(client, "GET", image_url, endpoint="image_download", stream=True)
+            try:
+                if response.status_code != 200:
+                    logger.error(f"Failed to download image: {response.status_code}")
+                    return None
+                if ready is not None:
+                    await ready
+
+                media = await get_async_wp_client().upload_media_bytes(
+                    response.aiter_bytes(UPLOAD_CHUNK_SIZE),
+                    article_image_filename(image_url),
+                    response.headers.get("Content-Type", "image/jpeg"),
+                    content_length=download_length(response.headers),
+                    source_url=image_url,
+                )
+            finally:
+                await response.aclose()
+    except httpx.HTTPError as e:
+        logger.error(f"An error occurred while downloading the image: {e}")
+        return None
+    return media.get("id") if media else None
+
+
 def get_category_id(slug):
     """ Get category ID by slug """
-    category_response = requests.get(f"{wordpress_url}/categories?slug={slug}", headers=headers)
-    if category_response.status_code == 200:
-        categories = category_response.json()
-        if categories:
-            category_id = categories[0]["id"]
-            logger.info(f"Category ID for '{slug}': {category_id}")
-            return category_id
-        else:
-            logger.error(f"Category with slug '{slug}' not found.")
-    else:
-        logger.error("Failed to retrieve categories:", category_response.status_code, category_response.text)
-    return None
+    return get_wp_client().get_category_id(slug)
+
+
+def get_category_ids(slugs):
+    """ Get category IDs by slugs in one lookup, in the same order as slugs """
+    return get_wp_client().get_category_ids(slugs)
 
 
 def get_tag_ids(slugs):
     """ Get tag IDs by slugs """
-    tag_ids = []
-    for slug in slugs:
-        tag_response = requests.get(f"{wordpress_url}/tags?slug={slug}", headers=headers)
-        if tag_response.status_code == 200:
-            tags = tag_response.json()
-            if tags:
-                tag_id = tags[0]["id"]
-                tag_ids.append(tag_id)
-                logger.info(f"Tag ID for '{slug}': {tag_id}")
-            else:
-                logger.error(f"Tag with slug '{slug}' not found.")
-        else:
-            logger.error(f"Failed to retrieve tag '{slug}': {tag_response.status_code}, {tag_response.text}")
-    return tag_ids
+    return get_wp_client().get_tag_ids(slugs)
+
+
+def parse_title(lines):
+    """ The title is the first non-empty line, without a "Title:" prefix """
+    for line in lines:
+        line = line.strip()
+        if line and not line.lower().startswith("title:"):
+            return line.lstrip("*").strip()  # Remove any asterisks or leading/trailing spaces
+    return None
+
+
+def parse_post(article, full_content):
+    """ Split a completion into the post title, content and details: a structured (JSON) post, else the line format.
+
+    details holds the excerpt and tags of a structured post; a line-format post has none.
+    """
+    post = try_parse_structured_post(full_content)
+    if post:
+        return post["title"], post["body_html"], {"excerpt": post["excerpt"], "tags": post["tags"]}
+
+    lines = full_content.strip().splitlines()
+
+    # Extract the title from the first non-empty line, without a "Title:" prefix; the content follows it
+    for index, line in enumerate(lines):
+        title = parse_title([line])
+        if title:
+            return title, "\n".join(lines[index + 1:]).strip(), {}
+    # Fallback title if none detected
+    return f"{article.get('title') or 'News'} Insights", "\n".join(lines[1:]).strip(), {}
+
+
+def article_prompt(article):
+    """ The article as it is sent to the model: only the fields that matter, within ARTICLE_TOKEN_BUDGET """
+    return compact_article(article, ARTICLE_TOKEN_BUDGET, POST_MODEL)
+
+
+def prompt_prefix(structured):
+    """ The system message every post request starts with; it only changes with PROMPT_VERSION """
+    parts = [SYSTEM_PROMPT, POST_INSTRUCTIONS] + ([STRUCTURED_INSTRUCTIONS] if structured else [])
+    return "\n\n".join(parts)
+
+
+def post_prompts(structured):
+    """ The fixed prompt text, as part of the LLM cache key """
+    return [PROMPT_VERSION, prompt_prefix(structured), POST_PROMPT]
+
+
+def post_messages(article, structured=False):
+    return [
+        {"role": "system", "content": prompt_prefix(structured)},
+        {"role": "user", "content": POST_PROMPT.format(article=article_prompt(article))},
+    ]
 
 
 def gpt_generate_post(article):
-    logger.info(f"Generating a post based on the following topic using ChatGPT API: {article}...")
+    """ Write a post about the article: (title, content, details) as parse_post returns them """
+    structured = structured_output_enabled()
+    messages = post_messages(article, structured)
+    logger.info(f"Generating a post about {article.get('title')!r} "
+                f"({count_message_tokens(messages, POST_MODEL)} input tokens)...")
+    logger.debug(f"Article: {article}")
+    title_stream = JsonTitleStream() if structured else TitleStream(parse_title)
     
-    try:
-        response = ai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful writing assistant."},
-                {
-                    "role": "user",
-                    "content": (
-                        f"Create a unique and engaging post about this article, {article} with a title and content. "
-                        f"The title should be catchy, between 8-12 words, and suitable for a blog post. "
-                        f"The content should be under 500 words and include relevant hashtags, SEO keywords, and emojis. "
-                        f"Do not include the word 'Title' in the title."
-                    ),
-                },
-            ],
-        )
-        
-        full_content = response.choices[0].message.content.strip()
-        lines = full_content.splitlines()
-        
-        # Extract the title from the first non-empty line, without a "Title:" prefix.
-        title = None
-        for line in lines:
-            line = line.strip()
-            if line and not line.lower().startswith("title:"):
-                title = line.lstrip("*").strip()  # Remove any asterisks or leading/trailing spaces
-                break
-        
-        if not title:
-            title = f"{article.capitalize()} Insights"  # Fallback title if none detected
+    def generate():
+        if structured:
+            return complete_post(llm, messages, post_messages(article), title_stream)
+        return llm.complete(messages, title_stream)
 
-        # Extract the content after the title
-        content_start_index = lines.index(title) + 1 if title in lines else 1
-        content = "\n".join(lines[content_start_index:]).strip()
+    try:
+        # The same article often comes back from NewsAPI on later runs; reuse the post written for it
+        full_content = cached_completion(llm.model_id, post_prompts(structured), article_prompt(article), generate,
+                                         answered_by=llm.answered_by)
+        title, content, details = parse_post(article, full_content)
 
         logger.info(f"Generated Post - Title: {title}")
         logger.info(f"Content: {content}")
         
-        return title, content
+        return title, content, details
 
     except Exception as e:
         logger.error(f"Failed to generate post: {str(e)}")
-        return None, None
+        return None, None, {}
     
 
-def create_wordpress_post(title, content, category_ids, tag_ids, featured_image_id=None):
-    """ Create a WordPress post with tags, categories, and optionally an image """
+def build_post_data(title, content, category_ids, tag_ids, featured_image_id=None, excerpt=None):
+    """ Request body for a new WordPress post """
     post_data = {
         "title": title,
         "content": content,
@@ -152,48 +276,231 @@ def create_wordpress_post(title, content, category_ids, tag_ids, featured_image_
         "tags": tag_ids
     }
 
+    # Use the generated excerpt instead of WordPress's cut of the content
+    if excerpt:
+        post_data["excerpt"] = excerpt
+
     # Add featured image if available
     if featured_image_id:
         post_data["featured_media"] = featured_image_id
 
-    try:
-        response = requests.post(f"{wordpress_url}/posts", json=post_data, headers=headers)
-        if response.status_code == 201:
-            logger.info("Post created successfully: " + response.json().get("link"))
-        else:
-            logger.error(f"Failed to create post: {response.status_code}, {response.text}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"An error occurred while creating the post: {e}")
+    return post_data
+
+
+def merge_tag_ids(tag_ids, ids_by_tag):
+    """ tag_ids followed by the IDs found for a post's generated tags, without repeats """
+    return list(dict.fromkeys(list(tag_ids) + [tag_id for tag_id in ids_by_tag.values() if tag_id]))
+
+
+def post_tag_ids(tag_ids, details):
+    """ tag_ids plus the IDs of the post's generated tags (created only as WP_TERM_CREATE_POLICY allows) """
+    tags = details.get("tags")
+    return merge_tag_ids(tag_ids, get_wp_client().resolve_terms("tags", tags)) if tags else list(tag_ids)
+
+
+def create_wordpress_post(title, content, category_ids, tag_ids, featured_image_id=None, excerpt=None):
+    """ Create a WordPress post with tags, categories, and optionally an image """
+    get_wp_client().create_post(build_post_data(title, content, category_ids, tag_ids, featured_image_id, excerpt))
+
+
+def fresh_articles(articles, count):
+    """ Up to count of the articles, in order, leaving out articles too close to a recent post """
+    if post_index is None:
+        return articles[:count]
+    return post_index.fresh(articles, count, text_of=article_prompt)
+
+
+def pick_articles(articles, count):
+    """ Up to count randomly selected articles that do not repeat a recent post """
+    selected = fresh_articles(random.sample(articles, len(articles)), count)
+    for article in selected:
+        logger.info(f"The randomly selected article for the post is: {article.get('title')}")
+        logger.debug(f"Selected article: {article}")
+    if len(selected) < count:
+        logger.warning(f"Only {len(selected)} of {len(articles)} articles are not near-duplicates of recent posts")
+    return selected
+
+
+def is_repeat(title, content):
+    """ True when a generated post nearly repeats an earlier one, so it is not worth an image or a WordPress write """
+    return post_index is not None and post_index.find_duplicate(f"{title}\n{content}") is not None
+
+
+def remember_post(article, title, content):
+    """ Add a published post to the post index """
+    if post_index is not None:
+        post_index.remember_post(article_prompt(article), title, content)
+
 
 # Main function to generate and create a WordPress post
 def main():
-    # Toggle for enabling or disabling image generation and upload
-    enable_image_generation = os.getenv("ENABLE_IMAGE_GENERATION", "true").lower() == "true"
+    # Toggle for re-hosting the article's own image as the featured image
+    rehost_images = article_images_enabled()
+
+    # Create the shared WordPress client early so its connection warms up in the background
+    get_wp_client()
     
     articles = fetch_latest_news()
     if not articles:
         logger.error("No articles found. Stopping the app.")
         return
 
-    article_index = random.randint(0, len(articles) - 1)  # Randomly select an article
-    logger.info(f"Randomly selected article index: {article_index}")
-    article = articles[article_index]  # Get the first article from the list
-    logger.info(f"The randomly selected article for the post is: {article}")
+    selected = pick_articles(articles, 1)
+    if not selected:
+        return
+    article = selected[0]
 
-    
-    topic_category_id = get_category_id("Blog")
-    just_release_category_id = get_category_id("just-release")
+    topic_category_id, just_release_category_id = get_category_ids(POST_CATEGORIES)
 
     # Adding tags
-    tag_ids = get_tag_ids(["art", "blog", "creativity", "3D", "AiArt", "Artists", "ArtLovers", "Artwork", "DigitalArt", "Innovation", "Tech"])
+    tag_ids = get_tag_ids(POST_TAGS)
 
     if topic_category_id and just_release_category_id:
-        post_title, post_content = gpt_generate_post(article)
+        post_title, post_content, details = gpt_generate_post(article)
+        if not post_title or is_repeat(post_title, post_content):
+            return
+        tag_ids = post_tag_ids(tag_ids, details)
+        image_id = upload_article_image(article) if rehost_images else None
 
-        # Create the WordPress post with the extracted image
-        create_wordpress_post(post_title, post_content, [topic_category_id, just_release_category_id], tag_ids)
+        # Create the WordPress post, with the article's image when it is re-hosted
+        create_wordpress_post(post_title, post_content, [topic_category_id, just_release_category_id], tag_ids,
+                              image_id, details.get("excerpt"))
+        remember_post(article, post_title, post_content)
+
+
+async def publish_post(wp, article, category_ids, tag_ids, rehost_images=False):
+    """ Write one post about the article and create it; category_ids and tag_ids are awaitables shared by the run.
+
+    The article's image starts downloading while the post is written, but is only uploaded once the
+    post has passed its checks; the download is cancelled when the post is dropped.
+    """
+    loop = asyncio.get_running_loop()
+    checked = loop.create_future()
+    image = asyncio.ensure_future(upload_article_image_async(article, checked)) if rehost_images else None
+
+    try:
+        (topic_category_id, just_release_category_id), tag_ids, generated = await asyncio.gather(
+            category_ids,
+            tag_ids,
+            loop.run_in_executor(completion_pool(), gpt_generate_post, article),
+        )
+        post_title, post_content, details = generated
+        if not (topic_category_id and just_release_category_id and post_title):
+            return
+        if await loop.run_in_executor(None, is_repeat, post_title, post_content):
+            return
+        if details.get("tags"):
+            tag_ids = merge_tag_ids(tag_ids, await wp.resolve_terms("tags", details["tags"]))
+
+        checked.set_result(True)
+        image_id = await image if image else None
+        post_data = build_post_data(post_title, post_content, [topic_category_id, just_release_category_id], tag_ids,
+                                    image_id, details.get("excerpt"))
+        await wp.create_post(post_data)
+        await loop.run_in_executor(None, remember_post, article, post_title, post_content)
+    finally:
+        if image:
+            image.cancel()  # Nothing to do once the image is in; otherwise the post was dropped
+
+
+async def async_main(count=None):
+    """ Same flow as main(), but the taxonomy lookups run while the news is fetched and the post is written.
+
+    Posts about count different articles (default: POSTS_PER_RUN, 1) are written at once; their
+    completions share the LLM_WORKERS thread pool and the process-wide rate limiter.
+    """
+    rehost_images = article_images_enabled()
+    count = int(os.getenv("POSTS_PER_RUN", "1")) if count is None else count
+    loop = asyncio.get_running_loop()
+    wp = get_async_wp_client()
+    try:
+        category_ids = asyncio.ensure_future(wp.get_category_ids(POST_CATEGORIES))
+        tag_ids = asyncio.ensure_future(wp.get_tag_ids(POST_TAGS))
+
+        articles = await loop.run_in_executor(None, fetch_latest_news)
+        selected = await loop.run_in_executor(None, pick_articles, articles, count) if articles else []
+        if not selected:
+            if not articles:
+                logger.error("No articles found. Stopping the app.")
+            category_ids.cancel()
+            tag_ids.cancel()
+            return
+
+        results = await asyncio.gather(
+            *(publish_post(wp, article, category_ids, tag_ids, rehost_images) for article in selected),
+            return_exceptions=True,
+        )
+        failures = [result for result in results if isinstance(result, Exception)]
+        for failure in failures:
+            logger.error(f"Failed to publish a post: {failure!r}")
+        if failures and len(failures) == len(selected):
+            raise failures[0]
+    finally:
+        await wp.aclose()
+        report_metrics()
+        report_rate_limits()
+
+
+def post_batch_results(job, outputs):
+    """ Create a draft, with its article image, for every completion in a finished batch """
+    if outputs is None:
+        return  # Still running; the next bulk run picks it up
+
+    category_ids = get_category_ids(POST_CATEGORIES)
+    if not all(category_ids):
+        logger.error(f"Categories {POST_CATEGORIES} not found; keeping batch {job.batch_id} for the next run")
+        return
+    tag_ids = get_tag_ids(POST_TAGS)
+    rehost_images = article_images_enabled()
+
+    posts, posts_data = [], []
+    for custom_id, full_content in outputs.items():
+        article = job.subjects[custom_id]
+        title, content, details = parse_post(article, full_content)
+        if is_repeat(title, content):
+            continue
+        image_id = upload_article_image(article) if rehost_images else None
+        posts.append((article, title, content))
+        posts_data.append(build_post_data(title, content, list(category_ids), post_tag_ids(tag_ids, details), image_id,
+                                          details.get("excerpt")))
+    created = get_wp_client().create_posts(posts_data) if posts_data else []
+    for post, created_post in zip(posts, created):
+        if created_post:
+            remember_post(*post)
+    logger.info(f"Created {sum(1 for post in created if post)} of {len(job.subjects)} drafts from batch {job.batch_id}")
+    job.finish()
+
+
+def bulk_main(count):
+    """ Write drafts for up to count of the latest articles through the OpenAI Batch API, at half the per-token price.
+
+    Finished batches from earlier runs are posted first. The new batch is waited on for up to
+    LLM_BATCH_WAIT seconds; if it is still running by then, the next bulk run posts it.
+    """
+    for job in pending_jobs(AGENT_NAME):
+        post_batch_results(job, collect_batch(get_openai_client(), job, timeout=0))
+
+    if count:
+        # Fetch more than needed, in case some of the latest articles were covered recently
+        articles = fresh_articles(fetch_latest_news(top_n=count * 2) or [], count)
+        if not articles:
+            logger.error("No new articles found. Stopping the app.")
+            return
+
+        subjects = {f"post-{index}": article for index, article in enumerate(articles)}
+        structured = structured_output_enabled()
+        response_format = post_response_format() if structured else None
+        batch_requests = [batch_request(custom_id, POST_MODEL, post_messages(article, structured), response_format)
+                          for custom_id, article in subjects.items()]
+        job = submit_batch(get_openai_client(), AGENT_NAME, batch_requests, subjects)
+        post_batch_results(job, collect_batch(get_openai_client(), job))
 
 
 # Adding a loop to run continuously
 if __name__ == "__main__":
-    main()  # Run the main function to generate and post content
\ No newline at end of file
+    # BULK_POSTS=N writes drafts for up to N articles in one Batch API job instead of one post right away
+    bulk_posts = int(os.getenv("BULK_POSTS", "0"))
+    if bulk_posts or os.getenv("BULK_COLLECT", "false").lower() == "true":
+        bulk_main(bulk_posts)
+    else:
+        asyncio.run(async_main())  # Run the main function to generate and post content
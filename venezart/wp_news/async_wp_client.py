@@ -0,0 +1,300 @@
+import os
+import asyncio
+import hashlib
+import logging
+import httpx
+from config import get_config
+from resilience import async_resilient_request
+from wp_batch import MAX_BATCH_SIZE, BatchItem, apply_batch_responses, batch_payload, with_fields
+from wp_client import (
+    ACCEPT_ENCODING,
+    MEDIA_FIELDS,
+    POST_FIELDS,
+    TERM_FIELDS,
+    TERMS_PER_PAGE,
+    basic_auth_header,
+    build_media_index,
+    build_taxonomy_cache,
+    created_term_ids,
+    guess_content_type,
+    is_stale_media_error,
+    is_stale_term_error,
+    media_headers,
+    merge_fetched_terms,
+    new_term_body,
+    ordered_category_ids,
+    ordered_tag_ids,
+    split_cached_slugs,
+    split_rest_namespace,
+    term_create_policy,
+    term_creation_allowed,
+    term_lookup_params,
+    unresolved_names,
+)
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class AsyncWordPressClient:
+    """ asyncio counterpart of WordPressClient; at most max_concurrency requests are in flight at once """
+
+    def __init__(self, base_url, username, password, pool_size=10, connect_timeout=5.0, read_timeout=60.0,
+                 taxonomy_cache=None, media_index=None, max_concurrency=8, term_create_policy="none"):
+        self.base_url = (base_url or "").rstrip("/")
+        self.taxonomy_cache = taxonomy_cache
+        self.media_index = media_index
+        self.term_create_policy = term_create_policy
+        self.rest_root, self.namespace = split_rest_namespace(self.base_url)
+        self.batch_url = f"{self.rest_root}/batch/v1"
+        self.batch_supported = True
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.client = httpx.AsyncClient(
+            headers={**basic_auth_header(username, password), **ACCEPT_ENCODING},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=self.timeout,
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.loop = asyncio.get_running_loop()
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def request(self, method, path, endpoint="wordpress", **kwargs):
+        return await self.send(method, self.url(path), endpoint=endpoint, **kwargs)
+
+    async def send(self, method, url, endpoint="wordpress", **kwargs):
+        """ Send a request with retries and the host's circuit breaker (see WordPressClient.send) """
+        if endpoint == "wordpress":
+            kwargs.setdefault("timeout", self.timeout)
+        async with self._semaphore:
+            return await async_resilient_request(self.client, method, url, endpoint=endpoint, **kwargs)
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def resolve_terms(self, taxonomy, names, create=None):
+        """ Map term names to term IDs; uncached slugs are fetched concurrently, 100 per request,
+        and missing terms are created in one batch when the policy allows it
+        """
+        if create is None:
+            create = term_creation_allowed(self.term_create_policy, taxonomy)
+        ids_by_name, lookup, known_missing = split_cached_slugs(self.taxonomy_cache, taxonomy, names)
+        chunks = [lookup[start:start + TERMS_PER_PAGE] for start in range(0, len(lookup), TERMS_PER_PAGE)]
+        responses = await asyncio.gather(
+            *(self.get(f"/{taxonomy}", params=term_lookup_params(chunk)) for chunk in chunks),
+            return_exceptions=True,
+        )
+
+        fetched = {}
+        looked_up = []
+        for chunk, response in zip(chunks, responses):
+            if isinstance(response, httpx.HTTPError):
+                logger.error(f"An error occurred while retrieving {taxonomy} {chunk}: {response}")
+            elif isinstance(response, BaseException):
+                raise response
+            elif response.status_code == 200:
+                looked_up.extend(chunk)
+                for term in response.json():
+                    fetched[term["slug"]] = term["id"]
+            else:
+                logger.error(f"Failed to retrieve {taxonomy}: {response.status_code}, {response.text}")
+
+        to_create = unresolved_names(looked_up, fetched) + known_missing
+        if create and to_create:
+            fetched.update(await self.create_terms(taxonomy, to_create))
+
+        return merge_fetched_terms(self.taxonomy_cache, taxonomy, names, ids_by_name, fetched, looked_up)
+
+    async def create_terms(self, taxonomy, names):
+        """ Create terms in bulk and return {slug: ID} for the ones that now exist """
+        logger.info(f"Creating {len(names)} missing {taxonomy}: {names}")
+        items = [BatchItem("POST", with_fields(f"/{taxonomy}", TERM_FIELDS), new_term_body(name)) for name in names]
+        await self.submit_batch(items)
+        return created_term_ids(items)
+
+    async def submit_batch(self, items):
+        """ Send BatchItems through /batch/v1, 25 per request, or concurrently one by one when the
+        site has no batch endpoint (see WordPressBatch)
+        """
+        pending = []
+        for start in range(0, len(items), MAX_BATCH_SIZE):
+            chunk = items[start:start + MAX_BATCH_SIZE]
+            if not (self.batch_supported and self.namespace and await self._send_batch(chunk)):
+                pending.extend(chunk)
+        await asyncio.gather(*(self._send_item(item) for item in pending))
+        return items
+
+    async def _send_batch(self, chunk):
+        try:
+            response = await self.send("POST", self.batch_url, endpoint="wordpress_batch",
+                                       json=batch_payload(self.namespace, chunk))
+        except httpx.HTTPError as e:
+            logger.error(f"An error occurred while sending a batch of {len(chunk)} operations: {e}")
+            return True
+
+        if response.status_code == 404:
+            logger.warning("WordPress batch endpoint not available; falling back to individual requests.")
+            self.batch_supported = False
+            return False
+        if response.status_code != 207 and response.status_code != 200:
+            logger.error(f"Batch request failed: {response.status_code}, {response.text}")
+            return True
+
+        apply_batch_responses(chunk, response.json().get("responses", []))
+        return True
+
+    async def _send_item(self, item):
+        try:
+            item.set_http_response(await self.request(item.method, item.path, json=item.body))
+        except httpx.HTTPError as e:
+            logger.error(f"An error occurred during {item.method} {item.path}: {e}")
+
+    async def get_category_ids(self, slugs):
+        """ Get category IDs by slugs, in the same order as slugs (None where not found) """
+        return ordered_category_ids(slugs, await self.resolve_terms("categories", slugs))
+
+    async def get_category_id(self, slug):
+        """ Get category ID by slug """
+        return (await self.get_category_ids([slug]))[0]
+
+    async def get_tag_ids(self, slugs):
+        """ Get tag IDs by slugs """
+        return ordered_tag_ids(slugs, await self.resolve_terms("tags", slugs))
+
+    async def create_post(self, post_data):
+        """ Create a WordPress post and return the created post, or None on failure """
+        try:
+            response = await self.post("/posts", params={"_fields": POST_FIELDS}, json=post_data)
+            if response.status_code == 201:
+                post = response.json()
+                logger.info("Post created successfully: " + post.get("link"))
+                return post
+            else:
+                logger.error(f"Failed to create post: {response.status_code}, {response.text}")
+                if is_stale_term_error(response.status_code, response.text) and self.taxonomy_cache:
+                    self.taxonomy_cache.invalidate()
+                if is_stale_media_error(response.status_code, response.text) and self.media_index:
+                    self.media_index.forget(post_data.get("featured_media"))
+        except httpx.HTTPError as e:
+            logger.error(f"An error occurred while creating the post: {e}")
+        return None
+
+    def find_media(self, source_url):
+        """ Media already uploaded from source_url, according to the local media index """
+        if not self.media_index:
+            return None
+        media = self.media_index.lookup_url(source_url)
+        if media:
+            logger.info(f"Reusing media {media['id']} already uploaded from {source_url}")
+        return media
+
+    async def upload_media_bytes(self, data, filename, content_type="image/jpeg", content_length=None, source_url=None):
+        """ Upload image data as a raw binary body.
+
+        data can be bytes or an async iterator of chunks (such as a streamed download); an iterator
+        with a known content_length is sent with that length instead of chunked transfer encoding.
+        Bytes already in the media index return the existing attachment without an upload.
+        """
+        hashing = None
+        if self.media_index:
+            if isinstance(data, (bytes, bytearray)):
+                media = await self.loop.run_in_executor(None, self.media_index.lookup, data)
+                if media:
+                    logger.info(f"Reusing existing media {media['id']} for {filename}: {media.get('source_url')}")
+                    return media
+            else:
+                data = hashing = AsyncHashingIterator(data)
+
+        headers = media_headers(filename, content_type)
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+
+        try:
+            logger.info(f"Uploading image {filename} to WordPress...")
+            response = await self.post("/media", endpoint="wordpress_media", params={"_fields": MEDIA_FIELDS},
+                                       headers=headers, content=data)
+            if response.status_code == 201:
+                media = response.json()
+                logger.info(f"Image uploaded successfully: {media.get('source_url')}")
+                if self.media_index:
+                    if hashing:
+                        self.media_index.add(media, digest=hashing.hexdigest(), source_url=source_url)
+                    else:
+                        await self.loop.run_in_executor(
+                            None, lambda: self.media_index.add(media, data=data, source_url=source_url)
+                        )
+                return media
+            else:
+                logger.error(f"Failed to upload image: {response.status_code}, {response.text}")
+        except httpx.HTTPError as e:
+            logger.error(f"An error occurred while uploading the image: {e}")
+        return None
+
+    async def upload_media(self, image_path):
+        """ Upload an image file to the WordPress media library and return the media item, or None on failure """
+        if not image_path:
+            logger.error("No image path given; skipping upload.")
+            return None
+
+        filename = os.path.basename(image_path)
+        try:
+            image_bytes = await self.loop.run_in_executor(None, _read_file, image_path)
+        except FileNotFoundError:
+            logger.error(f"Image file not found: {image_path}")
+            return None
+        return await self.upload_media_bytes(image_bytes, filename, guess_content_type(filename))
+
+
+class AsyncHashingIterator:
+    """ Passes byte chunks from an async iterator through unchanged while computing their SHA-256 """
+
+    def __init__(self, chunks):
+        self._chunks = chunks.__aiter__()
+        self._sha = hashlib.sha256()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self._chunks.__anext__()
+        self._sha.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self._sha.hexdigest()
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+_client = None
+
+
+def get_async_wp_client():
+    """ Return the async WordPress client for the running event loop, creating it on first use """
+    global _client
+    if _client is None or _client.loop is not asyncio.get_running_loop():
+        config = get_config()
+        _client = AsyncWordPressClient(
+            config.wordpress_url,
+            config.wordpress_username,
+            config.wordpress_password,
+            pool_size=config.wp_pool_size,
+            connect_timeout=config.wp_connect_timeout,
+            read_timeout=config.wp_read_timeout,
+            taxonomy_cache=build_taxonomy_cache(config.wordpress_url),
+            media_index=build_media_index(config.wordpress_url),
+            max_concurrency=config.wp_max_concurrency,
+            term_create_policy=term_create_policy(),
+        )
+    return _client
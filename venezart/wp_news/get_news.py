@@ -1,20 +1,20 @@
-import numpy as np
-import pandas as pd
+import re
+import html
 from typing import Optional, List
 import os
 import logging
-from dotenv import load_dotenv
+from config import load_env
 from datetime import date, datetime, timedelta
 import requests
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-import nltk
 import requests  # <-- Add this line
 from io import BytesIO
 import random
+from resilience import resilient_request
+from llm_tokens import count_tokens, truncate_tokens
 
 
 # Load environment variables from the .env file
-load_dotenv()
+load_env()
 
 # Configure logger
 logging.basicConfig(level=logging.INFO)
@@ -22,9 +22,12 @@ logger = logging.getLogger(__name__)
 
 # Get News API credentials from environment variables with error handling
 NEWS_API_KEY = os.getenv("NEWS_API_KEY")
+NEWS_API_URL = os.getenv("NEWS_API_URL", "https://newsapi.org/v2/everything")
+
+# NewsAPI cuts article content off with a marker such as "… [+2817 chars]"
+CONTENT_CUT_MARKER = re.compile(r"\s*(…|\.\.\.)?\s*\[\+\d+ chars\]\s*$")
+HTML_TAG = re.compile(r"<[^>]+>")
 
-# Ensure NLTK data is available
-nltk.download('vader_lexicon')
 # Cache for latest news
 news_cache = {
     "timestamp": None,
@@ -61,8 +64,12 @@ def fetch_latest_news(top_n: int = 15) -> Optional[list]:
         return news_cache["articles"][:top_n]  # Return only the top_n cached articles
 
     logger.info(f"Fetching latest {news_topic} news...")
-    url = f"https://newsapi.org/v2/everything?q={news_topic}&sortBy=publishedAt&language=en&apiKey={NEWS_API_KEY}"
-    response = requests.get(url)
+    url = f"{NEWS_API_URL}?q={news_topic}&sortBy=publishedAt&language=en&apiKey={NEWS_API_KEY}"
+    try:
+        response = resilient_request("GET", url, endpoint="newsapi")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"An error occurred while fetching news: {e}")
+        return None
 
     if response.status_code == 200:
         articles = response.json().get('articles', [])
@@ -93,3 +100,35 @@ def extract_image(article) -> Optional[str]:
     else:
         logger.warning("No image found in the article.")
     return image_url
+
+
+def clean_text(value) -> str:
+    """
+    Plain single-line text from an article field: no HTML tags or entities, no NewsAPI cut-off marker.
+    """
+    text = html.unescape(HTML_TAG.sub(" ", value or ""))
+    text = CONTENT_CUT_MARKER.sub("", text)
+    return " ".join(text.split())
+
+
+def compact_article(article, token_budget: int = 300, model: Optional[str] = None) -> str:
+    """
+    The parts of a news article a post is written from, as labelled lines within token_budget tokens.
+    The title is always kept; the description and then the content are cut to fit what is left.
+    Source, author, URLs and dates are left out; the model has no use for them.
+    """
+    title = clean_text(article.get("title"))
+    description = clean_text(article.get("description"))
+    content = clean_text(article.get("content"))
+    if description and content.startswith(description):
+        description = ""  # The content repeats it
+
+    lines = [f"Title: {title}"]
+    remaining = token_budget - count_tokens(lines[0], model)
+    for label, text in (("Summary", description), ("Text", content)):
+        if text and remaining > 0:
+            line = truncate_tokens(f"{label}: {text}", remaining, model)
+            if line:
+                lines.append(line)
+                remaining -= count_tokens(line, model) + 1
+    return "\n".join(lines)
@@ -1,23 +1,24 @@
 import torch
 import os
-from diffusers import StableDiffusionPipeline
 from PIL import Image
+from contextlib import nullcontext
+from pipeline_cache import CPU_INFERENCE_STEPS, get_pipeline, inference_device, set_scheduler, use_pipeline
+from generate_image import image_profile
 
 def generate_image(topic, save_path="images", image_format="JPEG"):
     print(f"Generating image for topic: {topic}")
     model_id = "stabilityai/stable-diffusion-2-1"
     
-    # Check CUDA availability
-    if not torch.cuda.is_available():
-        print("CUDA not available. Please run on a system with CUDA support.")
-        return None
+    # CUDA when available, else the CPU with fewer steps
+    device, dtype = inference_device()
+    if device == "cpu":
+        print(f"CUDA not available; rendering on the CPU in {dtype}.")
     
     # Load model
     try:
-        print(f"Loading model: {model_id}")
-        pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=torch.float16)
-        pipe = pipe.to("cuda")
-        print(f"Using CUDA device: {torch.cuda.get_device_name(0)}")
+        get_pipeline(model_id, device, dtype)  # Loaded once per process, then kept resident
+        if device == "cuda":
+            print(f"Using CUDA device: {torch.cuda.get_device_name(0)}")
     except Exception as e:
         print(f"Error loading model: {e}")
         return None
@@ -47,14 +48,18 @@ def generate_image(topic, save_path="images", image_format="JPEG"):
     ))
     print(f"Using prompt: {prompt}")
 
-    # Image generation settings
-    num_inference_steps = 50
-    guidance_scale = 7.5
+    # Image generation settings, from the IMAGE_PROFILE generation profile
+    profile = image_profile()
+    num_inference_steps = profile["steps"] if device == "cuda" else min(profile["steps"], CPU_INFERENCE_STEPS)
+    guidance_scale = profile["guidance_scale"]
+    autocast = torch.cuda.amp.autocast(dtype=torch.float16) if device == "cuda" else nullcontext()
 
     # Generate image
     try:
-        with torch.cuda.amp.autocast(dtype=torch.float16):
-            image = pipe(prompt, guidance_scale=guidance_scale, num_inference_steps=num_inference_steps).images[0]
+        with use_pipeline(model_id, device, dtype) as pipe, autocast:
+            set_scheduler(pipe, profile["scheduler"])
+            image = pipe(prompt, guidance_scale=guidance_scale, num_inference_steps=num_inference_steps,
+                         width=profile["width"], height=profile["height"]).images[0]
         print("Image generated successfully.")
     except Exception as e:
         print(f"Error generating image: {e}")
@@ -0,0 +1,262 @@
+""" Image generation worker: one process that keeps the diffusion pipeline loaded and renders jobs for the agents.
+
+Agents send jobs (prompt, seed, steps, size, scheduler, ...) over a local socket and get the encoded image
+back, so they keep writing text and talking to WordPress while an image renders, several agents
+share one warm model, and a crash inside torch takes down the worker instead of the post.
+Messages are JSON, images raw bytes; connections are authenticated with IMAGE_WORKER_AUTHKEY, which
+must be set when the worker listens on anything but a loopback address or a Unix socket.
+
+Start it next to the agents and point them at it:
+    python image_worker.py --address 127.0.0.1:8765 --preload
+    IMAGE_WORKER_ADDRESS=127.0.0.1:8765 python agent_venezart_wp.py
+"""
+import os
+import json
+import ipaddress
+import time
+import queue
+import logging
+import argparse
+import threading
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Secret used when IMAGE_WORKER_AUTHKEY is unset; it is public, so it is only accepted on loopback addresses
+DEFAULT_AUTHKEY = "venezart-image-worker"
+
+# Fields a job may set; anything else is rejected
+JOB_FIELDS = ("prompt", "seed", "steps", "width", "height", "guidance_scale", "model_id", "scheduler", "image_format")
+
+
+class ImageWorkerError(Exception):
+    """ The worker could not be reached, refused the job or failed to render it """
+
+
+def parse_address(address):
+    """ ("host", port) for "host:port", or the path of a Unix socket """
+    host, separator, port = address.rpartition(":")
+    if separator and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def is_loopback(address):
+    """ True for a Unix socket path or a (host, port) on the loopback interface """
+    if not isinstance(address, tuple):
+        return True
+    host = address[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False  # Any other host name may resolve to a public interface
+
+
+def worker_authkey():
+    """ Shared secret of the worker and its clients (IMAGE_WORKER_AUTHKEY, else DEFAULT_AUTHKEY) """
+    return os.getenv("IMAGE_WORKER_AUTHKEY", DEFAULT_AUTHKEY).encode("utf-8")
+
+
+def batch_key(job):
+    """ Settings a job shares with the jobs it may be batched with: everything but its prompt and seed """
+    return tuple(job.get(field) for field in JOB_FIELDS if field not in ("prompt", "seed"))
+
+
+def render_jobs(jobs):
+    """ Encoded image (or the exception) for each of jobs, which share a batch_key, rendered in as few pipeline calls as fit """
+    # Imported on first job: the worker is started from an agent directory and renders with its settings
+    from generate_image import encode_image, render_prompts
+
+    options = {field: jobs[0][field] for field in JOB_FIELDS if jobs[0].get(field) is not None}
+    image_format = options.pop("image_format", "JPEG")
+    options.pop("prompt")
+    options.pop("seed", None)
+    results = render_prompts([(job["prompt"], job.get("seed")) for job in jobs], **options)
+    return [encode_image(images[0], image_format).getvalue() if images
+            else ImageWorkerError("rendering failed; see the worker log") for images in results]
+
+
+class ImageWorker:
+    """ Serves render jobs from a bounded queue on a single render thread, batching jobs that wait together.
+
+    Every connection gets its own thread that reads jobs, queues them and sends back the results;
+    when max_queue jobs are already waiting the job is refused, so callers fail fast instead of
+    piling up. The render thread takes up to max_batch waiting jobs with the same settings at a
+    time; render(jobs) returns the encoded image, or an exception, for each.
+    """
+
+    def __init__(self, address, authkey, render=render_jobs, max_queue=16, max_batch=4):
+        self.address = address
+        self.authkey = authkey
+        self.render = render
+        self.max_batch = max(1, max_batch)
+        self.jobs = queue.Queue(max_queue)
+        self._held = deque()  # Jobs taken off the queue that did not fit the batch being rendered
+        self.rendered = 0
+        self.failed = 0
+        self.listener = None
+
+    def serve_forever(self):
+        threading.Thread(target=self._render_loop, name="render", daemon=True).start()
+        self.listener = Listener(self.address, authkey=self.authkey)
+        logger.info(f"Image worker listening on {self.listener.address}")
+        while True:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                logger.warning("Refused a connection with the wrong IMAGE_WORKER_AUTHKEY")
+                continue
+            except OSError:
+                break  # Listener closed
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
+
+    def _next_batch(self):
+        """ The oldest waiting job and up to max_batch - 1 others with the same settings, in arrival order """
+        batch = [self._held.popleft() if self._held else self.jobs.get()]
+        key = batch_key(batch[0][0])
+        for entry in list(self._held):
+            if len(batch) < self.max_batch and batch_key(entry[0]) == key:
+                self._held.remove(entry)
+                batch.append(entry)
+        while len(batch) < self.max_batch:
+            try:
+                entry = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            (batch if batch_key(entry[0]) == key else self._held).append(entry)
+        return batch
+
+    def _render_loop(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            try:
+                images = self.render([job for job, _, _ in batch])
+            except Exception as e:
+                logger.exception(f"Rendering {len(batch)} job(s) failed")
+                images = [e] * len(batch)
+            elapsed = time.perf_counter() - started
+            for (job, result, done), image in zip(batch, images):
+                if isinstance(image, Exception):
+                    result["error"] = str(image) or type(image).__name__
+                    self.failed += 1
+                else:
+                    result["image"] = image
+                    self.rendered += 1
+                done.set()
+            logger.info(f"Rendered {len(batch)} job(s), {batch[0][0]['prompt'][:60]!r} first, in {elapsed:.1f}s "
+                        f"({self.jobs.qsize() + len(self._held)} waiting)")
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    job = json.loads(conn.recv_bytes())
+                except (EOFError, OSError):
+                    return
+                except ValueError:
+                    conn.send_bytes(json.dumps({"ok": False, "error": "job is not valid JSON"}).encode())
+                    continue
+
+                unknown = set(job) - set(JOB_FIELDS) if isinstance(job, dict) else set()
+                if unknown or not isinstance(job, dict) or not isinstance(job.get("prompt"), str):
+                    error = f"unknown job fields: {', '.join(sorted(unknown))}" if unknown else "job has no prompt"
+                    conn.send_bytes(json.dumps({"ok": False, "error": error}).encode())
+                    continue
+
+                result, done = {}, threading.Event()
+                try:
+                    self.jobs.put_nowait((job, result, done))
+                except queue.Full:
+                    conn.send_bytes(json.dumps({"ok": False, "error": "worker is busy"}).encode())
+                    continue
+                done.wait()
+                try:
+                    if "error" in result:
+                        conn.send_bytes(json.dumps({"ok": False, "error": result["error"]}).encode())
+                    else:
+                        conn.send_bytes(json.dumps({"ok": True}).encode())
+                        conn.send_bytes(result["image"])
+                except OSError:
+                    return  # The client gave up waiting
+
+
+class ImageWorkerClient:
+    """ Sends render jobs to an ImageWorker; each job uses its own short-lived connection, so the client is thread-safe """
+
+    def __init__(self, address, authkey=None, timeout=600.0):
+        self.address = address
+        self.authkey = authkey if authkey is not None else worker_authkey()
+        self.timeout = timeout
+
+    def render(self, prompt, seed=None, steps=None, width=None, height=None, guidance_scale=None,
+               model_id=None, scheduler=None, image_format="JPEG"):
+        """ The encoded image for prompt; raises ImageWorkerError when the worker is down, busy or fails """
+        job = {"prompt": prompt, "seed": seed, "steps": steps, "width": width, "height": height,
+               "guidance_scale": guidance_scale, "model_id": model_id, "scheduler": scheduler,
+               "image_format": image_format}
+        job = {field: value for field, value in job.items() if value is not None}
+        try:
+            with Client(self.address, authkey=self.authkey) as conn:
+                conn.send_bytes(json.dumps(job).encode())
+                if not conn.poll(self.timeout):
+                    raise ImageWorkerError(f"no image after {self.timeout:.0f}s")
+                reply = json.loads(conn.recv_bytes())
+                if not reply.get("ok"):
+                    raise ImageWorkerError(reply.get("error") or "unknown error")
+                return conn.recv_bytes()
+        except (OSError, EOFError, AuthenticationError) as e:
+            raise ImageWorkerError(f"image worker at {self.address} is unavailable: {e!r}")
+
+
+def get_image_worker_client():
+    """ Client for the worker at IMAGE_WORKER_ADDRESS, or None when images are rendered in-process """
+    address = os.getenv("IMAGE_WORKER_ADDRESS")
+    if not address:
+        return None
+    return ImageWorkerClient(parse_address(address), timeout=float(os.getenv("IMAGE_WORKER_TIMEOUT", "600")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--address", default=os.getenv("IMAGE_WORKER_ADDRESS", "127.0.0.1:8765"),
+                        help="host:port or Unix socket path to listen on")
+    parser.add_argument("--max-queue", type=int, default=int(os.getenv("IMAGE_WORKER_MAX_QUEUE", "16")),
+                        help="Jobs that may wait before new ones are refused")
+    parser.add_argument("--max-batch", type=int, default=int(os.getenv("IMAGE_WORKER_MAX_BATCH", "4")),
+                        help="Waiting jobs with the same settings rendered in one pipeline call")
+    parser.add_argument("--preload", action="store_true", help="Load the diffusion model before taking jobs")
+    args = parser.parse_args()
+
+    address = parse_address(args.address)
+    if not os.getenv("IMAGE_WORKER_AUTHKEY") and not is_loopback(address):
+        parser.error(f"IMAGE_WORKER_AUTHKEY must be set to listen on {args.address}; "
+                     "the default key is only accepted on loopback addresses and Unix sockets")
+
+    if args.preload:
+        from generate_image import MODEL_ID
+        from pipeline_cache import get_pipeline, inference_device
+        get_pipeline(MODEL_ID, *inference_device())
+
+    worker = ImageWorker(address, worker_authkey(), max_queue=args.max_queue,
+                         max_batch=args.max_batch)
+    try:
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.close()
+
+
+if __name__ == "__main__":
+    main()
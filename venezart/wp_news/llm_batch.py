@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import logging
+
+from llm_tokens import cached_tokens_of
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def batch_request(custom_id, model, messages, response_format=None):
+    """ One line of a Batch API input file: a chat completion request tagged with custom_id """
+    body = {"model": model, "messages": messages}
+    if response_format:
+        body["response_format"] = response_format
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": body,
+    }
+
+
+def batch_jobs_dir():
+    return os.getenv("LLM_BATCH_DIR", os.path.join("cache", "llm_batches"))
+
+
+def batch_wait():
+    """ Seconds a bulk run waits for its batch (LLM_BATCH_WAIT); 0 submits and leaves it to the next run """
+    return float(os.getenv("LLM_BATCH_WAIT", str(24 * 3600)))
+
+
+class BatchJob:
+    """ A submitted batch, the agent that submitted it (name) and the subject (topic, article, ...) behind each custom_id.
+
+    The record is saved next to the input file, so a later process can pick the batch up again
+    instead of staying open for the whole completion window.
+    """
+
+    def __init__(self, batch_id, name, subjects, input_path=None, directory=None):
+        self.batch_id = batch_id
+        self.name = name
+        self.subjects = subjects
+        self.input_path = input_path
+        self.directory = directory or batch_jobs_dir()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{self.batch_id}.json")
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"batch_id": self.batch_id, "name": self.name, "input_path": self.input_path,
+                       "subjects": self.subjects}, f)
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def load(cls, batch_id, directory=None):
+        directory = directory or batch_jobs_dir()
+        with open(os.path.join(directory, f"{batch_id}.json"), "r", encoding="utf-8") as f:
+            record = json.load(f)
+        return cls(record["batch_id"], record["name"], record["subjects"], record.get("input_path"), directory)
+
+    def finish(self):
+        """ Remove the job record and its input file once the results have been used """
+        for path in (self.path, self.input_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+
+def pending_jobs(name, directory=None):
+    """ Jobs submitted earlier under name whose results have not been used yet, oldest first """
+    directory = directory or batch_jobs_dir()
+    if not os.path.isdir(directory):
+        return []
+    paths = sorted((os.path.join(directory, entry) for entry in os.listdir(directory) if entry.endswith(".json")),
+                   key=os.path.getmtime)
+    jobs = [BatchJob.load(os.path.basename(path)[:-len(".json")], directory) for path in paths]
+    return [job for job in jobs if job.name == name]
+
+
+def write_batch_file(path, requests):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for request in requests:
+            f.write(json.dumps(request) + "\n")
+
+
+def submit_batch(client, name, requests, subjects):
+    """ Upload requests as a JSONL file, start a 24h batch over them and save the job record.
+
+    subjects maps each request's custom_id to whatever the completion is for (JSON-serializable);
+    name tells the agents sharing a cache directory apart.
+    """
+    directory = batch_jobs_dir()
+    input_path = os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl")
+    write_batch_file(input_path, requests)
+
+    with open(input_path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window="24h",
+        metadata={"description": name},
+    )
+    job = BatchJob(batch.id, name, subjects, input_path, directory)
+    job.save()
+    logger.info(f"Submitted batch {batch.id} with {len(requests)} requests (status: {batch.status})")
+    return job
+
+
+def wait_for_batch(client, batch_id, poll_interval=None, timeout=None):
+    """ Poll the batch until it reaches a final status and return it; None if timeout (seconds) runs out first """
+    poll_interval = float(os.getenv("LLM_BATCH_POLL_INTERVAL", "60")) if poll_interval is None else poll_interval
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts:
+            logger.info(f"Batch {batch_id}: {batch.status}, {counts.completed}/{counts.total} done, {counts.failed} failed")
+        else:
+            logger.info(f"Batch {batch_id}: {batch.status}")
+        if batch.status in FINAL_STATUSES:
+            return batch
+        if deadline is not None and time.monotonic() + poll_interval > deadline:
+            logger.warning(f"Stopped waiting for batch {batch_id}; the next bulk run picks it up")
+            return None
+        time.sleep(poll_interval)
+
+
+def batch_outputs(client, batch):
+    """ Completion text by custom_id for every request in the batch that succeeded """
+    outputs = {}
+    prompt_tokens = cached_tokens = 0
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                logger.error(f"Batch request {result.get('custom_id')} failed: {result.get('error') or response.get('body')}")
+                continue
+            outputs[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+            usage = response["body"].get("usage") or {}
+            prompt_tokens += usage.get("prompt_tokens") or 0
+            cached_tokens += cached_tokens_of(usage)
+
+    if outputs:
+        logger.info(f"Batch {batch.id} used {prompt_tokens} input tokens, {cached_tokens} of them cached")
+
+    if batch.error_file_id:
+        failed = [line for line in client.files.content(batch.error_file_id).text.splitlines() if line.strip()]
+        logger.error(f"{len(failed)} requests in batch {batch.id} failed; see file {batch.error_file_id}")
+    return outputs
+
+
+def collect_batch(client, job, timeout=None):
+    """ Wait for a submitted job and return its outputs by custom_id (None if the wait timed out).
+
+    timeout defaults to batch_wait(); a timeout of 0 checks the batch once without waiting.
+    """
+    batch = wait_for_batch(client, job.batch_id, timeout=batch_wait() if timeout is None else timeout)
+    if batch is None:
+        return None
+    if batch.status != "completed":
+        logger.error(f"Batch {job.batch_id} ended as {batch.status}")
+    return batch_outputs(client, batch)
@@ -0,0 +1,169 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from resilience import RetryPolicy, parse_retry_after
+from llm_tokens import count_message_tokens
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Completion tokens assumed for a request before its usage is known (posts are capped at 500 words)
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "900"))
+
+# Pause after a 429 that came without a Retry-After header
+DEFAULT_THROTTLE_PAUSE = 2.0
+
+# Backoff before sending a completion again after a connection error, timeout or 5xx
+TRANSIENT_RETRY_POLICY = RetryPolicy(backoff_base=1.0, backoff_max=30.0)
+
+
+def estimate_tokens(messages, completion_tokens=None, model=None):
+    """ Token count of a chat request before it is sent: its prompt tokens plus the expected completion """
+    completion_tokens = EXPECTED_COMPLETION_TOKENS if completion_tokens is None else completion_tokens
+    return count_message_tokens(messages, model) + completion_tokens
+
+
+class TokenBucket:
+    """ Capacity that refills continuously at per_minute per minute; taking more than is left runs it into debt """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now, scale=1.0):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0 * scale)
+        self.updated = now
+
+    def wait_time(self, amount, scale=1.0):
+        """ Seconds until amount (capped at the capacity) is available """
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / (self.capacity / 60.0 * scale))
+
+
+class RateLimiter:
+    """ Keeps completions under a requests-per-minute and a tokens-per-minute limit, across threads.
+
+    acquire() reserves an estimate before each request and record() corrects it with the usage the
+    API reports. A 429 (throttled()) pauses every caller and halves the refill rate; each successful
+    request then wins a little of it back, so the limiter settles just under the real limits.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, min_scale=0.1):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.min_scale = min_scale
+        self.scale = 1.0
+        self.paused_until = 0.0
+        self.waited = 0.0
+        self.throttles = 0
+        self.tokens_used = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens):
+        """ Block until one request and tokens tokens fit under both limits, then reserve them """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.requests.refill(now, self.scale)
+                self.tokens.refill(now, self.scale)
+                delay = max(self.paused_until - now, self.requests.wait_time(1, self.scale),
+                            self.tokens.wait_time(tokens, self.scale))
+                if delay <= 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= tokens
+                    return
+                self.waited += delay
+            time.sleep(delay)
+
+    def record(self, estimated, used=None, prompt_tokens=0, cached_tokens=0):
+        """ Settle a reservation of estimated tokens against the tokens the request actually used.
+
+        prompt_tokens and cached_tokens (the part of them read from the provider's prompt cache) are
+        only counted, for the cache hit rate in stats().
+        """
+        used = estimated if used is None else used
+        with self._lock:
+            self.tokens.level += estimated - used
+            self.tokens_used += used
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.scale = min(1.0, self.scale + 0.05)
+
+    def throttled(self, estimated, retry_after=None):
+        """ The API answered 429 to a request that reserved estimated tokens: back off for everyone """
+        with self._lock:
+            self.throttles += 1
+            self.tokens.level += estimated
+            self.scale = max(self.min_scale, self.scale / 2)
+            pause = DEFAULT_THROTTLE_PAUSE if retry_after is None else retry_after
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        logger.warning(f"Rate limited by the completions API; pausing {pause:.1f}s at {self.scale:.0%} of the configured rate")
+
+    def stats(self):
+        return {"waited_seconds": round(self.waited, 3), "throttles": self.throttles,
+                "tokens_used": self.tokens_used, "scale": self.scale,
+                "prompt_tokens": self.prompt_tokens, "cached_tokens": self.cached_tokens,
+                "prompt_cache_hit_rate": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0}
+
+
+def is_rate_limit_error(error):
+    return getattr(error, "status_code", None) == 429
+
+
+def is_transient_error(error):
+    """ A connection error, timeout (an APIConnectionError too) or 5xx from the API, worth sending again """
+    return isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+
+
+def retry_after_of(error):
+    response = getattr(error, "response", None)
+    return parse_retry_after(response.headers.get("retry-after")) if response is not None else None
+
+
+_limiter = None
+_pool = None
+_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """ The process-wide limiter, sized by LLM_RPM and LLM_TPM (your account's limits for the model) """
+    global _limiter
+    if _limiter is None:
+        with _lock:
+            if _limiter is None:
+                _limiter = RateLimiter(
+                    requests_per_minute=float(os.getenv("LLM_RPM", "500")),
+                    tokens_per_minute=float(os.getenv("LLM_TPM", "200000")),
+                )
+    return _limiter
+
+
+def completion_pool():
+    """ Bounded pool of LLM_WORKERS threads that completion calls run on """
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_WORKERS", "4")),
+                                           thread_name_prefix="completion")
+    return _pool
+
+
+def report_rate_limits():
+    """ Log how much the rate limiter held completions back, if it was used at all """
+    if _limiter is not None:
+        stats = _limiter.stats()
+        logger.info(f"LLM rate limits: {stats['tokens_used']} tokens used, waited {stats['waited_seconds']}s, "
+                    f"{stats['throttles']} throttled, running at {stats['scale']:.0%} of the configured rate")
+        if stats["prompt_tokens"]:
+            logger.info(f"LLM prompt cache: {stats['cached_tokens']} of {stats['prompt_tokens']} input tokens cached "
+                        f"({stats['prompt_cache_hit_rate']:.0%})")
@@ -0,0 +1,119 @@
+import os
+import time
+import logging
+
+from llm_limiter import (
+    TRANSIENT_RETRY_POLICY, estimate_tokens, get_rate_limiter, is_rate_limit_error, is_transient_error, retry_after_of,
+)
+from llm_tokens import cached_tokens_of
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def streaming_enabled():
+    """ Completions are streamed unless LLM_STREAM is set to false """
+    return os.getenv("LLM_STREAM", "true").lower() == "true"
+
+
+class TitleStream:
+    """ Collects completion text as it streams in and logs how long the post title took to arrive.
+
+    title_parser(lines) gets the complete lines received so far and returns the title, or None while
+    there is not enough text yet.
+    """
+
+    def __init__(self, title_parser):
+        self.title_parser = title_parser
+        self.title = None
+        self.started = time.perf_counter()
+        self._parts = []
+        self._lines = []
+        self._pending = ""
+
+    def feed(self, text):
+        self._parts.append(text)
+        if self.title is not None:
+            return
+        # Only complete lines are parsed; the last piece may still grow
+        *complete, self._pending = (self._pending + text).split("\n")
+        if complete:
+            self._lines.extend(complete)
+            title = self.title_parser(self._lines)
+            if title:
+                self.announce(title)
+
+    def text(self):
+        return "".join(self._parts)
+
+    def restart(self):
+        """ Drop the text received so far, before the completion is requested again; a reported title stays reported """
+        self._parts, self._lines, self._pending = [], [], ""
+
+    def announce(self, title):
+        """ Record the title the first time it is seen in the stream """
+        if self.title is not None or not title:
+            return
+        self.title = title
+        logger.info(f"Title ready after {time.perf_counter() - self.started:.2f}s: {title}")
+
+
+def complete_text(client, model, messages, title_stream=None, response_format=None):
+    """ Completion text for messages, streamed through title_stream when streaming is enabled.
+
+    Requests are paced by the process-wide rate limiter; a 429 is retried here, after the limiter
+    has backed off, rather than inside the OpenAI client. Connection errors, timeouts and 5xx
+    responses, which the client would otherwise retry, are retried here too, after a jittered
+    backoff. response_format (a JSON schema, say) is passed on to the API as is.
+    """
+    limiter = get_rate_limiter()
+    estimated = estimate_tokens(messages, model=model)
+    max_attempts = int(os.getenv("LLM_MAX_ATTEMPTS", "5"))
+    client = client.with_options(max_retries=0)
+    for attempt in range(1, max_attempts + 1):
+        limiter.acquire(estimated)
+        try:
+            text, usage = _request_completion(client, model, messages, title_stream, response_format)
+        except Exception as e:
+            if attempt == max_attempts or not (is_rate_limit_error(e) or is_transient_error(e)):
+                raise
+            if is_rate_limit_error(e):
+                limiter.throttled(estimated, retry_after_of(e))
+            else:
+                delay = TRANSIENT_RETRY_POLICY.delay(attempt, retry_after_of(e))
+                logger.warning(f"Completion attempt {attempt} failed ({e!r}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+            if title_stream is not None:
+                title_stream.restart()  # The retry streams the completion from the start
+            continue
+        if not usage:
+            limiter.record(estimated)
+            return text
+        cached = cached_tokens_of(usage)
+        limiter.record(estimated, usage.total_tokens, usage.prompt_tokens, cached)
+        logger.info(f"Completion used {usage.prompt_tokens} input ({cached} cached) and {usage.completion_tokens} output tokens")
+        return text
+
+
+def _request_completion(client, model, messages, title_stream, response_format=None):
+    """ (text, token usage or None) for one completion request """
+    options = {"response_format": response_format} if response_format else {}
+    if not streaming_enabled():
+        response = client.chat.completions.create(model=model, messages=messages, **options)
+        text = response.choices[0].message.content
+        if title_stream and text:
+            title_stream.feed(text)
+        return text, response.usage
+
+    title_stream = title_stream or TitleStream(lambda lines: None)
+    stream = client.chat.completions.create(
+        model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **options
+    )
+    usage = None
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            title_stream.feed(chunk.choices[0].delta.content)
+        if chunk.usage:
+            usage = chunk.usage
+    return title_stream.text(), usage
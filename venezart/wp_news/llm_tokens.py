@@ -0,0 +1,87 @@
+import math
+import logging
+import threading
+
+try:
+    import tiktoken  # In requirements.txt; without it, counts fall back to a characters-per-token estimate
+except ImportError:
+    tiktoken = None
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Encoding for models tiktoken does not know yet (the gpt-4o family's)
+DEFAULT_ENCODING = "o200k_base"
+# Characters per token of English text, for counting without tiktoken
+CHARS_PER_TOKEN = 4
+# Tokens the chat format adds around each message, and to prime the reply
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+_encodings = {}
+_lock = threading.Lock()
+
+
+def encoding_for(model=None):
+    """ The tiktoken encoding for model, or None when tiktoken is missing or its data cannot be loaded """
+    with _lock:
+        if model not in _encodings and tiktoken is None:
+            logger.warning(f"Counting tokens approximately ({CHARS_PER_TOKEN} characters per token); "
+                           "tiktoken is not installed")
+            _encodings[model] = None
+        elif model not in _encodings:
+            try:
+                try:
+                    _encodings[model] = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(DEFAULT_ENCODING)
+                except KeyError:
+                    _encodings[model] = tiktoken.get_encoding(DEFAULT_ENCODING)
+            except Exception as e:
+                # The encoding files are downloaded on first use; offline, fall back to the estimate
+                logger.warning(f"Counting tokens approximately; tiktoken encoding unavailable: {e}")
+                _encodings[model] = None
+        return _encodings[model]
+
+
+def count_tokens(text, model=None):
+    """ Tokens in text for model: exact with tiktoken, otherwise about four characters per token """
+    if not text:
+        return 0
+    encoding = encoding_for(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def count_message_tokens(messages, model=None):
+    """ Prompt tokens of a chat request, including the per-message formatting overhead """
+    return sum(count_tokens(str(message.get("content") or ""), model) + MESSAGE_OVERHEAD
+               for message in messages) + REPLY_OVERHEAD
+
+
+def cached_tokens_of(usage):
+    """ Prompt tokens the provider served from its prompt cache, from a usage object or dict (0 when it does not say) """
+    if usage is None:
+        return 0
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        return 0
+    return (details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)) or 0
+
+
+def truncate_tokens(text, max_tokens, model=None, ellipsis="…"):
+    """ text cut down to at most max_tokens tokens, ending in ellipsis when something was cut """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+
+    encoding = encoding_for(model)
+    if encoding is not None:
+        kept = encoding.decode(encoding.encode(text)[:max(0, max_tokens - count_tokens(ellipsis, model))])
+    else:
+        kept = text[:max(0, max_tokens * CHARS_PER_TOKEN - len(ellipsis))]
+        # Do not end halfway through a word
+        if " " in kept and not text[len(kept)].isspace():
+            kept = kept.rsplit(" ", 1)[0]
+    return kept.rstrip() + ellipsis
@@ -0,0 +1,154 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from io import BytesIO
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(data):
+    """ 64-bit difference hash (dHash) of an encoded image, or None if it cannot be decoded """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    try:
+        with Image.open(BytesIO(data)) as image:
+            pixels = list(image.convert("L").resize((9, 8)).getdata())
+    except Exception:
+        return None
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return bits
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class MediaIndex:
+    """ Local index of uploaded media, keyed by content hash, perceptual hash and source URL.
+
+    Lets the upload path hand back an existing attachment instead of uploading (and having
+    WordPress regenerate thumbnails for) an image the library already has. Attachment IDs only
+    mean something on the site they came from: the file records site, and a file written for
+    another site (or before sites were recorded) is ignored rather than read.
+    """
+
+    def __init__(self, path, phash_distance=None, site=None):
+        self.path = path
+        self.site = site
+        self.phash_distance = phash_distance
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable media index {self.path}: {e}")
+            data = {}
+        if data and data.get("site") != self.site:
+            logger.warning(f"Ignoring media index {self.path}: it was not written for {self.site}")
+            data = {}
+        data["site"] = self.site
+        data.setdefault("media", {})
+        data.setdefault("urls", {})
+        return data
+
+    def save(self):
+        """ Write the index to disk atomically """
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f)
+            os.replace(tmp_path, self.path)
+
+    def _record(self, entry):
+        """ Count a hit or miss and return the media fields callers use (id, source_url) """
+        if entry:
+            self.hits += 1
+            return {"id": entry["id"], "source_url": entry["source_url"]}
+        self.misses += 1
+        return None
+
+    def lookup_url(self, source_url):
+        """ Media previously uploaded from this source URL, or None """
+        with self._lock:
+            digest = self._data["urls"].get(source_url)
+            return self._record(self._data["media"].get(digest) if digest else None)
+
+    def lookup(self, data):
+        """ Media with the same bytes, or (if enabled) a perceptually near-identical image, or None """
+        digest = content_hash(data)
+        with self._lock:
+            media = self._data["media"].get(digest)
+        if media or self.phash_distance is None:
+            return self._record(media)
+
+        phash = perceptual_hash(data)
+        if phash is None:
+            return self._record(None)
+
+        with self._lock:
+            best = None
+            for entry in self._data["media"].values():
+                if entry.get("phash") is None:
+                    continue
+                distance = hamming_distance(phash, entry["phash"])
+                if distance <= self.phash_distance and (best is None or distance < best[0]):
+                    best = (distance, entry)
+        if best:
+            logger.info(f"Found a near-identical image in the media library (distance {best[0]})")
+        return self._record(best[1] if best else None)
+
+    def add(self, media, data=None, digest=None, source_url=None):
+        """ Remember an uploaded media item under its content hash (from data or digest) and source URL """
+        if data is not None:
+            digest = content_hash(data)
+        if digest is None:
+            return
+
+        entry = {"id": media.get("id"), "source_url": media.get("source_url")}
+        if data is not None and self.phash_distance is not None:
+            entry["phash"] = perceptual_hash(data)
+
+        with self._lock:
+            self._data["media"][digest] = entry
+            if source_url:
+                self._data["urls"][source_url] = digest
+        self.save()
+
+    def forget(self, media_id):
+        """ Drop every entry pointing at a media ID, e.g. after it was deleted on the site """
+        with self._lock:
+            digests = [d for d, entry in self._data["media"].items() if entry.get("id") == media_id]
+            for digest in digests:
+                del self._data["media"][digest]
+            self._data["urls"] = {url: d for url, d in self._data["urls"].items() if d not in digests}
+        self.save()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
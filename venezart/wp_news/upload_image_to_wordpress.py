@@ -1,7 +1,5 @@
-import os
-import requests
-import base64
-from dotenv import load_dotenv
+from config import load_env
+from wp_client import get_wp_client
 
 # The rest of your existing imports...
 import logging
@@ -12,18 +10,7 @@ logger = logging.getLogger(__name__)
 
 
 # Load environment variables from a .env file
-load_dotenv()
-# Headers with encoded authorization for other requests.
-# We'll update headers in the `upload_image_to_wordpress` function specifically to handle image uploads.
-
-# Environment variables loaded as previously described
-wordpress_url = os.getenv("WORDPRESS_URL")
-username = os.getenv("WORDPRESS_USERNAME")
-password = os.getenv("WORDPRESS_PASSWORD")
-
-# Prepare the credentials for Basic Auth
-auth_string = f"{username}:{password}"
-encoded_auth = base64.b64encode(auth_string.encode()).decode()
+load_env()
 
 
 def main():
@@ -37,39 +24,9 @@ def main():
 
 def upload_image_to_wordpress(image_path):
     """ Upload an image to WordPress media library """
-    url = f"{wordpress_url}/media"
-    
-    # Headers for the image upload, with Basic Auth and specific content type for the file
-    headers = {
-        "Authorization": f"Basic {encoded_auth}",
-        "Content-Disposition": f"attachment; filename={os.path.basename(image_path)}"
-    }
-
-    # Open the file in binary mode
-    try:
-        with open(image_path, 'rb') as img_file:
-            # Prepare the file for upload
-            files = {
-                'file': (os.path.basename(image_path), img_file, 'image/jpeg')
-            }
-
-            logger.info(f"Uploading image {os.path.basename(image_path)} to WordPress...")
-            
-            response = requests.post(url, headers=headers, files=files)
-            
-            # Check if the image was uploaded successfully
-            if response.status_code == 201:
-                image_id = response.json().get('id')  # Get the image ID from the response
-                image_url = response.json().get('source_url')
-                logger.info(f"Image uploaded successfully: {image_url}")
-                return image_id  # Return the image ID instead of the URL
-            else:
-                logger.error(f"Failed to upload image: {response.status_code}, {response.text}")
-    except FileNotFoundError:
-        logger.error(f"Image file not found: {image_path}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"An error occurred while uploading the image: {e}")
-
+    media = get_wp_client().upload_media(image_path)
+    if media:
+        return media.get('id')  # Return the image ID instead of the URL
     return None
 
 
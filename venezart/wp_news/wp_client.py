@@ -0,0 +1,531 @@
+import os
+import re
+import base64
+import hashlib
+import logging
+import mimetypes
+import threading
+import unicodedata
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from config import get_config
+from taxonomy_cache import TaxonomyCache
+from media_index import MediaIndex
+from wp_batch import MAX_BATCH_SIZE, WordPressBatch, with_fields
+from resilience import resilient_request
+
+# Configure logger
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# WordPress caps per_page at 100, so this is also the most slugs one lookup can resolve
+TERMS_PER_PAGE = 100
+
+# Term names and slugs are stored in 200-character columns
+MAX_TERM_LENGTH = 200
+
+# Which taxonomies may get missing terms created: "none", "categories", "tags" or "all"
+TERM_CREATE_POLICIES = ("none", "categories", "tags", "all")
+
+# The only fields the agents read back from each kind of object (sent as _fields=...). Anything
+# else (rendered content, _links, ...) WordPress would build and serialize for nothing.
+TERM_FIELDS = "id,slug"
+POST_FIELDS = "id,link"
+MEDIA_FIELDS = "id,source_url"
+
+# Ask for compressed responses (requests and httpx decompress them transparently)
+ACCEPT_ENCODING = {"Accept-Encoding": "gzip, deflate"}
+
+
+def basic_auth_header(username, password):
+    """ Authorization header for WordPress application-password Basic Auth """
+    auth_string = f"{username}:{password}"
+    encoded_auth = base64.b64encode(auth_string.encode()).decode()
+    return {"Authorization": f"Basic {encoded_auth}"}
+
+
+def is_stale_term_error(status_code, text):
+    """ True when WordPress rejected a post because of an unknown category or tag ID """
+    return status_code == 400 and ("categories" in text or "tags" in text)
+
+
+def media_headers(filename, content_type):
+    """ Headers for a raw-body upload to /media """
+    # Header values must stay ASCII; WordPress sanitizes the name again on its side anyway
+    filename = re.sub(r"[^A-Za-z0-9._-]+", "-", filename)
+    return {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Content-Type": content_type,
+    }
+
+
+def guess_content_type(filename):
+    return mimetypes.guess_type(filename)[0] or "image/jpeg"
+
+
+class ChunkReader:
+    """ File-like view over an iterator of byte chunks with a known total length.
+
+    requests sends objects like this with a Content-Length header, reading them block by block,
+    whereas a bare generator would be sent with chunked transfer encoding.
+    """
+
+    def __init__(self, chunks, length):
+        self._chunks = iter(chunks)
+        self._length = length
+        self._buffer = b""
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def split_rest_namespace(base_url):
+    """ Split ".../wp-json/wp/v2" into (".../wp-json", "/wp/v2"); the namespace is None if unrecognised """
+    match = re.match(r"^(.*)(/wp/v\d+)$", base_url)
+    if match:
+        return match.group(1), match.group(2)
+    return base_url, None
+
+
+def is_stale_media_error(status_code, text):
+    """ True when WordPress rejected a post because its featured_media no longer exists """
+    return status_code == 400 and "featured_media" in text
+
+
+class HashingIterator:
+    """ Passes byte chunks through unchanged while computing their SHA-256 """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._sha = hashlib.sha256()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = next(self._chunks)
+        self._sha.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        return self._sha.hexdigest()
+
+
+def slugify(name):
+    """ Slug WordPress would give a term name (sanitize_title): accents folded to ASCII, lowercased,
+    punctuation and entities dropped, runs of spaces, dots and dashes turned into a single dash.
+    """
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    text = re.sub(r"<[^>]*>", "", text).lower()
+    text = re.sub(r"&\S+?;", "", text)
+    text = re.sub(r"[^a-z0-9 ._-]", "", text).replace(".", "-")
+    text = re.sub(r"[\s-]+", "-", text)
+    return text[:MAX_TERM_LENGTH].strip("-")
+
+
+def new_term_body(name):
+    """ Body of a POST /categories or /tags request that creates a term for name """
+    return {"name": name[:MAX_TERM_LENGTH], "slug": slugify(name)}
+
+
+def term_creation_allowed(policy, taxonomy):
+    return policy == "all" or policy == taxonomy
+
+
+def split_cached_slugs(taxonomy_cache, taxonomy, names):
+    """ Sort term names by what the cache knows about their slugs.
+
+    Returns ({name: cached ID}, [names to look up], [names known not to exist]),
+    with each slug appearing at most once across the two lists.
+    """
+    ids_by_name = {}
+    lookup = []
+    known_missing = []
+    seen = set()
+    for name in names:
+        slug = slugify(name)
+        cached, term_id = taxonomy_cache.lookup(taxonomy, slug) if taxonomy_cache else (False, None)
+        if term_id is not None:
+            ids_by_name[name] = term_id
+        elif slug and slug not in seen:
+            seen.add(slug)
+            (known_missing if cached else lookup).append(name)
+    return ids_by_name, lookup, known_missing
+
+
+def term_lookup_params(names):
+    """ Query parameters that look up several terms by slug in one request """
+    return [("slug[]", slugify(name)) for name in names] + [("per_page", TERMS_PER_PAGE), ("_fields", TERM_FIELDS)]
+
+
+def unresolved_names(names, fetched):
+    """ Names whose slug is not among the fetched {slug: ID} pairs """
+    return [name for name in names if slugify(name) not in fetched]
+
+
+def created_term_ids(items):
+    """ {slug: ID} for term-creation BatchItems that succeeded, or that failed because the term already exists """
+    ids_by_slug = {}
+    for item in items:
+        response = item.response or {}
+        if item.ok:
+            ids_by_slug[item.body["slug"]] = response.get("id")
+        elif response.get("code") == "term_exists":
+            # Same name under a different slug; WordPress reports the existing term's ID
+            ids_by_slug[item.body["slug"]] = response.get("data", {}).get("term_id")
+    return {slug: term_id for slug, term_id in ids_by_slug.items() if term_id is not None}
+
+
+def merge_fetched_terms(taxonomy_cache, taxonomy, names, ids_by_name, fetched, looked_up):
+    """ Cache freshly fetched or created {slug: ID} pairs, remember looked-up names that are still
+    missing, and fold the new IDs into ids_by_name
+    """
+    if taxonomy_cache:
+        taxonomy_cache.set_many(taxonomy, fetched)
+        taxonomy_cache.set_missing(taxonomy, [slugify(name) for name in unresolved_names(looked_up, fetched)])
+
+    for name in names:
+        if name not in ids_by_name and slugify(name) in fetched:
+            ids_by_name[name] = fetched[slugify(name)]
+
+    if taxonomy_cache:
+        stats = taxonomy_cache.stats()
+        logger.info(
+            f"Taxonomy cache: {stats['hits']} hits, {stats['negative_hits']} known missing, "
+            f"{stats['misses']} misses, {len(looked_up)} slugs fetched"
+        )
+    return ids_by_name
+
+
+def ordered_category_ids(slugs, ids_by_slug):
+    """ Category IDs in the same order as slugs (None where not found) """
+    category_ids = []
+    for slug in slugs:
+        category_id = ids_by_slug.get(slug)
+        if category_id is not None:
+            logger.info(f"Category ID for '{slug}': {category_id}")
+        else:
+            logger.error(f"Category with slug '{slug}' not found.")
+        category_ids.append(category_id)
+    return category_ids
+
+
+def ordered_tag_ids(slugs, ids_by_slug):
+    """ Tag IDs in the same order as slugs, skipping the ones not found """
+    tag_ids = []
+    for slug in slugs:
+        tag_id = ids_by_slug.get(slug)
+        if tag_id is not None:
+            tag_ids.append(tag_id)
+            logger.info(f"Tag ID for '{slug}': {tag_id}")
+        else:
+            logger.error(f"Tag with slug '{slug}' not found.")
+    return tag_ids
+
+
+def site_key(base_url):
+    """ File-name-safe name of the site at base_url: "example.com" for https://example.com/wp-json/wp/v2 """
+    parsed = urlsplit(base_url)
+    site = parsed.netloc + parsed.path.split("/wp-json")[0]
+    return re.sub(r"[^A-Za-z0-9.-]+", "_", site).strip("_") or "default"
+
+
+def build_media_index(base_url):
+    """ Media dedup index of the site at base_url, configured from the environment; None when WP_MEDIA_DEDUP is off """
+    if os.getenv("WP_MEDIA_DEDUP", "true").lower() != "true":
+        return None
+    # Reusing a merely similar image is opt-in; by default only identical bytes are reused
+    phash_distance = os.getenv("WP_MEDIA_PHASH_DISTANCE", "")
+    return MediaIndex(
+        os.getenv("WP_MEDIA_INDEX", os.path.join("cache", f"media_index-{site_key(base_url)}.json")),
+        phash_distance=int(phash_distance) if phash_distance.isdigit() and int(phash_distance) > 0 else None,
+        site=site_key(base_url),
+    )
+
+
+def build_taxonomy_cache(base_url):
+    """ Taxonomy cache of the site at base_url configured from the environment """
+    return TaxonomyCache(
+        os.getenv("WP_TAXONOMY_CACHE", os.path.join("cache", f"wp_taxonomy-{site_key(base_url)}.json")),
+        ttl=float(os.getenv("WP_TAXONOMY_CACHE_TTL", str(7 * 24 * 3600))),
+        negative_ttl=float(os.getenv("WP_TAXONOMY_NEGATIVE_TTL", "3600")),
+        site=site_key(base_url),
+    )
+
+
+def term_create_policy():
+    """ WP_TERM_CREATE_POLICY from the environment; "none" (create no terms) when unset or unknown """
+    policy = os.getenv("WP_TERM_CREATE_POLICY", "none").lower()
+    if policy not in TERM_CREATE_POLICIES:
+        logger.warning(f"Unknown WP_TERM_CREATE_POLICY '{policy}'; not creating any terms.")
+        return "none"
+    return policy
+
+
+class WordPressClient:
+    """ WordPress REST client that sends every call through one pooled keep-alive session """
+
+    def __init__(self, base_url, username, password, pool_size=10, connect_timeout=5.0, read_timeout=60.0,
+                 taxonomy_cache=None, media_index=None, term_create_policy="none"):
+        self.base_url = (base_url or "").rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.taxonomy_cache = taxonomy_cache
+        self.media_index = media_index
+        self.term_create_policy = term_create_policy
+
+        # REST root and namespace of base_url (".../wp-json" and "/wp/v2"), needed for /batch/v1
+        self.rest_root, self.namespace = split_rest_namespace(self.base_url)
+        self.batch_url = f"{self.rest_root}/batch/v1"
+        self.batch_supported = True
+
+        self.session = requests.Session()
+        self.session.headers.update(basic_auth_header(username, password))
+        self.session.headers.update(ACCEPT_ENCODING)
+
+        # One pool per scheme; pool_block makes extra threads wait for a free connection
+        # instead of opening (and then discarding) new ones.
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, endpoint="wordpress", **kwargs):
+        return self.send(method, self.url(path), endpoint=endpoint, **kwargs)
+
+    def send(self, method, url, endpoint="wordpress", **kwargs):
+        """ Send a request through the session with retries and the host's circuit breaker.
+
+        endpoint selects the timeout (see resilience.DEFAULT_TIMEOUTS); plain "wordpress" calls use
+        the timeout this client was configured with.
+        """
+        if endpoint == "wordpress":
+            kwargs.setdefault("timeout", self.timeout)
+        return resilient_request(method, url, endpoint=endpoint, session=self.session, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def warm_up(self, background=False):
+        """ Open a connection to the host up front so the first real call skips the TCP/TLS handshake """
+        if background:
+            threading.Thread(target=self.warm_up, daemon=True).start()
+            return
+
+        try:
+            self.session.head(self.base_url, timeout=self.timeout)
+            logger.info(f"Warmed up WordPress connection to {self.base_url}")
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not pre-warm WordPress connection: {e}")
+
+    def close(self):
+        self.session.close()
+
+    def resolve_terms(self, taxonomy, names, create=None):
+        """ Map term names (or slugs) to term IDs for a taxonomy ("categories" or "tags").
+
+        Names are slugified the way WordPress does it. Cached slugs cost nothing; the rest are
+        fetched with a single multi-slug request per 100 slugs (slug[]=a&slug[]=b). Terms that do
+        not exist are created in one batch when create (by default, the client's term_create_policy)
+        allows it, and otherwise remembered as missing and left out of the result.
+        """
+        if create is None:
+            create = term_creation_allowed(self.term_create_policy, taxonomy)
+        ids_by_name, lookup, known_missing = split_cached_slugs(self.taxonomy_cache, taxonomy, names)
+
+        fetched = {}
+        looked_up = []
+        for start in range(0, len(lookup), TERMS_PER_PAGE):
+            chunk = lookup[start:start + TERMS_PER_PAGE]
+            try:
+                response = self.get(f"/{taxonomy}", params=term_lookup_params(chunk))
+            except requests.exceptions.RequestException as e:
+                logger.error(f"An error occurred while retrieving {taxonomy} {chunk}: {e}")
+                continue
+
+            if response.status_code == 200:
+                looked_up.extend(chunk)
+                for term in response.json():
+                    fetched[term["slug"]] = term["id"]
+            else:
+                logger.error(f"Failed to retrieve {taxonomy}: {response.status_code}, {response.text}")
+
+        to_create = unresolved_names(looked_up, fetched) + known_missing
+        if create and to_create:
+            fetched.update(self.create_terms(taxonomy, to_create))
+
+        return merge_fetched_terms(self.taxonomy_cache, taxonomy, names, ids_by_name, fetched, looked_up)
+
+    def create_terms(self, taxonomy, names):
+        """ Create terms in bulk and return {slug: ID} for the ones that now exist """
+        logger.info(f"Creating {len(names)} missing {taxonomy}: {names}")
+        with self.batch() as batch:
+            items = [batch.add("POST", with_fields(f"/{taxonomy}", TERM_FIELDS), new_term_body(name)) for name in names]
+        return created_term_ids(items)
+
+    def get_category_ids(self, slugs):
+        """ Get category IDs by slugs, in the same order as slugs (None where not found) """
+        return ordered_category_ids(slugs, self.resolve_terms("categories", slugs))
+
+    def get_category_id(self, slug):
+        """ Get category ID by slug """
+        return self.get_category_ids([slug])[0]
+
+    def get_tag_ids(self, slugs):
+        """ Get tag IDs by slugs """
+        return ordered_tag_ids(slugs, self.resolve_terms("tags", slugs))
+
+    def invalidate_taxonomy_cache(self, taxonomy=None, slug=None):
+        if self.taxonomy_cache:
+            self.taxonomy_cache.invalidate(taxonomy, slugify(slug) if slug else None)
+
+    def create_post(self, post_data):
+        """ Create a WordPress post and return the created post, or None on failure """
+        try:
+            response = self.post("/posts", params={"_fields": POST_FIELDS}, json=post_data)
+            if response.status_code == 201:
+                post = response.json()
+                logger.info("Post created successfully: " + post.get("link"))
+                return post
+            else:
+                logger.error(f"Failed to create post: {response.status_code}, {response.text}")
+                if is_stale_term_error(response.status_code, response.text):
+                    # A cached term ID was probably deleted on the site; look it up again next run
+                    self.invalidate_taxonomy_cache()
+                if is_stale_media_error(response.status_code, response.text) and self.media_index:
+                    self.media_index.forget(post_data.get("featured_media"))
+        except requests.exceptions.RequestException as e:
+            logger.error(f"An error occurred while creating the post: {e}")
+        return None
+
+    def batch(self, max_batch_size=MAX_BATCH_SIZE):
+        """ Start a WordPressBatch that sends queued operations through /batch/v1 """
+        return WordPressBatch(self, max_batch_size=max_batch_size)
+
+    def create_posts(self, posts_data):
+        """ Create several posts with as few requests as possible; returns the created posts (None on failure) """
+        with self.batch() as batch:
+            items = [batch.create_post(post_data, fields=POST_FIELDS) for post_data in posts_data]
+        for item in items:
+            if item.ok:
+                logger.info("Post created successfully: " + item.response.get("link"))
+        return [item.response if item.ok else None for item in items]
+
+    def find_media(self, source_url):
+        """ Media already uploaded from source_url, according to the local media index """
+        if not self.media_index:
+            return None
+        media = self.media_index.lookup_url(source_url)
+        if media:
+            logger.info(f"Reusing media {media['id']} already uploaded from {source_url}")
+        return media
+
+    def upload_media_bytes(self, data, filename, content_type="image/jpeg", content_length=None, source_url=None):
+        """ Upload image data to the WordPress media library as a raw binary body.
+
+        data can be bytes, a binary file-like object (such as a BytesIO holding an encoded PIL image)
+        or an iterator of byte chunks (such as a streamed HTTP download). File-like objects, and iterators
+        whose content_length is known, are streamed in blocks instead of being read into memory first;
+        iterators of unknown length are sent with chunked transfer encoding.
+
+        With a media index, in-memory data whose hash is already known returns the existing
+        attachment without uploading anything; streamed data is hashed on the way out and recorded.
+        """
+        hashing = None
+        if self.media_index:
+            if hasattr(data, "read"):
+                data = data.getvalue() if hasattr(data, "getvalue") else data.read()
+            if isinstance(data, (bytes, bytearray)):
+                media = self.media_index.lookup(data)
+                if media:
+                    logger.info(f"Reusing existing media {media['id']} for {filename}: {media.get('source_url')}")
+                    return media
+            else:
+                data = hashing = HashingIterator(data)
+
+        if content_length is not None and not isinstance(data, (bytes, bytearray)) and not hasattr(data, "read"):
+            data = ChunkReader(data, content_length)
+
+        try:
+            logger.info(f"Uploading image {filename} to WordPress...")
+            response = self.post("/media", endpoint="wordpress_media", params={"_fields": MEDIA_FIELDS},
+                                 headers=media_headers(filename, content_type), data=data)
+
+            if response.status_code == 201:
+                media = response.json()
+                logger.info(f"Image uploaded successfully: {media.get('source_url')}")
+                if self.media_index:
+                    if hashing:
+                        self.media_index.add(media, digest=hashing.hexdigest(), source_url=source_url)
+                    else:
+                        self.media_index.add(media, data=data, source_url=source_url)
+                return media
+            else:
+                logger.error(f"Failed to upload image: {response.status_code}, {response.text}")
+        except requests.exceptions.RequestException as e:
+            logger.error(f"An error occurred while uploading the image: {e}")
+        return None
+
+    def upload_media(self, image_path):
+        """ Upload an image file to the WordPress media library and return the media item, or None on failure """
+        if not image_path:
+            logger.error("No image path given; skipping upload.")
+            return None
+
+        filename = os.path.basename(image_path)
+        try:
+            with open(image_path, "rb") as img_file:
+                return self.upload_media_bytes(img_file, filename, guess_content_type(filename))
+        except FileNotFoundError:
+            logger.error(f"Image file not found: {image_path}")
+        return None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_wp_client():
+    """ Return the process-wide WordPress client, creating it on first use.
+
+    The connection is pre-warmed in the background, so calling this at startup lets the
+    handshake overlap with whatever the agent does before its first WordPress request.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                config = get_config()
+                client = WordPressClient(
+                    config.wordpress_url,
+                    config.wordpress_username,
+                    config.wordpress_password,
+                    pool_size=config.wp_pool_size,
+                    connect_timeout=config.wp_connect_timeout,
+                    read_timeout=config.wp_read_timeout,
+                    taxonomy_cache=build_taxonomy_cache(config.wordpress_url),
+                    media_index=build_media_index(config.wordpress_url),
+                    term_create_policy=term_create_policy(),
+                )
+                if config.wp_prewarm:
+                    client.warm_up(background=True)
+                _client = client
+    return _client